@@ -0,0 +1,92 @@
+"""Benchmark the hash based deduplication against `drop_duplicates`.
+
+The rows are generated in chunks, repeating rows far apart in the data.
+pandas deduplicates the whole frame, which is only built up to
+`PANDAS_MAX_ROWS` rows. The deduplicator is fed the chunks one by one,
+with a budget large enough to keep the hashes in memory, then with one
+that spills them to disk. Reports the time, the peak memory traced and
+the rows kept.
+
+Usage:
+    python -m benchmarks.bench_dedup [rows ...]
+"""
+
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from src.dedup import Deduplicator
+
+CHUNK_ROWS = 1_000_000
+# Larger frames don't fit in the memory of a typical runner
+PANDAS_MAX_ROWS = 20_000_000
+BUDGETS = {"in memory": 4 * 2**30, "spilling": 64 * 2**20}
+
+
+def _chunk(start: int, rows: int, distinct: int) -> pd.DataFrame:
+    """Rows derived from random ids, so repeated ids are duplicates."""
+    rng = np.random.default_rng(start)
+    ids = rng.integers(0, distinct, rows)
+    return pd.DataFrame(
+        {
+            "area": (1650 + ids % 14550).astype("float64"),
+            "bedrooms": 1 + (ids // 14550) % 6,
+            "mainroad": np.where((ids // 87300) % 2, "yes", "no"),
+            "price": ids * 10.0,
+        }
+    )
+
+
+def _chunks(rows: int):
+    # About a tenth of the rows repeat an earlier one
+    distinct = int(rows * 2.2)
+    for start in range(0, rows, CHUNK_ROWS):
+        yield _chunk(start, min(CHUNK_ROWS, rows - start), distinct)
+
+
+def _measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    kept = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return kept, elapsed, peak
+
+
+def _pandas(rows: int) -> int:
+    return len(pd.concat(_chunks(rows), ignore_index=True).drop_duplicates())
+
+
+def _deduplicator(rows: int, budget: int) -> int:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with Deduplicator(budget, tmp_dir=tmp_dir) as dedup:
+            for chunk in _chunks(rows):
+                dedup.add(chunk)
+            dedup.finish()
+            return dedup.rows - dedup.duplicates
+
+
+def main(*sizes: int):
+    for rows in sizes or (1_000_000, 10_000_000, 100_000_000):
+        runs = {}
+        if rows <= PANDAS_MAX_ROWS:
+            runs["pandas"] = lambda: _pandas(rows)
+        for name, budget in BUDGETS.items():
+            runs[name] = lambda budget=budget: _deduplicator(rows, budget)
+        for name, func in runs.items():
+            kept, elapsed, peak = _measure(func)
+            print(
+                f"{rows:>11,} rows {name:>10}: {elapsed:7.2f}s, peak "
+                f"{peak / 2**20:8.1f} MiB, {kept:,} rows kept"
+            )
+        if rows > PANDAS_MAX_ROWS:
+            print(f"{rows:>11,} rows     pandas: skipped, too large")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
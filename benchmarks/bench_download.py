@@ -0,0 +1,48 @@
+"""Benchmark single stream vs ranged downloads against a local server.
+
+Each connection is throttled to mimic a remote server.
+
+Usage:
+    python -m benchmarks.bench_download [size_mb] [num_workers] [mb_per_s]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from src.data_gathering import get_data_from_url
+from tests.http_server import serve_directory
+
+
+def main(size_mb: int = 64, num_workers: int = 8, mb_per_s: int = 16):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        served = Path(tmp_dir) / "served"
+        served.mkdir()
+        with open(served / "data.csv", "wb") as file:
+            for _ in range(size_mb):
+                file.write(os.urandom(1024 * 1024))
+        output_path = str(Path(tmp_dir) / "raw.csv")
+
+        for accept_ranges, workers in ((False, 1), (True, num_workers)):
+            with serve_directory(
+                served, accept_ranges, bandwidth=mb_per_s * 1024 * 1024
+            ) as (url, _):
+                start = time.perf_counter()
+                get_data_from_url(
+                    f"{url}/data.csv",
+                    output_path,
+                    num_workers=workers,
+                    part_size=8 * 1024 * 1024,
+                )
+                elapsed = time.perf_counter() - start
+            mode = "ranged" if accept_ranges else "single stream"
+            print(
+                f"{mode:>13}: {elapsed:6.2f}s "
+                f"({size_mb / elapsed:7.1f} MiB/s, workers={workers})"
+            )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,62 @@
+"""Benchmark `dvc add` of freshly written splits, with and without the
+digests computed while writing them.
+
+Usage:
+    python -m benchmarks.bench_dvc_add [rows]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from dvc.repo import Repo as DvcRepo
+
+from src.artefacts import write_artefact
+from src.data_push import seed_dvc_state
+
+
+def _split(rows: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "area": rng.integers(1650, 16200, rows).astype("float64"),
+            "mainroad": rng.choice(["yes", "no"], rows),
+            "price": rng.lognormal(15.3, 0.4, rows).round(),
+        }
+    )
+
+
+def main(rows: int = 2_000_000):
+    splits = {name: _split(rows, seed) for seed, name in enumerate("abc")}
+    for seeded in (False, True):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            dvc_repo = DvcRepo.init(tmp_dir, no_scm=True)
+
+            start = time.perf_counter()
+            digests = {
+                f"{name}.csv": write_artefact(split, f"{name}.csv", "csv")
+                for name, split in splits.items()
+            }
+            write_time = time.perf_counter() - start
+            size = sum(os.path.getsize(path) for path in digests) / 2**20
+
+            start = time.perf_counter()
+            with dvc_repo:
+                if seeded:
+                    seed_dvc_state(dvc_repo, digests)
+                dvc_repo.add(list(digests))
+            add_time = time.perf_counter() - start
+            mode = "seeded" if seeded else "re-hashed"
+            print(
+                f"{mode:>9}: write {write_time:5.2f}s, dvc add "
+                f"{add_time:5.2f}s ({size / add_time:7.1f} MiB/s of "
+                f"{size:.0f} MiB)"
+            )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
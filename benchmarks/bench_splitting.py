@@ -0,0 +1,74 @@
+"""Benchmark the random vs stratified splitting of the cleansed data.
+
+Reports the time, the peak memory traced and how far the label deciles
+of the test split are from the ones of the whole data.
+
+Usage:
+    python -m benchmarks.bench_splitting [rows]
+"""
+
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.data_splitting import split_data
+from src.utils import load_yaml_config
+
+
+def _housing_data(rows: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "area": rng.integers(1650, 16200, rows).astype("float64"),
+            "bedrooms": rng.integers(1, 7, rows).astype("float64"),
+            "mainroad": rng.choice(["yes", "no"], rows),
+            "furnishingstatus": rng.choice(
+                ["furnished", "semi-furnished", "unfurnished"], rows
+            ),
+            "price": rng.lognormal(15.3, 0.4, rows).round(),
+        }
+    )
+
+
+def main(rows: int = 1_000_000):
+    config = load_yaml_config()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data = _housing_data(rows)
+        deciles = np.quantile(data["price"], np.linspace(0.1, 0.9, 9))
+        data.to_csv(Path(tmp_dir) / "cleansed_data.csv", index=False)
+        del data
+        for splitter in ("random", "stratified"):
+            config["data_split"].update(
+                {
+                    "splitter": splitter,
+                    "artefact_format": "csv",
+                    "cleansed_data_save_path": f"{tmp_dir}/cleansed_data.csv",
+                    "train_data_save_path": f"{tmp_dir}/train_data.csv",
+                    "val_data_save_path": f"{tmp_dir}/val_data.csv",
+                    "test_data_save_path": f"{tmp_dir}/test_data.csv",
+                }
+            )
+            tracemalloc.start()
+            start = time.perf_counter()
+            split_data(config)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            test_prices = pd.read_csv(f"{tmp_dir}/test_data.csv")["price"]
+            test_deciles = np.quantile(test_prices, np.linspace(0.1, 0.9, 9))
+            drift = np.max(np.abs(test_deciles / deciles - 1))
+            print(
+                f"{splitter:>10}: {elapsed:6.2f}s, peak "
+                f"{peak / 2**20:7.1f} MiB, max test decile drift "
+                f"{drift:.4%}"
+            )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,84 @@
+"""Benchmark the data tag lookup on a synthetic repo with many tags.
+
+Compares sorting `repo.tags` by commit date, which reads every tagged
+commit, with the `TagIndex` read from a single for-each-ref.
+
+Usage:
+    python -m benchmarks.bench_tags [tags]
+"""
+
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from git import Repo
+
+from src.data_push import TagIndex, get_latest_tag
+
+
+def _make_repo(path: str, tags: int) -> Repo:
+    """A repo with a commit per data tag, built with git fast-import."""
+    subprocess.run(["git", "init", "-q", path], check=True)
+    stream = []
+    for i in range(tags):
+        stream += [
+            "commit refs/heads/main",
+            f"mark :{i + 1}",
+            f"committer bench <bench@example.com> {1_700_000_000 + i} +0000",
+            "data 7",
+            "version",
+        ]
+        if i:
+            stream.append(f"from :{i}")
+        stream += [
+            f"reset refs/tags/data-v1.{i}.0",
+            f"from :{i + 1}",
+            "",
+        ]
+    subprocess.run(
+        ["git", "fast-import", "--quiet"],
+        input="\n".join(stream).encode(),
+        cwd=path,
+        check=True,
+    )
+    return Repo(path)
+
+
+def _latest_tag_by_commit_date(repo: Repo) -> str:
+    """The lookup that walks every tag's commit."""
+    tags = [
+        tag
+        for tag in repo.tags
+        if re.match(r"data-v(\d+)\.(\d+)\.(\d+)", tag.name)
+    ]
+    tags = sorted(tags, key=lambda t: t.commit.committed_datetime)
+    return tags[-1].name
+
+
+def main(tags: int = 10_000):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        repo = _make_repo(tmp_dir, tags)
+
+        start = time.perf_counter()
+        by_date = _latest_tag_by_commit_date(repo)
+        # git_push then listed the tag names three more times
+        for _ in range(3):
+            assert by_date in [tag.name for tag in repo.tags]
+        by_date_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tag_index = TagIndex.from_repo(repo)
+        new_tag = get_latest_tag(repo, tag_index)["new_tag"]
+        for _ in range(3):
+            assert new_tag not in tag_index
+        index_time = time.perf_counter() - start
+
+        print(f"{tags} tags, latest {by_date}, next {new_tag}")
+        print(f"  by commit date: {by_date_time:7.3f}s")
+        print(f"  tag index:      {index_time:7.3f}s")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
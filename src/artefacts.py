@@ -0,0 +1,437 @@
+"""Read and write the tabular artefacts passed between pipeline stages.
+
+The cleansed data and the train/val/test splits can be stored as:
+    - csv: plain text, for the consumers that still need it
+    - parquet: columnar, zstd compressed
+    - arrow: Arrow IPC (feather v2) file, zstd compressed
+
+The columnar formats keep the column dtypes between stages, so they are
+not inferred again when the next stage reads the artefact.
+
+With `compression` set to gzip, bz2 or zstd, the csv artefacts are
+written compressed with that codec and take its suffix, e.g.
+`train_data.csv.gz`, while the columnar formats use it inside the file
+instead of zstd. Compressed csv artefacts are read back as a stream.
+
+With `partition_rows` set, each split is instead a directory of
+partitions of that many rows, in row order, and DVC dedupes the
+partitions whose bytes did not change. The partitions are cut by row
+count, and the gaps are imputed with the statistics of the whole data:
+a row removed, or a median that moved, rewrites the partitions from
+there on. Only the incremental ingestion, which keeps the stored
+statistics and writes a new partition per run, leaves the older
+partitions untouched when rows are appended.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+from contextlib import nullcontext
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src import compression
+
+ARTEFACT_SUFFIXES = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+COLUMNAR_COMPRESSION = "zstd"
+# Codecs the columnar formats can be compressed with
+COLUMNAR_CODECS = {"parquet": ("gzip", "zstd"), "arrow": ("zstd",)}
+# Name pandas gives to the index column of a csv written with its index
+CSV_INDEX_COL = "Unnamed: 0"
+
+
+def get_artefact_format(config: dict) -> str:
+    """Get the configured artefact format, csv by default."""
+    artefact_format = config["data_split"].get("artefact_format", "csv")
+    if artefact_format not in ARTEFACT_SUFFIXES:
+        raise ValueError(f"Unknown artefact format: {artefact_format}")
+    return artefact_format
+
+
+def get_compression(config: dict) -> dict:
+    """Get the configured codec and level of the artefacts.
+
+    Returns:
+        dict: The `codec`, None for plain csv and zstd columnar artefacts,
+            and the `level`, None for the default level of the codec
+    """
+    codec = compression.check_codec(config["data_split"].get("compression"))
+    artefact_format = get_artefact_format(config)
+    if codec and artefact_format in COLUMNAR_CODECS:
+        if codec not in COLUMNAR_CODECS[artefact_format]:
+            raise ValueError(
+                f"The {artefact_format} format can't be compressed with "
+                f"{codec}"
+            )
+    return {
+        "codec": codec,
+        "level": config["data_split"].get("compression_level"),
+    }
+
+
+def artefact_suffix(artefact_format: str, codec: str | None = None) -> str:
+    """Suffix of an artefact, with the one of its codec for csv."""
+    suffix = ARTEFACT_SUFFIXES[artefact_format]
+    if codec and artefact_format == "csv":
+        suffix += compression.CODECS[codec]
+    return suffix
+
+
+def artefact_path(
+    path: str, artefact_format: str, codec: str | None = None
+) -> str:
+    """Path of an artefact with the suffix of its format and codec."""
+    return str(Path(path).with_suffix(artefact_suffix(artefact_format, codec)))
+
+
+def get_split_paths(config: dict) -> dict:
+    """Get the train, val and test data paths in the configured format."""
+    artefact_format = get_artefact_format(config)
+    codec = get_compression(config)["codec"]
+    return {
+        split: artefact_path(
+            config["data_split"][f"{split}_data_save_path"],
+            artefact_format,
+            codec,
+        )
+        for split in ("train", "val", "test")
+    }
+
+
+def partition_dir(path: str) -> str:
+    """Directory holding the partitions of a split artefact."""
+    return str(Path(compression.strip_suffix(path)).with_suffix(""))
+
+
+def get_split_dirs(config: dict) -> dict:
+    """Get the train, val and test partition directories."""
+    return {
+        split: partition_dir(path)
+        for split, path in get_split_paths(config).items()
+    }
+
+
+def get_partition_rows(config: dict) -> int:
+    """Rows of each split partition, 0 to write each split as one file."""
+    return config["data_split"].get("partition_rows") or 0
+
+
+def get_split_outputs(config: dict) -> list:
+    """The split files, or their partition directories if partitioned."""
+    if get_partition_rows(config):
+        return list(get_split_dirs(config).values())
+    return list(get_split_paths(config).values())
+
+
+def open_split_writer(config: dict, path: str):
+    """Writer of a split artefact, partitioned if configured."""
+    artefact_format = get_artefact_format(config)
+    partition_rows = get_partition_rows(config)
+    codec = get_compression(config)
+    if partition_rows:
+        return PartitionedWriter(
+            partition_dir(path), artefact_format, partition_rows, **codec
+        )
+    return ArtefactWriter(path, artefact_format, **codec)
+
+
+def get_digests_path(config: dict) -> str:
+    """Get the path of the digests of the artefacts written."""
+    return config["data_split"].get(
+        "digests_path", "./artefacts/artefact_digests.json"
+    )
+
+
+def get_imputation_stats_path(config: dict) -> str:
+    """Get the path of the imputation statistics of the cleansed data."""
+    return config["data_split"].get(
+        "imputation_stats_path", "./artefacts/imputation_stats.json"
+    )
+
+
+def load_digests(config: dict) -> dict:
+    """Load the digests of the artefacts written, by artefact path."""
+    digests_path = get_digests_path(config)
+    if not os.path.exists(digests_path):
+        return {}
+    with open(digests_path, "r") as digests_file:
+        return json.load(digests_file)
+
+
+def save_digests(config: dict, digests: dict) -> None:
+    """Record the digests of artefacts, along with the ones recorded."""
+    recorded = load_digests(config)
+    recorded.update(
+        {os.path.normpath(path): digest for path, digest in digests.items()}
+    )
+    digests_path = get_digests_path(config)
+    os.makedirs(os.path.dirname(digests_path) or ".", exist_ok=True)
+    with open(digests_path, "w") as digests_file:
+        json.dump(recorded, digests_file, indent=2)
+
+
+def _open_csv(path: str):
+    """The csv file, or its decompressed stream if it has a codec suffix."""
+    codec = compression.codec_from_suffix(path)
+    if codec is None:
+        return nullcontext(path)
+    return compression.open_reader(path, codec)
+
+
+def read_artefact(path: str, artefact_format: str) -> pd.DataFrame:
+    """Read an artefact into a dataframe."""
+    if artefact_format == "csv":
+        with _open_csv(path) as source:
+            return pd.read_csv(source)
+    if artefact_format == "parquet":
+        return pd.read_parquet(path)
+    return pd.read_feather(path)
+
+
+def iter_artefact(path: str, artefact_format: str, chunk_rows: int):
+    """Read an artefact as dataframes of at most `chunk_rows` rows."""
+    if artefact_format == "csv":
+        with _open_csv(path) as source:
+            yield from pd.read_csv(source, chunksize=chunk_rows)
+    elif artefact_format == "parquet":
+        for batch in pq.ParquetFile(path).iter_batches(chunk_rows):
+            yield batch.to_pandas()
+    else:
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                table = pa.Table.from_batches([reader.get_batch(i)])
+                for batch in table.to_batches(chunk_rows):
+                    yield batch.to_pandas()
+
+
+def write_artefact(
+    df: pd.DataFrame,
+    path: str,
+    artefact_format: str,
+    index: bool = False,
+    codec: str | None = None,
+    level: int | None = None,
+) -> dict:
+    """Write a dataframe artefact in one go, returns its digest."""
+    with ArtefactWriter(
+        path, artefact_format, index=index, codec=codec, level=level
+    ) as writer:
+        writer.write(df)
+    return writer.digest
+
+
+class _HashingFile(io.RawIOBase):
+    """Binary file that computes the md5 of the bytes written to it."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "wb")
+        self.md5 = hashlib.md5()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.md5.update(data)
+        return self._file.write(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+class ArtefactWriter:
+    """Write a dataframe artefact chunk by chunk.
+
+    With `index=True` the index is kept: as the first csv column, or as a
+    `CSV_INDEX_COL` column in the columnar formats, so that every format
+    reads back with the same columns.
+
+    The md5 of the bytes is computed while they are written, and is the
+    `digest` of the artefact once closed, so the artefact doesn't have to
+    be read back to be hashed by DVC.
+
+    With a `codec`, csv is compressed as it is written, and the columnar
+    formats are compressed with it instead of zstd, at the `level` of
+    the codec.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        artefact_format: str,
+        index: bool = False,
+        codec: str | None = None,
+        level: int | None = None,
+    ):
+        self.path = path
+        self.artefact_format = artefact_format
+        self.index = index
+        self.codec = codec
+        self.level = level
+        self.digest = None
+        self._file = _HashingFile(path)
+        self._text = None
+        self._writer = None
+        self._schema = None
+        self._chunks = 0
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Append a chunk of rows to the artefact."""
+        if self.artefact_format == "csv":
+            if self._text is None:
+                if self.codec:
+                    binary = compression.open_writer(
+                        self._file, self.codec, self.level
+                    )
+                else:
+                    binary = io.BufferedWriter(self._file)
+                # Same encoding and line endings as `to_csv` to a path
+                self._text = io.TextIOWrapper(
+                    binary, encoding="utf-8", newline=""
+                )
+            df.to_csv(self._text, index=self.index, header=self._chunks == 0)
+        else:
+            self._write_columnar(df)
+        self._chunks += 1
+        self.rows += len(df)
+
+    def _write_columnar(self, df: pd.DataFrame) -> None:
+        if self.index:
+            df = df.reset_index(names=CSV_INDEX_COL)
+        if self._schema is None:
+            schema = pa.Schema.from_pandas(df, preserve_index=False)
+            # Columns missing from the whole first chunk are strings in csv
+            self._schema = pa.schema(
+                (
+                    field.with_type(pa.string())
+                    if pa.types.is_null(field.type)
+                    else field
+                )
+                for field in schema
+            ).with_metadata(schema.metadata)
+        table = pa.Table.from_pandas(
+            df, schema=self._schema, preserve_index=False
+        )
+        if self._writer is None:
+            if self.artefact_format == "parquet":
+                self._writer = pq.ParquetWriter(
+                    self._file,
+                    self._schema,
+                    compression=self.codec or COLUMNAR_COMPRESSION,
+                    compression_level=self.level,
+                )
+            else:
+                self._writer = pa.ipc.new_file(
+                    self._file,
+                    self._schema,
+                    options=pa.ipc.IpcWriteOptions(
+                        compression=pa.Codec(
+                            self.codec or COLUMNAR_COMPRESSION, self.level
+                        )
+                    ),
+                )
+        self._writer.write_table(table)
+
+    @property
+    def digests(self) -> dict:
+        """The digest of the artefact by path, once closed."""
+        return {self.path: self.digest}
+
+    def close(self) -> None:
+        """Finish writing the artefact."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._text is not None:
+            self._text.close()
+            self._text = None
+        self._file.close()
+        if self.digest is None:
+            stat = os.stat(self.path)
+            self.digest = {
+                "md5": self._file.md5.hexdigest(),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            }
+
+
+class PartitionedWriter:
+    """Write a dataframe artefact as a directory of fixed size partitions.
+
+    The rows are written in order to `part-00000`, `part-00001`, ... of
+    `partition_rows` rows each. A partition is written in one go once
+    full, so its bytes only depend on its rows and not on how they were
+    chunked. The partitions of a previous artefact are removed.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        artefact_format: str,
+        partition_rows: int,
+        codec: str | None = None,
+        level: int | None = None,
+    ):
+        self.path = directory
+        self.artefact_format = artefact_format
+        self.partition_rows = partition_rows
+        self.codec = codec
+        self.level = level
+        self.digests = {}
+        self.rows = 0
+        self._buffer = []
+        self._buffered = 0
+        self._empty = None
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Append a chunk of rows to the artefact."""
+        self._empty = df.iloc[:0]
+        while len(df):
+            take = self.partition_rows - self._buffered
+            self._buffer.append(df.iloc[:take])
+            self._buffered += len(self._buffer[-1])
+            self.rows += len(self._buffer[-1])
+            df = df.iloc[take:]
+            if self._buffered == self.partition_rows:
+                self._flush()
+
+    def _flush(self) -> None:
+        suffix = artefact_suffix(self.artefact_format, self.codec)
+        path = os.path.join(self.path, f"part-{len(self.digests):05d}{suffix}")
+        data = pd.concat(self._buffer) if self._buffer else self._empty
+        self.digests[path] = write_artefact(
+            data,
+            path,
+            self.artefact_format,
+            codec=self.codec,
+            level=self.level,
+        )
+        self._buffer = []
+        self._buffered = 0
+
+    def close(self) -> None:
+        """Write the last partition, even without rows if it's the only one."""
+        if self._buffered or (not self.digests and self._empty is not None):
+            self._flush()
@@ -0,0 +1,148 @@
+"""Compressed files, read and written as streams.
+
+Supported codecs, each with the file suffix it is known by:
+    - gzip (.gz) and bz2 (.bz2), from the standard library
+    - zstd (.zst), with the zstd codec of pyarrow
+
+The data is compressed and decompressed chunk by chunk, so memory does
+not depend on the size of the file. A compressed file is recognised by
+its magic bytes, or by its suffix when it can't be read ahead.
+"""
+
+import bz2
+import gzip
+import io
+
+import pyarrow as pa
+
+CODECS = {"gzip": ".gz", "bz2": ".bz2", "zstd": ".zst"}
+MAGIC_BYTES = {
+    # With the deflate method, the only one in use
+    b"\x1f\x8b\x08": "gzip",
+    b"BZh": "bz2",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+COPY_CHUNK_SIZE = 1024 * 1024
+# Uncompressed bytes of each zstd frame written
+ZSTD_FRAME_SIZE = 4 * 1024 * 1024
+
+
+def check_codec(codec: str | None) -> str | None:
+    """Check that the codec is supported, None for no compression."""
+    if codec and codec not in CODECS:
+        raise ValueError(f"Unknown compression codec: {codec}")
+    return codec or None
+
+
+def codec_from_suffix(path: str) -> str | None:
+    """Codec of a file from its suffix, None if it has none of them."""
+    for codec, suffix in CODECS.items():
+        if str(path).endswith(suffix):
+            return codec
+    return None
+
+
+def strip_suffix(path: str) -> str:
+    """Path without the suffix of its codec."""
+    codec = codec_from_suffix(path)
+    return str(path)[: -len(CODECS[codec])] if codec else str(path)
+
+
+def detect_codec(head: bytes) -> str | None:
+    """Codec of a file from its first bytes, None if not compressed."""
+    for magic, codec in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def sniff_codec(path: str) -> str | None:
+    """Codec of a file from its magic bytes."""
+    with open(path, "rb") as file:
+        return detect_codec(file.read(4))
+
+
+class _ZstdWriter(io.RawIOBase):
+    """Write zstd frames of `ZSTD_FRAME_SIZE` bytes to a binary file.
+
+    The pyarrow zstd stream can't be given a level, but a zstd file can
+    be a sequence of frames, each one compressed at the level.
+    """
+
+    def __init__(self, file, level: int | None):
+        self._file = file
+        self._codec = pa.Codec("zstd", level)
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= ZSTD_FRAME_SIZE:
+            self._write_frame()
+        return len(data)
+
+    def _write_frame(self) -> None:
+        self._file.write(self._codec.compress(self._buffer, asbytes=True))
+        self._buffer = bytearray()
+
+    def close(self) -> None:
+        if not self.closed and self._buffer:
+            self._write_frame()
+        super().close()
+
+
+def open_writer(file, codec: str, level: int | None = None):
+    """Binary stream that writes compressed to the binary `file`.
+
+    Closing the stream ends the compressed data, but leaves `file` open.
+    """
+    if codec == "gzip":
+        # No timestamp in the header, so the same data has the same bytes
+        return gzip.GzipFile(
+            fileobj=file,
+            mode="wb",
+            compresslevel=9 if level is None else level,
+            mtime=0,
+        )
+    if codec == "bz2":
+        return bz2.BZ2File(
+            file, "wb", compresslevel=9 if level is None else level
+        )
+    return io.BufferedWriter(_ZstdWriter(file, level))
+
+
+def open_reader(file, codec: str):
+    """Binary stream of the decompressed data of a path or binary file."""
+    if codec == "gzip":
+        return gzip.open(file, "rb")
+    if codec == "bz2":
+        return bz2.open(file, "rb")
+    if isinstance(file, (str, bytes)) or hasattr(file, "__fspath__"):
+        source = pa.OSFile(str(file), "rb")
+    else:
+        source = pa.PythonFile(file, mode="r")
+    return io.BufferedReader(pa.CompressedInputStream(source, "zstd"))
+
+
+def open_decompressed(file):
+    """Binary stream of a seekable binary file, decompressed if needed.
+
+    The codec is detected from the magic bytes at the start of the file.
+    """
+    codec = detect_codec(file.read(4))
+    file.seek(0)
+    if codec is None:
+        return file
+    return open_reader(file, codec)
+
+
+def decompress_file(path: str, output_path: str, codec: str) -> int:
+    """Decompress a file chunk by chunk, returns the bytes written."""
+    size = 0
+    with open_reader(path, codec) as source, open(output_path, "wb") as out:
+        while chunk := source.read(COPY_CHUNK_SIZE):
+            out.write(chunk)
+            size += len(chunk)
+    return size
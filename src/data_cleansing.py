@@ -1,20 +1,133 @@
+import io
+import math
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
-from sklearn.impute import SimpleImputer
 
-from src import utils
+from src import artefacts, compression, dedup, metrics, utils
+from src.imputation_stats import DEFAULT_MAX_DISTINCT, ImputationStats, impute
+
+# Rows sampled to estimate the in-memory size of a row
+SAMPLE_ROWS = 1000
+# Copies of a chunk alive at once while it's cleansed and written
+CHUNK_COPIES = 4
+MODES = ("in_memory", "streaming", "parallel")
+# Largest byte range of the raw file cleansed by a worker at once
+PARTITION_BYTES = 64 * 1024 * 1024
+# Memory for the row hashes of the deduplication before they are spilled
+DEFAULT_DEDUP_MEMORY_MB = 256
+
+
+def clean_data(
+    config: dict,
+    data: pd.DataFrame | None = None,
+    save: bool = True,
+    stats: ImputationStats | None = None,
+) -> pd.DataFrame | None:
+    """Cleanses the data as a preprocessing step.
+
+    The statistics the gaps are imputed with are always written to the
+    imputation statistics sidecar, versioned with the splits.
+
+    Args:
+        config (dict): The data ingestion config
+        data (pd.DataFrame): The raw data, read from the raw data file
+            if None
+        save (bool): Whether to write the cleansed data artefact
+        stats (ImputationStats): Statistics of data cleansed before,
+            updated with the ones of this data to impute it
+
+    Returns:
+        pd.DataFrame: The cleansed data, with the same columns as when it
+            is read back from the artefact. None in the streaming and
+            parallel modes, where the data is always written to the
+            artefact instead.
+    """
+    cleansing_config = config.get("data_cleansing", {})
+    mode = cleansing_config.get("mode", "in_memory")
+    if mode not in MODES:
+        raise ValueError(f"Unknown data cleansing mode: {mode}")
+    # Data handed over in memory is already loaded, no need to stream it
+    if data is not None:
+        mode = "in_memory"
+    # The medians are exact, but in the streaming mode that bounds their
+    # memory
+    new_stats = ImputationStats(
+        config["data_split"]["numeric_cols"],
+        config["data_split"]["categorical_cols"],
+        max_distinct=DEFAULT_MAX_DISTINCT if mode == "streaming" else None,
+    )
+    if stats is not None:
+        new_stats.merge(stats)
+    df = None
+    if mode == "in_memory":
+        df = _clean_data_in_memory(config, data, save, new_stats)
+    elif mode == "streaming":
+        _clean_data_streaming(
+            config, cleansing_config.get("memory_budget_mb", 512), new_stats
+        )
+    else:
+        _clean_data_parallel(
+            config,
+            cleansing_config.get("num_workers") or os.cpu_count(),
+            new_stats,
+        )
+    stats_path = artefacts.get_imputation_stats_path(config)
+    new_stats.save(stats_path)
+    utils.logger.info("Data cleansing completed.")
+    utils.logger.info(f"Imputation statistics saved to {stats_path}")
+    if save or df is None:
+        utils.logger.info(
+            f"Cleaned data saved to {get_cleansed_data_path(config)}"
+        )
+    return df
+
+
+def get_cleansed_data_path(config: dict) -> str:
+    """Get the cleansed data path in the configured artefact format."""
+    return artefacts.artefact_path(
+        config["data_split"]["cleansed_data_save_path"],
+        artefacts.get_artefact_format(config),
+        artefacts.get_compression(config)["codec"],
+    )
 
 
-def clean_data(config: dict) -> None:
-    """Cleanses the data as a preprocessing step."""
-    df = pd.read_csv(config["data_split"]["raw_data_save_path"])
+def _dedup_options(config: dict) -> dict:
+    """Memory budget of the deduplication, spilling next to the output."""
+    memory_mb = config.get("data_cleansing", {}).get(
+        "dedup_memory_mb", DEFAULT_DEDUP_MEMORY_MB
+    )
+    output_path = os.path.abspath(get_cleansed_data_path(config))
+    return {
+        "memory_budget_bytes": int(memory_mb * 1024 * 1024),
+        "tmp_dir": os.path.dirname(output_path),
+    }
+
 
+def _clean_data_in_memory(
+    config: dict,
+    df: pd.DataFrame | None,
+    save: bool,
+    stats: ImputationStats,
+) -> pd.DataFrame:
+    """Cleanse the data loaded as a single dataframe."""
     # Define column names
     label_col = config["data_split"]["label_col"]
     categorical_cols = config["data_split"]["categorical_cols"]
-    numeric_cols = config["data_split"]["numeric_cols"]
 
-    # 1. Remove duplicates
-    df.drop_duplicates(inplace=True)
+    if df is None:
+        df = pd.read_csv(
+            config["data_split"]["raw_data_save_path"],
+            **_read_options(categorical_cols),
+        )
+    metrics.record(rows_in=len(df))
+
+    # 1. Remove duplicates, found from compact row hashes
+    df = dedup.drop_duplicates(df, **_dedup_options(config))
 
     # 2. Remove rows where label column has missing values
     df = df.dropna(subset=[label_col])
@@ -22,27 +135,373 @@ def clean_data(config: dict) -> None:
     # 3. Ensure consistency in data representation
     # by standardize categorical values
     # (e.g., 'Yes' and 'No' instead of 'yes', 'Yes', 'no', 'No')
-    for col in categorical_cols:
-        df[col] = df[col].str.lower().str.strip()
+    _normalise_categoricals(df, categorical_cols)
 
-    # 4. Impute missing values for numerical columns with the median
-    numeric_imputer = SimpleImputer(strategy="median")
-    df[numeric_cols] = numeric_imputer.fit_transform(df[numeric_cols])
+    # 4. Impute missing values for numerical columns with the median,
+    # and for categorical columns with the most frequent value, counted
+    # from the category codes
+    stats.update(df)
+    impute(df, *_imputation_values(stats))
 
-    # 5. Impute missing values for categorical columns
-    # with the most frequent value
-    categorical_imputer = SimpleImputer(strategy="most_frequent")
-    df[categorical_cols] = categorical_imputer.fit_transform(
-        df[categorical_cols]
-    )
+    # 5. Save the cleansed data
+    if save:
+        artefacts.write_artefact(
+            df,
+            get_cleansed_data_path(config),
+            artefacts.get_artefact_format(config),
+            index=True,
+            **artefacts.get_compression(config),
+        )
+    metrics.record(rows_out=len(df))
+    return df.reset_index(names=artefacts.CSV_INDEX_COL)
 
-    # 6. Save the cleansed data
-    df.to_csv(config["data_split"]["cleansed_data_save_path"])
-    utils.logger.info("Data cleansing completed.")
+
+def _chunk_rows(path: str, memory_budget_mb: float, read_options) -> int:
+    """Number of rows per chunk that keeps a chunk within the budget."""
+    sample = pd.read_csv(path, nrows=SAMPLE_ROWS, **read_options)
+    if sample.empty:
+        return SAMPLE_ROWS
+    row_bytes = sample.memory_usage(deep=True).sum() / len(sample)
+    budget_bytes = memory_budget_mb * 1024 * 1024
+    return max(1, int(budget_bytes / (row_bytes * CHUNK_COPIES)))
+
+
+def _clean_data_streaming(
+    config: dict, memory_budget_mb: float, stats: ImputationStats
+) -> None:
+    """Cleanse the data in chunks with bounded memory.
+
+    The first pass finds the duplicated rows from their hashes, the
+    second one builds the imputation statistics of the rows kept, and the
+    third one cleanses each chunk and appends it to the output. The
+    output is the same as the in-memory cleansing, except for numeric
+    medians which become approximate on columns with a very large number
+    of distinct values.
+
+    Memory is bounded by the chunk size derived from `memory_budget_mb`,
+    plus the row hashes up to `dedup_memory_mb`, spilled to disk past
+    that, and 1 bit per input row for the rows kept.
+    """
+    raw_path = config["data_split"]["raw_data_save_path"]
+    read_options = _read_options(config["data_split"]["categorical_cols"])
+    chunk_rows = _chunk_rows(raw_path, memory_budget_mb, read_options)
+    utils.logger.info(f"Streaming data cleansing with {chunk_rows} row chunks")
+
+    with dedup.Deduplicator(**_dedup_options(config)) as deduplicator:
+        # 1. First pass: find the duplicates
+        chunk_dtypes = []
+        for chunk in pd.read_csv(
+            raw_path, chunksize=chunk_rows, **read_options
+        ):
+            chunk_dtypes.append(chunk.dtypes)
+            deduplicator.add(chunk)
+        deduplicator.finish()
+
+    # 2. Second pass: compute the imputation statistics of the rows kept
+    chunks = pd.read_csv(raw_path, chunksize=chunk_rows, **read_options)
+    for chunk, keep in zip(chunks, deduplicator.keep_masks()):
+        _update_stats(config, chunk[keep], stats)
+
+    # Columns parsed differently across chunks get the type pandas would
+    # have inferred from the whole file
+    dtypes = _common_dtypes(chunk_dtypes)
+    medians, modes = _imputation_values(stats)
+
+    # 3. Third pass: cleanse and write the chunks
+    chunks = pd.read_csv(raw_path, chunksize=chunk_rows, **read_options)
+    with artefacts.ArtefactWriter(
+        get_cleansed_data_path(config),
+        artefacts.get_artefact_format(config),
+        index=True,
+        **artefacts.get_compression(config),
+    ) as writer:
+        for chunk, keep in zip(chunks, deduplicator.keep_masks()):
+            writer.write(
+                _cleanse_chunk(config, chunk, keep, dtypes, medians, modes)
+            )
+    metrics.record(rows_in=deduplicator.rows, rows_out=writer.rows)
+
+
+def _update_stats(
+    config: dict, chunk: pd.DataFrame, stats: ImputationStats
+) -> None:
+    """Add the deduplicated rows of a chunk to the imputation statistics."""
+    chunk = chunk.dropna(subset=[config["data_split"]["label_col"]])
+    _normalise_categoricals(chunk, config["data_split"]["categorical_cols"])
+    stats.update(chunk)
+
+
+def _imputation_values(stats: ImputationStats) -> tuple[dict, dict]:
+    """The medians and most frequent values to impute the gaps with."""
+    medians, modes = stats.medians(), stats.modes()
+    for col, sketch in stats.numeric.items():
+        if not sketch.exact:
+            utils.logger.warning(
+                f"Median of {col} approximated to {sketch.digits} "
+                f"significant digits"
+            )
+    return medians, modes
+
+
+def _cleanse_chunk(
+    config: dict,
+    chunk: pd.DataFrame,
+    keep: np.ndarray,
+    dtypes: dict,
+    medians: dict,
+    modes: dict,
+) -> pd.DataFrame:
+    """Cleanse a chunk with the statistics of the whole data."""
+    label_col = config["data_split"]["label_col"]
+    categorical_cols = config["data_split"]["categorical_cols"]
+    # The categories of each chunk are normalised on their own
+    dtypes = {
+        col: dtype
+        for col, dtype in dtypes.items()
+        if col not in categorical_cols
+    }
+    chunk = chunk.astype(dtypes)[keep].dropna(subset=[label_col])
+    _normalise_categoricals(chunk, categorical_cols)
+    return impute(chunk, medians, modes)
+
+
+def _clean_data_parallel(
+    config: dict, num_workers: int, stats: ImputationStats
+) -> None:
+    """Cleanse line aligned byte ranges of the raw file in processes.
+
+    Same three steps as the streaming mode, each one run over the
+    partitions in a process pool:
+        1. hash the rows, the duplicates are found in the main process
+        2. build the statistics of the rows kept, merged exactly
+        3. cleanse the partitions, written in order to the output
+
+    The raw file must not have line breaks within quoted values.
+    """
+    raw_path = config["data_split"]["raw_data_save_path"]
+    categorical_cols = config["data_split"]["categorical_cols"]
+    read_options = _read_options(categorical_cols)
+    partitions = _partition_offsets(
+        raw_path,
+        max(
+            num_workers, math.ceil(os.path.getsize(raw_path) / PARTITION_BYTES)
+        ),
+    )
     utils.logger.info(
-        f"Cleaned data saved to "
-        f'{config["data_split"]["cleansed_data_save_path"]}'
+        f"Parallel data cleansing of {len(partitions)} partitions with "
+        f"{num_workers} workers"
+    )
+    tasks = [(raw_path, start, end, read_options) for start, end in partitions]
+    artefact_format = artefacts.get_artefact_format(config)
+    output_path = get_cleansed_data_path(config)
+
+    with ProcessPoolExecutor(num_workers) as executor:
+        # 1. Deduplicate from the hashes of all the rows, in file order
+        chunk_dtypes = []
+        with dedup.Deduplicator(**_dedup_options(config)) as deduplicator:
+            for hashes, partition_dtypes in executor.map(
+                _scan_partition, *zip(*tasks)
+            ):
+                deduplicator.add_hashes(hashes)
+                chunk_dtypes.append(partition_dtypes)
+            deduplicator.finish()
+        keep_masks = list(deduplicator.keep_masks())
+        bounds = np.cumsum([0] + [len(keep) for keep in keep_masks])
+        dtypes = _common_dtypes(chunk_dtypes)
+
+        # 2. Exact statistics, merged from the partial ones
+        for partial_stats in executor.map(
+            _partition_stats,
+            *zip(*tasks),
+            keep_masks,
+            [config] * len(tasks),
+        ):
+            stats.merge(partial_stats)
+        medians, modes = _imputation_values(stats)
+
+        # 3. Cleanse the partitions, then write them in order
+        with tempfile.TemporaryDirectory(
+            dir=os.path.dirname(os.path.abspath(output_path))
+        ) as tmp_dir:
+            part_paths = [
+                os.path.join(tmp_dir, f"part-{i:05d}")
+                for i in range(len(tasks))
+            ]
+            rows_out = sum(
+                executor.map(
+                    _cleanse_partition,
+                    *zip(*tasks),
+                    keep_masks,
+                    bounds[:-1],
+                    [config] * len(tasks),
+                    [(dtypes, medians, modes)] * len(tasks),
+                    part_paths,
+                )
+            )
+            _concat_partitions(
+                part_paths,
+                output_path,
+                artefact_format,
+                artefacts.get_compression(config),
+            )
+    metrics.record(rows_in=deduplicator.rows, rows_out=rows_out)
+
+
+def _partition_offsets(path: str, partitions: int) -> list:
+    """Split the rows of a csv file in byte ranges starting on a line."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        file.readline()
+        offsets = [file.tell()]
+        for i in range(1, partitions):
+            position = max(offsets[-1], size * i // partitions)
+            # Move to the start of the line following the position
+            file.seek(position - 1)
+            file.readline()
+            offsets.append(min(file.tell(), size))
+    offsets.append(size)
+    return [
+        (start, end) for start, end in zip(offsets, offsets[1:]) if end > start
+    ]
+
+
+def _read_partition(
+    path: str, start: int, end: int, read_options: dict
+) -> pd.DataFrame:
+    """Read the rows of a byte range of a csv file."""
+    header = pd.read_csv(path, nrows=0).columns
+    with open(path, "rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+    if not data.strip():
+        return pd.read_csv(path, nrows=0, **read_options)
+    return pd.read_csv(
+        io.BytesIO(data), header=None, names=header, **read_options
+    )
+
+
+def _scan_partition(
+    path: str, start: int, end: int, read_options: dict
+) -> tuple[np.ndarray, pd.Series]:
+    """128 bit hashes of the rows of a partition, and their dtypes."""
+    partition = _read_partition(path, start, end, read_options)
+    return utils.row_hashes128(partition), partition.dtypes
+
+
+def _partition_stats(
+    path: str,
+    start: int,
+    end: int,
+    read_options: dict,
+    keep: np.ndarray,
+    config: dict,
+) -> ImputationStats:
+    """Imputation statistics of the rows kept in a partition."""
+    stats = ImputationStats(
+        config["data_split"]["numeric_cols"],
+        config["data_split"]["categorical_cols"],
+        max_distinct=None,
     )
+    partition = _read_partition(path, start, end, read_options)
+    _update_stats(config, partition[keep], stats)
+    return stats
+
+
+def _cleanse_partition(
+    path: str,
+    start: int,
+    end: int,
+    read_options: dict,
+    keep: np.ndarray,
+    first_row: int,
+    config: dict,
+    statistics: tuple,
+    part_path: str,
+) -> int:
+    """Cleanse a partition into a file of the configured format.
+
+    Returns:
+        int: The number of cleansed rows written
+    """
+    partition = _read_partition(path, start, end, read_options)
+    # Rows indexed by their position in the raw file
+    partition.index = pd.RangeIndex(first_row, first_row + len(partition))
+    cleansed = _cleanse_chunk(config, partition, keep, *statistics)
+    artefacts.write_artefact(
+        cleansed,
+        part_path,
+        artefacts.get_artefact_format(config),
+        index=True,
+    )
+    return len(cleansed)
+
+
+def _concat_partitions(
+    part_paths: list, output_path: str, artefact_format: str, codec: dict
+) -> None:
+    """Write the cleansed partitions one after the other to the output.
+
+    The partitions are not compressed, the output is with the `codec`.
+    """
+    if artefact_format == "csv":
+        with open(output_path, "wb") as file:
+            output = file
+            if codec["codec"]:
+                output = compression.open_writer(file, **codec)
+            with output:
+                for i, part_path in enumerate(part_paths):
+                    with open(part_path, "rb") as part:
+                        # Only the header of the first partition is kept
+                        if i > 0:
+                            part.readline()
+                        shutil.copyfileobj(part, output)
+        return
+    with artefacts.ArtefactWriter(
+        output_path, artefact_format, **codec
+    ) as writer:
+        for part_path in part_paths:
+            writer.write(artefacts.read_artefact(part_path, artefact_format))
+
+
+def _common_dtypes(chunk_dtypes: list) -> dict:
+    """Dtype of each column that holds the values of all the chunks."""
+    return {
+        col: _common_dtype(dtypes[col] for dtypes in chunk_dtypes)
+        for col in chunk_dtypes[0].index
+    }
+
+
+def _common_dtype(dtypes) -> np.dtype:
+    """Smallest dtype that can hold the values of all the given dtypes."""
+    dtypes = list(dtypes)
+    if all(pd.api.types.is_numeric_dtype(dtype) for dtype in dtypes):
+        return np.result_type(*dtypes)
+    return np.dtype("object")
+
+
+def _read_options(categorical_cols: list) -> dict:
+    """Read the categorical columns as categories, even if all missing."""
+    return {"dtype": {col: "category" for col in categorical_cols}}
+
+
+def _normalise_categoricals(df: pd.DataFrame, categorical_cols: list):
+    """Lower case and strip the categorical values in place.
+
+    The values are normalised once per distinct value, on the categories,
+    and the rows are remapped from their category codes. The columns are
+    left with the category dtype.
+    """
+    for col in categorical_cols:
+        values = df[col].astype("category")
+        normalised = values.cat.categories.astype("str").str.lower()
+        normalised = normalised.str.strip()
+        categories = normalised.unique()
+        # Lookup table from the old category codes to the new ones, the
+        # missing values' code -1 picks the trailing -1
+        lookup = np.append(categories.get_indexer(normalised), -1)
+        df[col] = pd.Categorical.from_codes(
+            lookup[values.cat.codes.to_numpy()], categories
+        )
 
 
 if __name__ == "__main__":
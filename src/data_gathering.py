@@ -6,41 +6,698 @@ This module should:
     - combine them into a single dataset
     - save the data locally for the rest of the data ingestion and
         versioning pipeline can work
+
+The sources listed in `data_sources` are fetched concurrently, each one
+to its own csv file, then merged into the raw data file. A source is one
+of:
+    - http: a file downloaded from `url`
+    - file: a local or network mounted file at `path`
+    - sql: the rows of `query` on a SQLite or Postgres database, see
+        `db_source`
+    - objects: the csv objects under an fsspec `url`, e.g. an s3 prefix
+Without `data_sources`, `data_url` is the only source.
+
+Compressed sources (gzip, bz2 or zstd) are decompressed as they are
+read, so that the raw data is always plain csv. The codec of a download
+is taken from the `Content-Encoding` that requests doesn't decode
+itself, e.g. zstd, then from the `Content-Type`, e.g.
+`application/zstd`, then from the suffix of the url, e.g. `.csv.gz`.
+The magic bytes at the start of the body have the last word, and are
+the only clue for the files and the objects.
 """
 
+import hashlib
+import io
+import json
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
+import fsspec
+import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+
+from src import artefacts, compression, db_source, fetch_cache, metrics, utils
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+SOURCE_TYPES = ("http", "file", "sql", "objects")
+MERGE_MODES = ("concat", "join")
+# Rows read at once when aligning the columns of the sources
+MERGE_CHUNK_ROWS = 100_000
+CONTENT_TYPE_CODECS = {
+    "application/gzip": "gzip",
+    "application/x-gzip": "gzip",
+    "application/x-bzip2": "bz2",
+    "application/zstd": "zstd",
+}
+CONTENT_ENCODING_CODECS = {"gzip": "gzip", "x-gzip": "gzip", "zstd": "zstd"}
+
+
+def _part_paths(output_path: str) -> tuple[str, str]:
+    """Paths of the partial download and its resume state file."""
+    part_path = f"{output_path}.part"
+    return part_path, f"{part_path}.json"
+
+
+def _range_total(response: requests.Response) -> int | None:
+    """Size of the file from the answer to a `bytes=0-0` range request.
+
+    None when the server did not serve the range, e.g. it sent the whole
+    file instead.
+    """
+    if response.status_code != 206:
+        return None
+    match = re.fullmatch(
+        r"bytes 0-0/(\d+)", response.headers.get("Content-Range", "")
+    )
+    return int(match.group(1)) if match else None
+
+
+def _load_resume_state(state_path: str, validators: dict) -> dict:
+    """Load the resume state if it belongs to the same remote file."""
+    if not os.path.exists(state_path):
+        return {}
+    try:
+        with open(state_path, "r") as state_file:
+            state = json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+    if state.get("validators") != validators:
+        utils.logger.info("Remote file changed, discarding partial download")
+        return {}
+    return state
+
+
+def _save_resume_state(state_path: str, state: dict) -> None:
+    """Persist the resume state next to the partial download."""
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w") as state_file:
+        json.dump(state, state_file)
+    os.replace(tmp_path, state_path)
 
-from src import utils
 
+def _declared_codec(url: str, response: requests.Response) -> str | None:
+    """Codec of the body from the response headers, or the url suffix.
 
-def get_data_from_url(url: str, output_path: str = "data.csv") -> bool:
+    None when requests decodes the `Content-Encoding` itself, as the body
+    read is then no longer the file the url and `Content-Type` name.
+    """
+    encoding = response.headers.get("Content-Encoding", "identity").lower()
+    if encoding != "identity":
+        if encoding in response.raw.CONTENT_DECODERS:
+            return None
+        return CONTENT_ENCODING_CODECS.get(encoding)
+    content_type = response.headers.get("Content-Type", "")
+    codec = CONTENT_TYPE_CODECS.get(content_type.split(";")[0].strip())
+    return codec or compression.codec_from_suffix(urlparse(url).path)
+
+
+def _body_codec(declared: str | None, head: bytes) -> str | None:
+    """Codec of a body from its declared codec and its first bytes."""
+    sniffed = compression.detect_codec(head)
+    if len(head) < 4 or sniffed == declared:
+        return declared or sniffed
+    if declared:
+        utils.logger.warning(
+            f"Data declared as {declared} starts as {sniffed or 'plain'} "
+            f"data, read as such"
+        )
+    return sniffed
+
+
+class _BodyReader(io.RawIOBase):
+    """Binary stream of a response body, digested as it is read."""
+
+    def __init__(self, response: requests.Response, digest):
+        self._chunks = iter(
+            response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+        )
+        self._chunk = memoryview(b"")
+        self.digest = digest
+        self.size = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._chunk:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self.digest.update(chunk)
+            self.size += len(chunk)
+            self._chunk = memoryview(chunk)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def _download_single_stream(
+    response: requests.Response,
+    part_path: str,
+    digest,
+    codec: str | None = None,
+) -> tuple[int, str | None]:
+    """Stream the whole response body into the partial file.
+
+    A compressed body is decompressed as it is received, `digest` being
+    the one of the body as sent.
+
+    Returns:
+        tuple: The bytes received, and the codec of the body
+    """
+    body = _BodyReader(response, digest)
+    with io.BufferedReader(body, STREAM_CHUNK_SIZE) as stream:
+        codec = _body_codec(codec, stream.peek(4)[:4])
+        source = compression.open_reader(stream, codec) if codec else stream
+        with open(part_path, "wb") as file:
+            while chunk := source.read(STREAM_CHUNK_SIZE):
+                file.write(chunk)
+    return body.size, codec
+
+
+def _file_digest(path: str):
+    """Compute the sha256 digest of a file."""
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, "sha256")
+
+
+def _download_ranges(
+    url: str,
+    part_path: str,
+    state_path: str,
+    validators: dict,
+    num_workers: int,
+    part_size: int,
+) -> None:
+    """Download the file as concurrent byte ranges into the partial file.
+
+    Completed ranges are recorded in the state file so that an
+    interrupted download only fetches the missing ranges on retry.
+    """
+    total_size = int(validators["content_length"])
+    state = _load_resume_state(state_path, validators)
+    if not state or not os.path.exists(part_path):
+        state = {"validators": validators, "completed": []}
+        # Pre-allocate the file so ranges can be written in place
+        with open(part_path, "wb") as file:
+            file.truncate(total_size)
+        _save_resume_state(state_path, state)
+
+    ranges = [
+        (start, min(start + part_size, total_size) - 1)
+        for start in range(0, total_size, part_size)
+    ]
+    completed = set(state["completed"])
+    pending = [r for r in ranges if r[0] not in completed]
+    if completed:
+        utils.logger.info(
+            f"Resuming download, {len(pending)}/{len(ranges)} ranges left"
+        )
+
+    lock = threading.Lock()
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(num_workers, 1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def fetch_range(byte_range):
+        start, end = byte_range
+        headers = {"Range": f"bytes={start}-{end}"}
+        if validators["etag"]:
+            # Only serve the range if the file is still the same one
+            headers["If-Range"] = validators["etag"]
+        with session.get(url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise requests.RequestException(
+                    f"Server ignored the range request for bytes "
+                    f"{start}-{end} (status {response.status_code}), "
+                    f"the remote file may have changed"
+                )
+            etag = response.headers.get("ETag")
+            if validators["etag"] and etag and etag != validators["etag"]:
+                raise requests.RequestException(
+                    f"ETag changed during download: "
+                    f"{validators['etag']} != {etag}"
+                )
+            offset = start
+            with open(part_path, "r+b") as file:
+                file.seek(offset)
+                for chunk in response.iter_content(
+                    chunk_size=STREAM_CHUNK_SIZE
+                ):
+                    file.write(chunk)
+                    offset += len(chunk)
+            if offset != end + 1:
+                raise requests.RequestException(
+                    f"Incomplete range {start}-{end}: got "
+                    f"{offset - start} of {end - start + 1} bytes"
+                )
+        with lock:
+            state["completed"].append(start)
+            _save_resume_state(state_path, state)
+
+    try:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            # Consume the results to surface the first failure
+            list(executor.map(fetch_range, pending))
+    finally:
+        session.close()
+
+
+def get_download_options(config: dict) -> dict:
+    """Get the `get_data_from_url` keyword arguments from the config."""
+    download_config = config.get("data_download", {})
+    fetch_cache_path = download_config.get("fetch_cache_path")
+    return {
+        "num_workers": download_config.get("num_workers", 4),
+        "part_size": download_config.get("part_size_mb", 16) * 1024 * 1024,
+        # Absolute, as the pipeline changes directory before it's updated
+        "fetch_cache_path": (
+            os.path.abspath(fetch_cache_path) if fetch_cache_path else None
+        ),
+    }
+
+
+def get_data_from_url(
+    url: str,
+    output_path: str = "data.csv",
+    num_workers: int = 4,
+    part_size: int = DEFAULT_PART_SIZE,
+    fetch_cache_path: str | None = None,
+) -> bool:
     """
     Get data from a URL and save it to a local file.
 
+    With `num_workers` > 1, a request for the first byte tells whether
+    the server supports byte range requests, and the size of the file.
+    When it does and the file is larger than `part_size`, the file is
+    downloaded as concurrent ranges which can be resumed after an
+    interruption. Otherwise it is streamed in a single request, the
+    answer to the first one when the server sent the whole file.
+
+    The data is written to `<output_path>.part` and only renamed to
+    `output_path` once its size has been verified. A gzip, bz2 or zstd
+    body is decompressed as it is streamed, or once its ranges are
+    downloaded.
+
+    With a `fetch_cache_path`, the request is made conditional on the
+    `ETag`/`Last-Modified` of the previous download, and the content
+    digest is compared with the cached one when the server sends the
+    file again.
+
     Args:
         url (str): The URL to download data from
         output_path (str): The local path to save the downloaded file
+        num_workers (int): The number of concurrent range requests
+        part_size (int): The size in bytes of each range request
+        fetch_cache_path (str): The fetch cache file, None to disable it
 
     Returns:
-        bool: True if the download was successful, False otherwise
+        bool: True if the data changed since it was last ingested,
+            False if the data was already ingested
     """
+    part_path, state_path = _part_paths(output_path)
+    entry = None
+    headers = {}
+    if fetch_cache_path:
+        entry = fetch_cache.get_entry(fetch_cache_path, url, output_path)
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
     try:
-        response = requests.get(url, stream=True)
+        total_size = None
+        if num_workers > 1:
+            # Only the first byte, which tells both the range support and
+            # the size of the file, without starting to send the file
+            response = requests.get(
+                url, stream=True, headers={**headers, "Range": "bytes=0-0"}
+            )
+            if response.status_code == 416:
+                # An empty file has no first byte
+                response.close()
+            else:
+                total_size = _range_total(response)
+                if total_size is not None:
+                    # Read the byte, so the connection goes back to the pool
+                    response.content
+        if num_workers <= 1 or response.status_code == 416:
+            response = requests.get(url, stream=True, headers=headers)
+        if response.status_code == 304 and entry:
+            response.close()
+            utils.logger.info(f"Data not modified since last fetch - {url}")
+            return not entry["ingested"]
         response.raise_for_status()
 
-        with open(output_path, "wb") as file:
-            for chunk in response.iter_content(chunk_size=1024 * 1024):
-                file.write(chunk)
+        validators = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_length": (
+                str(total_size)
+                if total_size is not None
+                else response.headers.get("Content-Length")
+            ),
+        }
+        codec = _declared_codec(url, response)
+        if total_size is not None and total_size > part_size:
+            _download_ranges(
+                url, part_path, state_path, validators, num_workers, part_size
+            )
+            size = os.path.getsize(part_path)
+            digest = _file_digest(part_path)
+            # The ranges land in place, so the file is decompressed after
+            with open(part_path, "rb") as file:
+                codec = _body_codec(codec, file.read(4))
+            compressed_part = codec is not None
+        else:
+            if total_size is not None:
+                # Too small to be split, read in one request after all
+                response = requests.get(url, stream=True, headers=headers)
+                response.raise_for_status()
+                validators["content_length"] = response.headers.get(
+                    "Content-Length"
+                )
+            digest = hashlib.sha256()
+            size, codec = _download_single_stream(
+                response, part_path, digest, codec
+            )
+            compressed_part = False
+
+        content_length = validators["content_length"]
+        # Content-Length is the encoded size when the body is compressed
+        encoded = response.headers.get("Content-Encoding", "identity")
+        if (
+            content_length
+            and encoded == "identity"
+            and size != int(content_length)
+        ):
+            raise requests.RequestException(
+                f"Downloaded {size} bytes, expected {content_length}"
+            )
+
+        if compressed_part:
+            compression.decompress_file(part_path, output_path, codec)
+            os.remove(part_path)
+        else:
+            os.replace(part_path, output_path)
+        if codec:
+            utils.logger.info(
+                f"Decompressed {codec} data from {size} to "
+                f"{os.path.getsize(output_path)} bytes"
+            )
+        if os.path.exists(state_path):
+            os.remove(state_path)
         utils.logger.info(f"Data downloaded successfully from - {url}")
-        return True
+
+        changed = True
+        if fetch_cache_path:
+            sha256 = digest.hexdigest()
+            unchanged = entry is not None and entry["sha256"] == sha256
+            if unchanged:
+                utils.logger.info(f"Downloaded data is unchanged - {url}")
+            fetch_cache.update_entry(
+                fetch_cache_path,
+                url,
+                {
+                    "etag": validators["etag"],
+                    "last_modified": validators["last_modified"],
+                    "sha256": sha256,
+                    # Of the file kept, decompressed if it was compressed
+                    "size": os.path.getsize(output_path),
+                    "ingested": unchanged and entry["ingested"],
+                },
+            )
+            changed = not (unchanged and entry["ingested"])
+        return changed
     except requests.RequestException as e:
         utils.logger.error(f"Error downloading data from - {url}: \n{e}")
         raise e
 
 
+def get_sources(config: dict) -> list:
+    """Get the configured data sources, `data_url` alone by default."""
+    sources = config.get("data_sources") or []
+    if not sources:
+        data_url = os.getenv("DATA_URL", config["data_url"])
+        return [{"name": "data", "type": "http", "url": data_url}]
+    names = [source["name"] for source in sources]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate data source names: {names}")
+    for source in sources:
+        if source.get("type") not in SOURCE_TYPES:
+            raise ValueError(f"Unknown data source type: {source.get('type')}")
+    return sources
+
+
+def source_key(source: dict) -> str:
+    """Key of a source in the fetch cache."""
+    if source["type"] == "http":
+        return source["url"]
+    if source["type"] == "file":
+        return os.path.abspath(source["path"])
+    if source["type"] == "sql":
+        if source.get("driver", "sqlite") == "postgres":
+            return f"{source['dsn']}?{source['query']}"
+        return (
+            f"sqlite:{os.path.abspath(source['database'])}?{source['query']}"
+        )
+    return source["url"]
+
+
+def _copy_file(path: str, part_path: str) -> str:
+    """Copy a file, decompressed, returns the sha256 of the copy."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file, compression.open_decompressed(
+        file
+    ) as source, open(part_path, "wb") as output:
+        while chunk := source.read(STREAM_CHUNK_SIZE):
+            output.write(chunk)
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _concat_objects(source: dict, part_path: str) -> str:
+    """Concatenate the csv objects under a url, returns their sha256.
+
+    The objects are taken in the order of their paths, and must have the
+    same header, which is only kept from the first one. The objects with
+    a codec suffix after the csv one, e.g. `.csv.gz`, are listed too,
+    and the compressed objects are decompressed.
+    """
+    fs, root = fsspec.core.url_to_fs(
+        source["url"], **source.get("storage_options", {})
+    )
+    suffix = source.get("suffix", ".csv")
+    suffixes = (suffix, *(suffix + ext for ext in compression.CODECS.values()))
+    paths = sorted(path for path in fs.find(root) if path.endswith(suffixes))
+    if not paths:
+        raise FileNotFoundError(f"No {suffix} objects under {source['url']}")
+    digest = hashlib.sha256()
+    header = None
+    with open(part_path, "wb") as output:
+        for path in paths:
+            with fs.open(path, "rb") as file, compression.open_decompressed(
+                file
+            ) as obj:
+                first_line = obj.readline()
+                if header is None:
+                    header = first_line
+                    output.write(header)
+                    digest.update(header)
+                elif first_line != header:
+                    raise ValueError(f"Different csv header in {path}")
+                _copy_lines(obj, output, digest)
+    return digest.hexdigest()
+
+
+def _copy_lines(source, output, digest=None) -> None:
+    """Copy the rest of a file, ended with a line break if it isn't."""
+    last = b"\n"
+    while chunk := source.read(STREAM_CHUNK_SIZE):
+        output.write(chunk)
+        if digest is not None:
+            digest.update(chunk)
+        last = chunk[-1:]
+    if last != b"\n":
+        output.write(b"\n")
+        if digest is not None:
+            digest.update(b"\n")
+
+
+def _fetch(source: dict, output_path: str, download_options: dict) -> bool:
+    """Fetch a source into `output_path`.
+
+    Returns:
+        bool: True if the source changed since it was last ingested
+    """
+    if source["type"] == "http":
+        return get_data_from_url(
+            source["url"], output_path, **download_options
+        )
+
+    export = {
+        "file": lambda part_path: _copy_file(source["path"], part_path),
+        "sql": lambda part_path: db_source.export_query(source, part_path),
+        "objects": lambda part_path: _concat_objects(source, part_path),
+    }[source["type"]]
+    part_path, _ = _part_paths(output_path)
+    digest = export(part_path)
+    os.replace(part_path, output_path)
+
+    cache_path = download_options.get("fetch_cache_path")
+    if not cache_path:
+        return True
+    key = source_key(source)
+    entry = fetch_cache.load_fetch_cache(cache_path).get(key)
+    unchanged = entry is not None and entry.get("digest") == digest
+    fetch_cache.update_entry(
+        cache_path,
+        key,
+        {
+            "digest": digest,
+            "size": os.path.getsize(output_path),
+            "ingested": unchanged and entry["ingested"],
+        },
+    )
+    return not (unchanged and entry["ingested"])
+
+
+def _source_paths(config: dict, sources: list) -> dict:
+    """Local file of each source, the raw data file for a single one."""
+    raw_path = config["data_split"]["raw_data_save_path"]
+    if len(sources) == 1:
+        return {sources[0]["name"]: raw_path}
+    sources_dir = os.path.join(os.path.dirname(raw_path), "sources")
+    os.makedirs(sources_dir, exist_ok=True)
+    return {
+        source["name"]: os.path.join(sources_dir, f"{source['name']}.csv")
+        for source in sources
+    }
+
+
+def merge_sources(paths: list, output_path: str, merge_config: dict) -> None:
+    """Merge the csv files of the sources into a single csv file.
+
+    With `how: concat`, the rows of every source are appended in the
+    order of the sources, byte for byte when they have the same header,
+    or in chunks with the union of their columns otherwise. With
+    `how: join`, the sources are joined on the `on` columns, with the
+    `join` type of `pandas.merge`, in memory.
+    """
+    how = merge_config.get("how", "concat")
+    if how not in MERGE_MODES:
+        raise ValueError(f"Unknown data source merge: {how}")
+    part_path, _ = _part_paths(output_path)
+
+    if how == "join":
+        merged = pd.read_csv(paths[0])
+        for path in paths[1:]:
+            merged = merged.merge(
+                pd.read_csv(path),
+                on=merge_config["on"],
+                how=merge_config.get("join", "left"),
+            )
+        merged.to_csv(part_path, index=False)
+        os.replace(part_path, output_path)
+        return
+
+    headers = []
+    for path in paths:
+        with open(path, "rb") as source:
+            headers.append(source.readline())
+    if len(set(headers)) == 1:
+        with open(part_path, "wb") as output:
+            for i, path in enumerate(paths):
+                with open(path, "rb") as source:
+                    # Only the header of the first source is kept
+                    if i > 0:
+                        source.readline()
+                    _copy_lines(source, output)
+    else:
+        columns = []
+        for path in paths:
+            for column in pd.read_csv(path, nrows=0).columns:
+                if column not in columns:
+                    columns.append(column)
+        with artefacts.ArtefactWriter(part_path, "csv") as writer:
+            for path in paths:
+                for chunk in pd.read_csv(path, chunksize=MERGE_CHUNK_ROWS):
+                    writer.write(chunk.reindex(columns=columns))
+    os.replace(part_path, output_path)
+
+
+def gather_data(config: dict) -> bool:
+    """Fetch all the sources concurrently and merge them.
+
+    Returns:
+        bool: True if any source changed since it was last ingested
+    """
+    sources = get_sources(config)
+    download_options = get_download_options(config)
+    paths = _source_paths(config, sources)
+
+    def fetch(source):
+        start = time.perf_counter()
+        changed = _fetch(source, paths[source["name"]], download_options)
+        seconds = time.perf_counter() - start
+        size = os.path.getsize(paths[source["name"]])
+        utils.logger.info(
+            f"Fetched source {source['name']} ({size} bytes) in "
+            f"{seconds:.2f}s",
+            extra={
+                "source": source["name"],
+                "source_type": source["type"],
+                "seconds": seconds,
+                "bytes": size,
+                "changed": changed,
+            },
+        )
+        return changed, size
+
+    merge_config = config.get("source_merge", {})
+    workers = merge_config.get("workers") or len(sources)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(fetch, sources))
+    metrics.record(
+        sources=len(sources), bytes_fetched=sum(size for _, size in results)
+    )
+    changed = any(changed for changed, _ in results)
+
+    raw_path = config["data_split"]["raw_data_save_path"]
+    if len(sources) > 1 and (changed or not os.path.exists(raw_path)):
+        merge_sources(
+            [paths[source["name"]] for source in sources],
+            raw_path,
+            merge_config,
+        )
+        utils.logger.info(
+            f"Merged {len(sources)} sources into {raw_path}",
+            extra={"bytes": os.path.getsize(raw_path)},
+        )
+    return changed
+
+
+def source_keys(config: dict) -> list:
+    """Keys of all the sources in the fetch cache."""
+    return [source_key(source) for source in get_sources(config)]
+
+
+def mark_ingested(fetch_cache_path: str | None, keys: list) -> None:
+    """Record that the fetched version of the sources was ingested."""
+    if fetch_cache_path:
+        for key in keys:
+            fetch_cache.mark_ingested(fetch_cache_path, key)
+
+
 if __name__ == "__main__":
     config = utils.load_yaml_config()
-    data_url = os.getenv("DATA_URL", config["data_url"])
-    get_data_from_url(data_url, config["data_split"]["raw_data_save_path"])
+    gather_data(config)
@@ -3,98 +3,287 @@
 import os
 import re
 import shutil
+import time
 from pathlib import Path
 
-from dvc.cli import main as dvc_main
+import fsspec.config
+import yaml
+from dvc.api import DVCFileSystem
+from dvc.repo import Repo as DvcRepo
+from dvc_data.hashfile.hash_info import HashInfo
 from git import GitCommandError, Repo
 
-from src import utils
+from src import artefacts, incremental, metrics, utils
 from src.utils import logger
 
-
-def dvc_remote_add(config):
-    """Set the dvc remote."""
+# Default push settings, each can be overridden by the `dvc_push` config
+# section and then by the `DVC_PUSH_<SETTING>` environment variable
+PUSH_SETTINGS = {
+    "jobs": 8,
+    "max_pool_connections": 32,
+    "max_concurrency": 4,
+    "retries": 5,
+    "retry_mode": "adaptive",
+    "connect_timeout": 60,
+    "read_timeout": 60,
+}
+
+
+def get_push_settings(config):
+    """Get the DVC push settings from the config and the environment."""
+    settings = {**PUSH_SETTINGS, **config.get("dvc_push", {})}
+    for name, default in PUSH_SETTINGS.items():
+        value = os.getenv(f"DVC_PUSH_{name.upper()}")
+        if value:
+            settings[name] = type(default)(value)
+    return settings
+
+
+def apply_s3_settings(settings):
+    """Set the S3 client settings of the filesystems created from now on.
+
+    DVC has no remote options for the connection pool, the retries or the
+    parts of a file uploaded concurrently, so they are given to s3fs as
+    the fsspec defaults of the s3 filesystems. The timeouts are set there
+    too, as DVC would replace all of them if set as remote options.
+    """
+    fsspec.config.conf["s3"] = {
+        **fsspec.config.conf.get("s3", {}),
+        # Parts of a multipart upload sent concurrently, for each file
+        "max_concurrency": settings["max_concurrency"],
+        "config_kwargs": {
+            # Enough connections for all the files and parts in flight
+            "max_pool_connections": settings["max_pool_connections"],
+            "retries": {
+                "max_attempts": settings["retries"],
+                "mode": settings["retry_mode"],
+            },
+            "connect_timeout": settings["connect_timeout"],
+            "read_timeout": settings["read_timeout"],
+        },
+    }
+
+
+def get_remote(config):
+    """Name and settings of the dvc remote, from the config and the env."""
     access_key_id = os.getenv("DVC_ACCESS_KEY_ID")
     secret_access_key = os.getenv("DVC_SECRET_ACCESS_KEY")
     region = os.getenv("AWS_DEFAULT_REGION")
-    try:
-        dvc_remote_name = os.getenv(
-            "DVC_REMOTE_NAME", config["dvc_remote_name"]
-        )
-        dvc_remote = os.getenv("DVC_REMOTE", config["dvc_remote"])
-        dvc_endpoint_url = os.getenv(
-            "DVC_ENDPOINT_URL", config["dvc_endpoint_url"]
-        )
+    dvc_remote_name = os.getenv("DVC_REMOTE_NAME", config["dvc_remote_name"])
+    dvc_remote = os.getenv("DVC_REMOTE", config["dvc_remote"])
+    dvc_endpoint_url = os.getenv(
+        "DVC_ENDPOINT_URL", config["dvc_endpoint_url"]
+    )
 
-        dvc_main(["remote", "add", "-f", dvc_remote_name, dvc_remote])
-        dvc_main(
-            [
-                "remote",
-                "modify",
-                dvc_remote_name,
-                "endpointurl",
-                dvc_endpoint_url,
-            ]
+    remote = {"url": dvc_remote, "endpointurl": dvc_endpoint_url}
+    if secret_access_key is None or secret_access_key == "":
+        # Set dvc remote credentials
+        # only when a valid secret access key is present
+        logger.warning(
+            "AWS credentials `dvc_secret_access_key` is missing "
+            "in the Airflow connection."
         )
-        if secret_access_key is None or secret_access_key == "":
-            # Set dvc remote credentials
-            # only when a valid secret access key is present
-            logger.warning(
-                "AWS credentials `dvc_secret_access_key` is missing "
-                "in the Airflow connection."
-            )
-        else:
-            dvc_main(
-                [
-                    "remote",
-                    "modify",
-                    dvc_remote_name,
-                    "access_key_id",
-                    access_key_id,
-                ]
-            )
-            dvc_main(
-                [
-                    "remote",
-                    "modify",
-                    dvc_remote_name,
-                    "secret_access_key",
-                    secret_access_key,
-                ]
-            )
-        # Minio does not enforce regions but DVC requires it
-        dvc_main(["remote", "modify", dvc_remote_name, "region", region])
+    else:
+        remote["access_key_id"] = access_key_id
+        remote["secret_access_key"] = secret_access_key
+    # Minio does not enforce regions but DVC requires it
+    if region:
+        remote["region"] = region
+    return dvc_remote_name, remote
+
+
+def dvc_remote_add(dvc_repo, config):
+    """Set the dvc remote, in a single write of the dvc config."""
+    try:
+        dvc_remote_name, remote = get_remote(config)
+        settings = get_push_settings(config)
+        # Number of files uploaded concurrently
+        remote["jobs"] = settings["jobs"]
+        apply_s3_settings(settings)
+        # Replaces the remote of the same name, as `dvc remote add -f`
+        with dvc_repo.config.edit() as dvc_config:
+            dvc_config["remote"][dvc_remote_name] = remote
     except Exception as e:
         logger.error(f"DVC remote add failed with error: {e}")
         raise e
 
 
-def dvc_add_files(config):
-    """Add train, test and val data files to DVC."""
+def open_data_fs(config, git_url, rev="data-latest"):
+    """The files of the data repo at `rev`, read from the dvc remote."""
+    dvc_remote_name, remote = get_remote(config)
+    return DVCFileSystem(
+        git_url, rev=rev, remote=dvc_remote_name, remote_config=remote
+    )
+
+
+def get_dvc_outputs(config):
+    """Get the data paths tracked by DVC.
+
+    These are the train, val and test data files, or their partition
+    directories when partitioned, and the imputation statistics. In
+    incremental mode, the partition directories, the ingestion state
+    directory and the imputation statistics.
+    """
+    stats_path = artefacts.get_imputation_stats_path(config)
+    if incremental.is_enabled(config):
+        return [
+            *artefacts.get_split_dirs(config).values(),
+            incremental.get_state_dir(config),
+            stats_path,
+        ]
+    return [*artefacts.get_split_outputs(config), stats_path]
+
+
+def seed_dvc_state(dvc_repo, digests):
+    """Give DVC the md5 of the artefacts computed while writing them.
+
+    DVC then takes the hashes from its state instead of reading the files
+    back. A digest is only used if the file has the size and
+    modification time it had when written.
+    """
+    seeded = 0
+    for path, digest in digests.items():
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if (stat.st_size, stat.st_mtime_ns) == (
+            digest["size"],
+            digest["mtime_ns"],
+        ):
+            dvc_repo.state.save(
+                os.path.abspath(path),
+                dvc_repo.fs,
+                HashInfo("md5", digest["md5"]),
+            )
+            seeded += 1
+    logger.info(f"Seeded the DVC state with {seeded} artefact digests")
+
+
+def dvc_add_files(dvc_repo, config):
+    """Add train, test and val data files to DVC in a single batch."""
     try:
-        dvc_main(
-            ["add", config["data_split"]["train_data_save_path"]],
-        )
-        dvc_main(
-            ["add", config["data_split"]["test_data_save_path"]],
-        )
-        dvc_main(
-            ["add", config["data_split"]["val_data_save_path"]],
-        )
+        dvc_repo.add(get_dvc_outputs(config))
     except Exception as e:
         logger.error(f"DVC add failed with error: {e}")
         raise e
 
 
-def dvc_push(config):
-    """DVC push."""
+def _missing_files(dvc_repo, config, remote, jobs):
+    """The files of each output whose objects are missing on the remote.
+
+    Taken from the cloud status of the outputs, with the size of each
+    file, 0 for the manifest of a directory.
+    """
+    outputs = get_dvc_outputs(config)
+    status = dvc_repo.status(
+        targets=outputs, cloud=True, remote=remote, jobs=jobs
+    )
+    new = [name for name, state in status.items() if state == "new"]
+    missing = {}
+    for output in outputs:
+        root = os.path.normpath(output)
+        files = {
+            name: os.path.getsize(name) if os.path.isfile(name) else 0
+            for name in new
+            if name == root or name.startswith(root + os.sep)
+        }
+        if files:
+            missing[output] = files
+    return missing
+
+
+def _push_batches(missing, jobs):
+    """Group the outputs so that each push uploads `jobs` files at once."""
+    batches, batch, files = [], [], 0
+    for output, output_files in missing.items():
+        batch.append(output)
+        files += len(output_files)
+        if files >= jobs:
+            batches.append(batch)
+            batch, files = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def dvc_push(dvc_repo, config):
+    """DVC push, logging the progress and the throughput.
+
+    Only the files missing on the remote are uploaded, and counted in the
+    bytes pushed. The outputs are pushed in batches of at least `jobs`
+    files, each batch logging the progress of the push.
+    """
     try:
-        dvc_main(["push", "-r", config["dvc_remote_name"]])
+        jobs = get_push_settings(config)["jobs"]
+        remote = config["dvc_remote_name"]
+        start = time.perf_counter()
+        missing = _missing_files(dvc_repo, config, remote, jobs)
+        total_files = sum(len(files) for files in missing.values())
+        total_size = sum(sum(files.values()) for files in missing.values())
+        logger.info(
+            f"DVC pushing {total_files} files of {total_size} bytes "
+            f"missing on the remote"
+        )
+        pushed = size = 0
+        for batch in _push_batches(missing, jobs):
+            pushed += dvc_repo.push(targets=batch, remote=remote, jobs=jobs)
+            size += sum(sum(missing[output].values()) for output in batch)
+            logger.info(
+                f"DVC push progress: {pushed}/{total_files} files, "
+                f"{size}/{total_size} bytes",
+                extra={
+                    "files_done": pushed,
+                    "files_total": total_files,
+                    "bytes_done": size,
+                    "bytes_total": total_size,
+                    "seconds": round(time.perf_counter() - start, 3),
+                },
+            )
+        seconds = time.perf_counter() - start
+        metrics.record(files_uploaded=pushed, bytes_uploaded=size)
+        logger.info(
+            f"DVC pushed {pushed} files of {size} bytes in {seconds:.3f}s",
+            extra={
+                "files_pushed": pushed,
+                "bytes": size,
+                "seconds": round(seconds, 3),
+                "bytes_per_second": round(size / seconds) if seconds else 0,
+                "jobs": jobs,
+            },
+        )
     except Exception as e:
         logger.error(f"DVC push failed with error: {e}")
         raise e
 
 
+def _dvc_out_hashes(dvc_file_content):
+    """The path and hash of the outputs in the content of a .dvc file."""
+    return [
+        (out["path"], out.get("md5"))
+        for out in yaml.safe_load(dvc_file_content).get("outs", [])
+    ]
+
+
+def data_unchanged(repo, config, tag="data-latest"):
+    """Whether the data hashes the same as the data at `tag`.
+
+    The output hashes of the .dvc files just written by `dvc add` are
+    compared with the ones committed at `tag`.
+    """
+    for path in get_dvc_outputs(config):
+        dvc_file = add_suffix(path)
+        try:
+            previous = repo.git.show(f"{tag}:./{Path(dvc_file)}")
+        except GitCommandError:
+            # No such tag, or the output wasn't tracked yet
+            return False
+        with open(dvc_file, "r") as current:
+            if _dvc_out_hashes(current.read()) != _dvc_out_hashes(previous):
+                return False
+    return True
+
+
 def create_and_switch_branch(repo, config):
     """Create a branch if it doesn't exist and switch to it."""
     try:
@@ -114,13 +303,22 @@ def add_suffix(file_name, suffix: str = ".dvc"):
 
 
 def git_add_files(repo, config):
-    """Git add required files."""
+    """Git add required files.
+
+    These are the .dvc files of the outputs, the .gitignore files next to
+    them where `dvc add` ignores the outputs, and the dvc config.
+    """
     try:
-        repo.index.add(
-            add_suffix(config["data_split"]["train_data_save_path"])
-        )
-        repo.index.add(add_suffix(config["data_split"]["val_data_save_path"]))
-        repo.index.add(add_suffix(config["data_split"]["test_data_save_path"]))
+        gitignores = set()
+        for path in get_dvc_outputs(config):
+            repo.index.add(add_suffix(path))
+            gitignore = os.path.join(
+                os.path.dirname(os.path.normpath(path)), ".gitignore"
+            )
+            if os.path.exists(gitignore):
+                gitignores.add(gitignore)
+        if gitignores:
+            repo.index.add(sorted(gitignores))
         # Add the dvc config as well
         repo.index.add(".dvc/config")
     except Exception as e:
@@ -137,35 +335,73 @@ def git_commit(repo, config):
         raise e
 
 
-def get_latest_tag(repo):
+DATA_TAG_PATTERN = re.compile(r"data-v(\d+)\.(\d+)\.(\d+)")
+
+
+class TagIndex:
+    """The repo tags and their commits, read once with for-each-ref.
+
+    Membership checks are O(1), and the data version tags are kept
+    sorted by semantic version rather than by commit date, so that no
+    commit object has to be read.
+    """
+
+    def __init__(self, tags: dict):
+        # Tag name to the sha of the commit it points to
+        self.tags = tags
+
+    @classmethod
+    def from_repo(cls, repo):
+        """Read the tags of a repo."""
+        output = repo.git.for_each_ref(
+            "--format=%(refname:strip=2) %(objectname) %(*objectname)",
+            "refs/tags",
+        )
+        tags = {}
+        for line in output.splitlines():
+            name, sha, *peeled = line.split()
+            # Annotated tags point to the commit of their tag object
+            tags[name] = peeled[0] if peeled else sha
+        return cls(tags)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.tags
+
+    def add(self, name: str, sha: str) -> None:
+        """Record a tag created after the index was read."""
+        self.tags[name] = sha
+
+    def latest_data_tag(self) -> str | None:
+        """The data tag of the highest version, None if there is none."""
+        versions = {}
+        for name in self.tags:
+            match = DATA_TAG_PATTERN.match(name)
+            if match:
+                versions[name] = tuple(map(int, match.groups()))
+        return max(versions, key=versions.get, default=None)
+
+
+def get_latest_tag(repo, tag_index=None):
     """Get the new git data tag to be used.
 
     This is done by getting the existing latest data tag and then
     incrementing the minor version by 1.
     """
     try:
-        # Get only the data tags
-        tags = [
-            tag
-            for tag in repo.tags
-            if re.match(r"data-v(\d+)\.(\d+)\.(\d+)", tag.name)
-        ]
-        # Sort the filtered data tags by commit date
-        tags = sorted(tags, key=lambda t: t.commit.committed_datetime)
-        if tags:
-            latest_tag = tags[-1]
-            latest_tag_name = latest_tag.name
-            last_commit = latest_tag.commit
+        if tag_index is None:
+            tag_index = TagIndex.from_repo(repo)
+        latest_tag_name = tag_index.latest_data_tag()
+        if latest_tag_name:
+            last_commit = repo.commit(tag_index.tags[latest_tag_name])
 
             # Increment the minor version
-            match = re.match(r"data-v(\d+)\.(\d+)\.(\d+)", latest_tag_name)
-            if match:
-                major, minor, patch = map(int, match.groups())
-                new_tag = f"data-v{major}.{minor + 1}.{patch}"
-                return {
-                    "new_tag": new_tag,
-                    "latest_commit": last_commit,
-                }
+            match = DATA_TAG_PATTERN.match(latest_tag_name)
+            major, minor, patch = map(int, match.groups())
+            new_tag = f"data-v{major}.{minor + 1}.{patch}"
+            return {
+                "new_tag": new_tag,
+                "latest_commit": last_commit,
+            }
         # If no tag exists, initialize the versioning
         return {
             "new_tag": "data-v1.0.0",
@@ -177,63 +413,49 @@ def get_latest_tag(repo):
 
 
 def git_push(repo, config):
-    """Git push the commit and tag, adding 'previous' and 'latest' tags."""
+    """Git push the commit and tag, adding 'previous' and 'latest' tags.
+
+    The branch and all the tags are pushed in a single atomic push, so
+    the remote either gets all of them or none.
+    """
     # Additional rolling tags used for
     # automated model training and drift monitoring
     prev_tag = "data-previous"
     latest_tag = "data-latest"
     try:
-        # Push the branch first
-        repo.git.push("origin", config["git_branch"])
-
-        # Get tagging information
-        tag_info = get_latest_tag(repo)
+        # Get tagging information, from the tags read once
+        tag_index = TagIndex.from_repo(repo)
+        tag_info = get_latest_tag(repo, tag_index)
         new_tag = tag_info["new_tag"]
         latest_commit = tag_info["latest_commit"]
+        head_commit = repo.commit()
+        refspecs = [config["git_branch"]]
 
-        # add prev_tag
+        # Move prev_tag to the commit of the previous version
         if latest_commit:
-            if prev_tag in [tag.name for tag in repo.tags]:
-                try:
-                    # Delete the existing prev_tag
-                    repo.delete_tag(prev_tag)
-                except Exception as e:
-                    logger.info(f"Error deleting local tag {prev_tag}: {e}")
-                # Remove remote prev_tag
-                repo.git.push("--delete", "origin", prev_tag)
-            repo.create_tag(prev_tag, ref=latest_commit)
+            repo.create_tag(prev_tag, ref=latest_commit, force=True)
+            tag_index.add(prev_tag, latest_commit.hexsha)
+            refspecs.append(f"+{latest_commit.hexsha}:refs/tags/{prev_tag}")
             logger.info(
                 f"Added {prev_tag} tag to commit: {latest_commit.hexsha}"
             )
-            repo.git.push("origin", prev_tag)
-            logger.warning(
-                f"New tag {prev_tag} already exists on "
-                f"previous commit:{latest_commit.hexsha}!!!"
-            )
 
-        # Add latest_tag
-        if new_tag not in [tag.name for tag in repo.tags]:
+        # Add the new version tag
+        if new_tag not in tag_index:
             repo.create_tag(new_tag)
+            tag_index.add(new_tag, head_commit.hexsha)
+            refspecs.append(f"refs/tags/{new_tag}")
             logger.info(f"Added new version tag: {new_tag}")
-            repo.git.push("origin", new_tag)
         else:
             logger.info(f"Tag {new_tag} already exists, skipping creation.")
 
-        # Update latest_tag to the current HEAD
-        if latest_tag in [tag.name for tag in repo.tags]:
-            try:
-                # Delete the existing latest_tag
-                repo.delete_tag(latest_tag)
-            except Exception as e:
-                logger.info(f"Error deleting local tag {latest_tag}: {e}")
-                # Remove remote latest_tag
-            repo.git.push("--delete", "origin", latest_tag)
-
-        repo.create_tag(latest_tag, ref=repo.commit())
-        logger.info(
-            f"Added {latest_tag} tag to commit: {repo.commit().hexsha}"
-        )
-        repo.git.push("origin", latest_tag)
+        # Move latest_tag to the current HEAD
+        repo.create_tag(latest_tag, ref=head_commit, force=True)
+        tag_index.add(latest_tag, head_commit.hexsha)
+        refspecs.append(f"+{head_commit.hexsha}:refs/tags/{latest_tag}")
+        logger.info(f"Added {latest_tag} tag to commit: {head_commit.hexsha}")
+
+        repo.git.push("--atomic", "origin", *refspecs)
 
     except Exception as e:
         logger.error(f"Git push failed with error: {e}")
@@ -301,19 +523,90 @@ def pull_updates(repo_dir):
     Repo(repo_dir).remotes.origin.pull()
 
 
+def _remote_branch_exists(repo, branch_name):
+    """Whether the branch exists on origin, without fetching it."""
+    return bool(repo.git.ls_remote("--heads", "origin", branch_name))
+
+
+def prepare_workspace(git_url, config):
+    """Clone the repo once at `git_repo_save_name` and update it after.
+
+    The repo is a partial clone of the data branch, without any file
+    content until it is checked out. It is cloned next to the workspace
+    then its `.git` directory is renamed into it, so files already in the
+    workspace are kept. On later runs, the branch and the tags are
+    fetched and the workspace is reset to the remote branch, keeping the
+    untracked files.
+    """
+    workspace = config["git_repo_save_name"]
+    branch_name = config["git_branch"]
+    if not os.path.isdir(os.path.join(workspace, ".git")):
+        clone_path = f"{os.path.abspath(workspace)}.clone"
+        shutil.rmtree(clone_path, ignore_errors=True)
+        Repo.clone_from(
+            git_url,
+            clone_path,
+            multi_options=[
+                "--filter=blob:none",
+                "--single-branch",
+                "--no-checkout",
+            ],
+        )
+        os.makedirs(workspace, exist_ok=True)
+        os.rename(
+            os.path.join(clone_path, ".git"), os.path.join(workspace, ".git")
+        )
+        shutil.rmtree(clone_path)
+        logger.info(f"Cloned {config['git_repo_url']} into {workspace}")
+
+    repo = Repo(workspace)
+    # The credentials in the url may have changed since the clone
+    repo.remotes.origin.set_url(git_url)
+    if _remote_branch_exists(repo, branch_name):
+        repo.git.fetch(
+            "--filter=blob:none",
+            "--tags",
+            "--force",
+            "origin",
+            f"+refs/heads/{branch_name}:refs/remotes/origin/{branch_name}",
+        )
+        start_point = f"origin/{branch_name}"
+    else:
+        # Start the data branch from the default branch of the clone
+        repo.git.fetch("--filter=blob:none", "--tags", "--force", "origin")
+        start_point = "origin/HEAD"
+    # Resets the branch, index and tracked files to the start point
+    repo.git.checkout("--force", "-B", branch_name, start_point)
+    return repo
+
+
 def push_data(config):
-    """Push the data and tag it with version."""
+    """Push the data and tag it with version.
+
+    Returns:
+        bool: Whether a new data version was pushed, False when the data
+            is the same as the latest version
+    """
     # 1. Authenticate, clone, and update git repo
     authenticated_git_url = get_authenticated_github_url(
         config["git_repo_url"]
     )
-    repo_temp_path = "./repo"
-    Repo.clone_from(authenticated_git_url, repo_temp_path)
-    branch_exists = checkout_branch(repo_temp_path, config["git_branch"])
-    if branch_exists:
-        pull_updates(repo_temp_path)
+    # Read before moving to the workspace, relative to the data paths
+    digests = artefacts.load_digests(config)
+    if config.get("git_workspace", "fresh") == "persistent":
+        with metrics.stage("Git workspace update"):
+            prepare_workspace(authenticated_git_url, config)
+    else:
+        with metrics.stage("Git clone"):
+            repo_temp_path = "./repo"
+            Repo.clone_from(authenticated_git_url, repo_temp_path)
+            branch_exists = checkout_branch(
+                repo_temp_path, config["git_branch"]
+            )
+            if branch_exists:
+                pull_updates(repo_temp_path)
 
-    copy_directory(repo_temp_path, config["git_repo_save_name"])
+            copy_directory(repo_temp_path, config["git_repo_save_name"])
     os.chdir(config["git_repo_save_name"])
 
     # 2. Initialise git and dvc
@@ -325,27 +618,38 @@ def push_data(config):
     #     ["init"],
     # )
 
-    # 3. DVC operations
-    logger.warning("STARTING DVC REMOTE ADD")
-    dvc_remote_add(config)
-    logger.warning("STARTING DVC ADD")
-    dvc_add_files(config)
-    logger.warning("STARTING DVC PUSH")
-    dvc_push(config)
-    logger.warning("ENDED DVC PUSH")
+    # 3. DVC operations, on a single dvc repo instance
+    with DvcRepo(".") as dvc_repo:
+        with metrics.stage("DVC remote add"):
+            dvc_remote_add(dvc_repo, config)
+        with metrics.stage("DVC add"):
+            seed_dvc_state(dvc_repo, digests)
+            dvc_add_files(dvc_repo, config)
+        if data_unchanged(repo, config):
+            logger.info(
+                "Data unchanged since the latest version, skipping the "
+                "push, commit and tagging",
+                extra={"result": "no-op"},
+            )
+            return False
+        with metrics.stage("DVC push"):
+            dvc_push(dvc_repo, config)
 
     # 4. Git operations:
-    # Create a branch if it doesn't exist and switch to it
-    create_and_switch_branch(repo, config)
+    with metrics.stage("Git commit"):
+        # Create a branch if it doesn't exist and switch to it
+        create_and_switch_branch(repo, config)
 
-    # Git add some files
-    git_add_files(repo, config)
+        # Git add some files
+        git_add_files(repo, config)
 
-    # Git commit the changes
-    git_commit(repo, config)
+        # Git commit the changes
+        git_commit(repo, config)
 
     # Git push the commit and tag/version
-    git_push(repo, config)
+    with metrics.stage("Git push"):
+        git_push(repo, config)
+    return True
 
 
 if __name__ == "__main__":
@@ -1,16 +1,44 @@
 """Data split, preprocess and other data utilities."""
 
+from contextlib import ExitStack
+
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
-from src import utils
+from src import artefacts, metrics, utils
+from src.data_cleansing import get_cleansed_data_path
+from src.imputation_stats import NumericSketch
+
+SPLITTERS = ("random", "hash", "stratified")
+# Rows of the cleansed data read at once by the chunked splitters
+SPLIT_CHUNK_ROWS = 100_000
+# Number of label quantile bins the stratified splitter balances
+DEFAULT_STRATIFY_BINS = 10
+
 
+def split_data(config: dict, data: pd.DataFrame | None = None) -> None:
+    """Load a single data source and split it into train, test and val.
 
-def split_data(config: dict) -> None:
-    """Load a single data source and split it into train, test and val."""
-    # read raw data file path from environment variable
-    raw_data_path = config["data_split"]["cleansed_data_save_path"]
-    data = pd.read_csv(raw_data_path)
+    Args:
+        config (dict): The data ingestion config
+        data (pd.DataFrame): The cleansed data, read from the cleansed
+            data artefact if None
+    """
+    splitter = get_splitter(config)
+    if splitter != "random":
+        if splitter == "hash":
+            _hash_split(config, data)
+        else:
+            _stratified_split(config, data)
+        utils.logger.info("Data splitting completed.")
+        return
+
+    artefact_format = artefacts.get_artefact_format(config)
+    if data is None:
+        data = artefacts.read_artefact(
+            get_cleansed_data_path(config), artefact_format
+        )
 
     # Split features(X) and target(y) variable
     label_column = config["data_split"]["label_col"]
@@ -38,13 +66,225 @@ def split_data(config: dict) -> None:
     X_test[config["data_split"]["label_col"]] = y_test
     X_val[config["data_split"]["label_col"]] = y_val
 
-    # Save the split dataframes into csvs
-    X_train.to_csv(config["data_split"]["train_data_save_path"], index=False)
-    X_val.to_csv(config["data_split"]["val_data_save_path"], index=False)
-    X_test.to_csv(config["data_split"]["test_data_save_path"], index=False)
+    # Save the split dataframes in the artefact format
+    splits = {"train": X_train, "val": X_val, "test": X_test}
+    digests = {}
+    for split, path in artefacts.get_split_paths(config).items():
+        with artefacts.open_split_writer(config, path) as writer:
+            writer.write(splits[split])
+        digests.update(writer.digests)
+    artefacts.save_digests(config, digests)
+    metrics.record(rows_in=len(data), rows_out=len(data))
     utils.logger.info("Data splitting completed.")
 
 
+def get_splitter(config: dict) -> str:
+    """Get the configured splitter, random by default."""
+    splitter = config["data_split"].get("splitter", "random")
+    if splitter not in SPLITTERS:
+        raise ValueError(f"Unknown splitter: {splitter}")
+    return splitter
+
+
+def get_split_key_cols(config: dict, columns) -> list:
+    """Columns the hash splitter assigns the rows from.
+
+    The columns that are never imputed by default, as the imputed values
+    change with the statistics of each data version and would move the
+    rows with gaps to another split. At least two columns must be left,
+    otherwise `split_key_cols` has to be set.
+    """
+    imputed_cols = set(config["data_split"].get("numeric_cols", [])) | set(
+        config["data_split"].get("categorical_cols", [])
+    )
+    key_cols = config["data_split"].get("split_key_cols")
+    if key_cols:
+        if imputed := [col for col in key_cols if col in imputed_cols]:
+            utils.logger.warning(
+                f"Split key columns {imputed} are imputed, the rows with "
+                f"gaps may change split when the imputed values change"
+            )
+        return list(key_cols)
+    key_cols = [
+        col
+        for col in columns
+        if col != artefacts.CSV_INDEX_COL and col not in imputed_cols
+    ]
+    if len(key_cols) < 2:
+        # A single column, e.g. the label, puts all the rows sharing its
+        # value in the same split
+        raise ValueError(
+            f"Only {key_cols or 'no columns'} left to hash once the imputed "
+            f"columns are excluded, set data_split.split_key_cols to the "
+            f"columns the hash splitter assigns the rows from"
+        )
+    return key_cols
+
+
+def _split_fractions(config: dict) -> np.ndarray:
+    """Expected train, val and test shares of the rows."""
+    test_frac = config["data_split"]["test_frac"]
+    val_frac = (1 - test_frac) * config["data_split"]["val_frac"]
+    return np.array([1 - test_frac - val_frac, val_frac, test_frac])
+
+
+def _iter_cleansed_data(config: dict, data: pd.DataFrame | None):
+    """The cleansed data in chunks, read from its artefact if None."""
+    if data is not None:
+        return iter([data])
+    return artefacts.iter_artefact(
+        get_cleansed_data_path(config),
+        artefacts.get_artefact_format(config),
+        SPLIT_CHUNK_ROWS,
+    )
+
+
+def _write_chunked_splits(config: dict, chunks, assign) -> None:
+    """Write the chunks to the splits `assign(chunk)` puts the rows in.
+
+    Every chunk is split on its own, so memory is bounded by the chunk
+    size.
+    """
+    label_column = config["data_split"]["label_col"]
+
+    with ExitStack() as stack:
+        writers = {
+            split: stack.enter_context(
+                artefacts.open_split_writer(config, path)
+            )
+            for split, path in artefacts.get_split_paths(config).items()
+        }
+        empty = None
+        rows = 0
+        for chunk in chunks:
+            rows += len(chunk)
+            # Same column order as the random splitter, the label last
+            chunk = chunk[
+                [col for col in chunk.columns if col != label_column]
+                + [label_column]
+            ]
+            labels = assign(chunk)
+            for split, writer in writers.items():
+                if (labels == split).any():
+                    writer.write(chunk[labels == split])
+            empty = chunk.iloc[:0]
+        # Splits without any row still get a file, with the header only
+        for writer in writers.values():
+            if writer.rows == 0 and empty is not None:
+                writer.write(empty)
+    digests = {}
+    for writer in writers.values():
+        digests.update(writer.digests)
+    artefacts.save_digests(config, digests)
+    metrics.record(
+        rows_in=rows, rows_out=sum(writer.rows for writer in writers.values())
+    )
+
+
+def _hash_split(config: dict, data: pd.DataFrame | None) -> None:
+    """Split the cleansed data chunk by chunk from a hash of its rows.
+
+    A row lands in the same split whatever the other rows.
+    """
+
+    def assign(chunk: pd.DataFrame) -> np.ndarray:
+        return hash_split_labels(
+            chunk[get_split_key_cols(config, chunk.columns)],
+            config["data_split"]["seed"],
+            config["data_split"]["test_frac"],
+            config["data_split"]["val_frac"],
+        )
+
+    _write_chunked_splits(config, _iter_cleansed_data(config, data), assign)
+
+
+def _stratified_split(config: dict, data: pd.DataFrame | None) -> None:
+    """Split the cleansed data chunk by chunk, stratified on the label.
+
+    The first pass estimates the label quantiles, which bound
+    `stratify_bins` bins of about as many rows. The second pass gives the
+    rows of each bin to the splits that are furthest behind their share
+    of the bin, so the label distribution is the same in every split.
+    """
+    label_column = config["data_split"]["label_col"]
+    bins = config["data_split"].get("stratify_bins", DEFAULT_STRATIFY_BINS)
+
+    # 1. First pass: the label quantiles bounding the bins
+    sketch = NumericSketch()
+    for chunk in _iter_cleansed_data(config, data):
+        sketch.update(chunk[label_column])
+    edges = np.unique(sketch.quantiles(np.linspace(0, 1, bins + 1)[1:-1]))
+    utils.logger.info(
+        f"Stratified split on {len(edges) + 1} bins of {label_column}"
+    )
+
+    # 2. Second pass: assign the rows of each bin to the splits
+    fractions = _split_fractions(config)
+    split_names = np.array(["train", "val", "test"], dtype=object)
+    bin_counts = np.zeros((len(edges) + 1, len(fractions)), dtype="int64")
+    rng = np.random.default_rng(config["data_split"]["seed"])
+
+    def assign(chunk: pd.DataFrame) -> np.ndarray:
+        labels = np.empty(len(chunk), dtype=object)
+        row_bins = np.searchsorted(
+            edges, chunk[label_column].to_numpy(dtype="float64")
+        )
+        for row_bin in np.unique(row_bins):
+            rows = rng.permutation(np.flatnonzero(row_bins == row_bin))
+            quotas = _quotas(bin_counts[row_bin], fractions, len(rows))
+            labels[rows] = np.repeat(split_names, quotas)
+            bin_counts[row_bin] += quotas
+        return labels
+
+    _write_chunked_splits(config, _iter_cleansed_data(config, data), assign)
+
+
+def _quotas(
+    counts: np.ndarray, fractions: np.ndarray, rows: int
+) -> np.ndarray:
+    """Split `rows` new rows to bring `counts` closest to `fractions`."""
+    deficits = np.maximum(fractions * (counts.sum() + rows) - counts, 0)
+    shares = deficits / deficits.sum() * rows
+    quotas = np.floor(shares).astype("int64")
+    # Largest remainders get the rows left over by the rounding down
+    leftover = rows - quotas.sum()
+    quotas[np.argsort(quotas - shares, kind="stable")[:leftover]] += 1
+    return quotas
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """splitmix64 finaliser, spreads every input bit over the output."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _seeded(hashes: np.ndarray, seed: int) -> np.ndarray:
+    """Derive independent hashes for every seed."""
+    seed_hash = _mix64(np.array([seed], dtype="uint64"))[0]
+    return _mix64(hashes ^ seed_hash)
+
+
+def hash_split_labels(
+    data: pd.DataFrame, seed: int, test_frac: float, val_frac: float
+) -> np.ndarray:
+    """Assign every row to "train", "val" or "test" from a hash of it.
+
+    The assignment of a row only depends on its values and the seed, so
+    it doesn't change when other rows are added or removed. The expected
+    split proportions are the same as in `split_data`.
+    """
+    hashes = _seeded(utils.row_hashes(data), seed)
+    # Uniform draw in [0, 1) from the top 53 bits of the hash
+    draws = (hashes >> np.uint64(11)).astype("float64") / 2**53
+    labels = np.full(len(data), "train", dtype=object)
+    labels[draws < test_frac + (1 - test_frac) * val_frac] = "val"
+    labels[draws < test_frac] = "test"
+    return labels
+
+
 if __name__ == "__main__":
     config = utils.load_yaml_config()
     split_data(config)
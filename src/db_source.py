@@ -0,0 +1,218 @@
+"""Extract the rows of a database query into a csv file.
+
+The rows are fetched from a cursor in batches of `batch_rows` with
+`fetchmany`, and each batch is written before the next one is fetched,
+so memory is bounded by the batch size whatever the size of the table.
+On Postgres the cursor is a named, server-side cursor, so the results
+are not buffered on the client either.
+
+With a numeric `partition_col`, the query is split into `partitions`
+ranges of that column, exported concurrently by `workers` threads, each
+on its own connection, then concatenated in order. The rows are ordered
+by the column, the rows without a value last, whatever the number of
+ranges: with a unique `partition_col` the file and its md5 are the same
+for any number of `partitions`.
+
+The rows are written as csv, the raw data format of the pipeline.
+
+Supported drivers:
+    - sqlite: the SQLite `database` file, from the standard library
+    - postgres: the `dsn` of a Postgres database, needs psycopg2
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from src import artefacts, utils
+
+DRIVERS = ("sqlite", "postgres")
+DEFAULT_BATCH_ROWS = 50_000
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _connect(source: dict):
+    """Open a DB-API connection to the source database."""
+    driver = source.get("driver", "sqlite")
+    if driver not in DRIVERS:
+        raise ValueError(f"Unknown database driver: {driver}")
+    if driver == "sqlite":
+        # A connection per thread, the ranges are exported concurrently
+        return sqlite3.connect(source["database"], check_same_thread=False)
+    try:
+        import psycopg2
+    except ImportError as e:
+        raise ImportError(
+            "The postgres driver of the sql source needs psycopg2"
+        ) from e
+    return psycopg2.connect(source["dsn"])
+
+
+def _cursor(source: dict, connection):
+    """A cursor on the server for Postgres, a client one otherwise."""
+    if source.get("driver", "sqlite") == "postgres":
+        cursor = connection.cursor(name="data_ingestion_export")
+        cursor.itersize = source.get("batch_rows", DEFAULT_BATCH_ROWS)
+        return cursor
+    return connection.cursor()
+
+
+def _placeholder(source: dict) -> str:
+    return "%s" if source.get("driver", "sqlite") == "postgres" else "?"
+
+
+def _export(
+    source: dict, query: str, params: tuple, path: str
+) -> tuple[int, str]:
+    """Write the rows of a query to a csv file, batch by batch.
+
+    Returns:
+        tuple: The number of rows written and the md5 of the file
+    """
+    batch_rows = source.get("batch_rows", DEFAULT_BATCH_ROWS)
+    connection = _connect(source)
+    try:
+        cursor = _cursor(source, connection)
+        cursor.execute(query, params)
+        # A server-side cursor only describes its columns once fetched from
+        rows = cursor.fetchmany(batch_rows)
+        columns = [column[0] for column in cursor.description]
+        with artefacts.ArtefactWriter(path, "csv") as writer:
+            while rows:
+                writer.write(pd.DataFrame.from_records(rows, columns=columns))
+                rows = cursor.fetchmany(batch_rows)
+            if writer.rows == 0:
+                # The header only, as the other ranges have
+                writer.write(pd.DataFrame(columns=columns))
+        cursor.close()
+    finally:
+        connection.close()
+    return writer.rows, writer.digest["md5"]
+
+
+def _order_by(col: str) -> str:
+    """Order by the column, the rows without a value last on any database."""
+    return f"ORDER BY {col} IS NULL, {col}"
+
+
+def _key_ranges(source: dict) -> list:
+    """Bounds of the ranges of the partition column, None if unknown."""
+    col = source["partition_col"]
+    connection = _connect(source)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            f"SELECT MIN({col}), MAX({col}) FROM ({source['query']}) AS q"
+        )
+        low, high = cursor.fetchone()
+        cursor.close()
+    finally:
+        connection.close()
+    if low is None:
+        return None
+    partitions = source["partitions"]
+    step = (high - low) / partitions
+    bounds = [low + i * step for i in range(partitions)] + [high]
+    if isinstance(low, int) and isinstance(high, int):
+        bounds = [int(bound) for bound in bounds]
+    # Fewer ranges than partitions when there are fewer distinct bounds,
+    # as a range with equal bounds would always be empty
+    bounds = list(dict.fromkeys(bounds))
+    if len(bounds) == 1:
+        return [(low, high)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _range_queries(source: dict, ranges: list) -> list:
+    """Query and parameters of every range, the last one closed.
+
+    The rows without a partition key go to the last range.
+    """
+    col = source["partition_col"]
+    mark = _placeholder(source)
+    queries = []
+    for i, (low, high) in enumerate(ranges):
+        upper = "<=" if i == len(ranges) - 1 else "<"
+        condition = f"({col} >= {mark} AND {col} {upper} {mark})"
+        if i == len(ranges) - 1:
+            condition += f" OR {col} IS NULL"
+        queries.append(
+            (
+                f"SELECT * FROM ({source['query']}) AS q "
+                f"WHERE {condition} {_order_by(col)}",
+                (low, high),
+            )
+        )
+    return queries
+
+
+def _concat_csv(part_paths: list, output_path: str) -> str:
+    """Concatenate csv files with the same header, returns their md5."""
+    digest = hashlib.md5()
+    with open(output_path, "wb") as output:
+        for i, part_path in enumerate(part_paths):
+            with open(part_path, "rb") as part:
+                # Only the header of the first range is kept
+                if i > 0:
+                    part.readline()
+                while chunk := part.read(COPY_CHUNK_SIZE):
+                    output.write(chunk)
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def export_query(source: dict, output_path: str) -> str:
+    """Export the rows of the source query to a csv file.
+
+    Args:
+        source (dict): The sql source config
+        output_path (str): The csv file to write
+
+    Returns:
+        str: The md5 of the csv file written
+    """
+    ranges = None
+    query = source["query"]
+    if col := source.get("partition_col"):
+        if source.get("partitions", 1) > 1:
+            ranges = _key_ranges(source)
+        # Same order as the range queries
+        query = f"SELECT * FROM ({query}) AS q {_order_by(col)}"
+    if not ranges:
+        rows, digest = _export(source, query, (), output_path)
+        utils.logger.info(f"Exported {rows} rows of {source['name']}")
+        return digest
+
+    queries = _range_queries(source, ranges)
+    with tempfile.TemporaryDirectory(
+        dir=os.path.dirname(os.path.abspath(output_path))
+    ) as tmp_dir:
+        part_paths = [
+            os.path.join(tmp_dir, f"part-{i:05d}.csv")
+            for i in range(len(queries))
+        ]
+        with ThreadPoolExecutor(
+            max_workers=source.get("workers") or len(queries)
+        ) as executor:
+            exports = list(
+                executor.map(
+                    lambda args: _export(source, *args),
+                    [
+                        (query, params, part_path)
+                        for (query, params), part_path in zip(
+                            queries, part_paths
+                        )
+                    ],
+                )
+            )
+        rows = sum(part_rows for part_rows, _ in exports)
+        digest = _concat_csv(part_paths, output_path)
+    utils.logger.info(
+        f"Exported {rows} rows of {source['name']} in {len(queries)} "
+        f"ranges of {source['partition_col']}"
+    )
+    return digest
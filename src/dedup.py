@@ -0,0 +1,227 @@
+"""Exact duplicate rows of data read in chunks, with bounded memory.
+
+Every row is hashed to 128 bits with `utils.row_hashes128`, so distinct
+rows only collide with a probability of about rows² / 2¹²⁹, e.g. 1e-23
+for 100M rows. The hashes and position of the rows are kept in numpy
+records, 24 bytes a row, until they reach the memory budget. Then the
+rows repeating an earlier row of the buffer are dropped, and the others
+are spilled to temporary files, partitioned by their hash so that all
+the copies of a row are in the same partition. Once every row was
+added, each partition is deduplicated on its own, and split again by
+other bits of the hash if it doesn't fit in the budget.
+
+A row is kept if no earlier row has the same hash, so the first
+occurrence of every row is kept, as by `drop_duplicates`. The rows kept
+are recorded in a bitmap, 1 bit a row.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from src import utils
+
+# Columns of the records of the rows: their two hashes and position
+H1, H2, ROW = range(3)
+RECORD_BYTES = 3 * 8
+DEFAULT_PARTITIONS = 64
+# Times a partition larger than the budget is split again at most
+MAX_DEPTH = 3
+# Rows hashed at once by `drop_duplicates`
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+
+class Deduplicator:
+    """Find the duplicated rows of data added chunk by chunk.
+
+    Add the chunks in order with `add`, or their `utils.row_hashes128`
+    with `add_hashes`, then call `finish`. `keep_masks` then gives the
+    rows to keep of every chunk added.
+
+    Memory is about three times `memory_budget_bytes` while sorting the
+    hashes, plus the bitmap. The spilled hashes take 24 bytes a row of
+    disk space in `tmp_dir`.
+    """
+
+    def __init__(
+        self,
+        memory_budget_bytes: int,
+        partitions: int = DEFAULT_PARTITIONS,
+        tmp_dir: str | None = None,
+    ):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.partitions = partitions
+        self.tmp_dir = tmp_dir
+        self.rows = 0
+        self.duplicates = 0
+        # Whether the hashes did not fit in the budget
+        self.spilled = False
+        self._buffer = []
+        self._buffered = 0
+        self._bounds = []
+        self._keep = bytearray()
+        self._tmp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, chunk: pd.DataFrame) -> None:
+        """Add the next chunk of rows."""
+        self.add_hashes(utils.row_hashes128(chunk))
+
+    def add_hashes(self, hashes: np.ndarray) -> None:
+        """Add the 128 bit hashes of the next chunk of rows."""
+        records = np.empty((len(hashes), 3), dtype="uint64")
+        records[:, [H1, H2]] = hashes
+        records[:, ROW] = np.arange(self.rows, self.rows + len(hashes))
+        self._bounds.append((self.rows, self.rows + len(hashes)))
+        self.rows += len(hashes)
+        # Every row is kept until found to be a duplicate
+        self._keep.extend(b"\xff" * (-(-self.rows // 8) - len(self._keep)))
+        self._buffer.append(records)
+        self._buffered += records.nbytes
+        if self._buffered > self.memory_budget_bytes:
+            self._spill()
+
+    def _collapse(self, records: np.ndarray) -> np.ndarray:
+        """Mark the rows repeating an earlier one, returns the others."""
+        records = np.take(records, np.argsort(records[:, H1]), axis=0)
+        h1, h2, rows = records[:, H1], records[:, H2], records[:, ROW]
+        new_run = np.empty(len(records), dtype=bool)
+        new_run[:1] = True
+        np.not_equal(h1[1:], h1[:-1], out=new_run[1:])
+        starts = np.flatnonzero(new_run)
+        run = np.cumsum(new_run) - 1
+        if (h2 != h2[starts][run]).any():
+            # Distinct rows with the same first hash, rare enough to sort
+            # on the whole hash
+            order = np.lexsort((rows, h2, h1))
+            records = np.take(records, order, axis=0)
+            h1, h2, rows = records[:, H1], records[:, H2], records[:, ROW]
+            repeated = np.zeros(len(records), dtype=bool)
+            repeated[1:] = (h1[1:] == h1[:-1]) & (h2[1:] == h2[:-1])
+        else:
+            # The first occurrence is the lowest row of the run
+            first = np.minimum.reduceat(rows, starts) if len(rows) else rows
+            repeated = rows != first[run]
+        self._mark(rows[repeated])
+        return records[~repeated]
+
+    def _mark(self, rows: np.ndarray) -> None:
+        """Clear the bits of the duplicated rows."""
+        keep = np.frombuffer(self._keep, dtype="uint8")
+        bits = (rows & np.uint64(7)).astype("uint8")
+        np.bitwise_and.at(
+            keep, rows >> np.uint64(3), ~(np.uint8(0x80) >> bits)
+        )
+        self.duplicates += len(rows)
+
+    def _path(self, partition: tuple) -> str:
+        return os.path.join(self._tmp.name, "-".join(map(str, partition)))
+
+    def _write_partitions(self, records: np.ndarray, parent: tuple) -> None:
+        """Append the records to the partitions of `parent` by hash."""
+        # Each level partitions on other bits of the hash
+        keys = (
+            records[:, H1] // np.uint64(self.partitions ** len(parent))
+        ) % np.uint64(self.partitions)
+        order = np.argsort(keys)
+        records = np.take(records, order, axis=0)
+        bounds = np.searchsorted(keys[order], np.arange(self.partitions + 1))
+        for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if start < stop:
+                with open(self._path((*parent, i)), "ab") as file:
+                    records[start:stop].tofile(file)
+
+    def _spill(self) -> None:
+        if self._tmp is None:
+            self._tmp = tempfile.TemporaryDirectory(
+                prefix="dedup-", dir=self.tmp_dir
+            )
+            self.spilled = True
+            utils.logger.info(
+                f"Row hashes past {self.memory_budget_bytes} bytes, spilling "
+                f"them to {self.partitions} partitions"
+            )
+        if self._buffer:
+            records = self._collapse(np.concatenate(self._buffer))
+            self._write_partitions(records, ())
+        self._buffer = []
+        self._buffered = 0
+
+    def _dedup_partition(self, partition: tuple) -> None:
+        path = self._path(partition)
+        if (
+            os.path.getsize(path) > self.memory_budget_bytes
+            and len(partition) < MAX_DEPTH
+        ):
+            block = 3 * max(1, self.memory_budget_bytes // RECORD_BYTES)
+            with open(path, "rb") as file:
+                while len(
+                    records := np.fromfile(file, dtype="uint64", count=block)
+                ):
+                    self._write_partitions(records.reshape(-1, 3), partition)
+            os.remove(path)
+            for i in range(self.partitions):
+                if os.path.exists(self._path((*partition, i))):
+                    self._dedup_partition((*partition, i))
+            return
+        self._collapse(np.fromfile(path, dtype="uint64").reshape(-1, 3))
+        os.remove(path)
+
+    def finish(self) -> None:
+        """Find the duplicates once all the rows were added."""
+        if self._tmp is None:
+            if self._buffer:
+                self._collapse(np.concatenate(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+            return
+        self._spill()
+        for i in range(self.partitions):
+            if os.path.exists(self._path((i,))):
+                self._dedup_partition((i,))
+        self.close()
+
+    def keep_mask(self, start: int, stop: int) -> np.ndarray:
+        """Whether to keep each row from `start` to `stop`."""
+        keep = np.frombuffer(self._keep, dtype="uint8")
+        first, last = start >> 3, -(-stop // 8)
+        offset = start & 7
+        end = offset + stop - start
+        return np.unpackbits(keep[first:last])[offset:end].astype(bool)
+
+    def keep_masks(self):
+        """The rows to keep of each chunk, in the order they were added."""
+        for start, stop in self._bounds:
+            yield self.keep_mask(start, stop)
+
+    def close(self) -> None:
+        """Remove the spilled hashes."""
+        if self._tmp is not None:
+            self._tmp.cleanup()
+            self._tmp = None
+
+
+def drop_duplicates(
+    df: pd.DataFrame,
+    memory_budget_bytes: int,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    tmp_dir: str | None = None,
+) -> pd.DataFrame:
+    """The rows of `df` without duplicates, as `df.drop_duplicates()`.
+
+    The rows are hashed `chunk_rows` at a time, so the only copy of the
+    data is the result.
+    """
+    with Deduplicator(memory_budget_bytes, tmp_dir=tmp_dir) as dedup:
+        for start in range(0, len(df), chunk_rows):
+            stop = start + chunk_rows
+            dedup.add(df.iloc[start:stop])
+        dedup.finish()
+        return df[dedup.keep_mask(0, len(df))]
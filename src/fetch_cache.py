@@ -0,0 +1,82 @@
+"""Persistent cache of the raw data source validators.
+
+The cache is a small json file keyed by the data url. Each entry holds
+the `ETag` and `Last-Modified` validators returned by the server, the
+sha256 digest of the downloaded file, the size of the file it was saved
+as, decompressed if it was compressed, and whether that version of the
+file went through the whole ingestion pipeline.
+
+The sources are fetched concurrently, so the entries are updated under a
+lock, and the cache is written to a temporary file of its own before it
+replaces the cache file.
+"""
+
+import json
+import os
+import tempfile
+import threading
+
+from src import utils
+
+# Serialises the read, update and write of the cache across threads
+_lock = threading.Lock()
+
+
+def load_fetch_cache(cache_path: str) -> dict:
+    """Load the fetch cache, an empty cache if it doesn't exist."""
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, "r") as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError) as e:
+        utils.logger.warning(f"Ignoring unreadable fetch cache: {e}")
+        return {}
+
+
+def save_fetch_cache(cache_path: str, cache: dict) -> None:
+    """Atomically write the fetch cache."""
+    cache_dir = os.path.dirname(cache_path) or "."
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w",
+        dir=cache_dir,
+        prefix=f"{os.path.basename(cache_path)}.",
+        suffix=".tmp",
+        delete=False,
+    ) as cache_file:
+        json.dump(cache, cache_file, indent=2)
+    os.replace(cache_file.name, cache_path)
+
+
+def get_entry(cache_path: str, url: str, output_path: str) -> dict | None:
+    """Get the cache entry of `url` if the file it describes is present.
+
+    An entry is only usable when `output_path` still holds the file that
+    was cached, which is checked from its size.
+    """
+    entry = load_fetch_cache(cache_path).get(url)
+    if (
+        entry is None
+        or not os.path.exists(output_path)
+        or os.path.getsize(output_path) != entry.get("size")
+    ):
+        return None
+    return entry
+
+
+def update_entry(cache_path: str, url: str, entry: dict) -> None:
+    """Replace the cache entry of `url`."""
+    with _lock:
+        cache = load_fetch_cache(cache_path)
+        cache[url] = entry
+        save_fetch_cache(cache_path, cache)
+
+
+def mark_ingested(cache_path: str, url: str) -> None:
+    """Record that the cached version of `url` was fully ingested."""
+    with _lock:
+        cache = load_fetch_cache(cache_path)
+        if url in cache:
+            cache[url]["ingested"] = True
+            save_fetch_cache(cache_path, cache)
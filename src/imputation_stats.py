@@ -0,0 +1,312 @@
+"""Streaming statistics used to impute missing values.
+
+The statistics are kept as value counts, which can be updated chunk by
+chunk and merged across partitions. They give the same medians and most
+frequent values as `SimpleImputer` fitted on the whole dataset.
+
+The statistics of the cleansed data are saved as a json sidecar of the
+splits, versioned by DVC with them. It holds the median or most frequent
+value of every column, the one its gaps were imputed with, and the value
+counts to update them when rows are added. Load it with
+`ImputationStats.load` to impute new rows the same way without refitting.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Number of distinct values kept before a numeric sketch is compacted
+DEFAULT_MAX_DISTINCT = 100_000
+
+
+def _round_significant(values: np.ndarray, digits: int) -> np.ndarray:
+    """Round values to a number of significant digits."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        magnitude = np.floor(np.log10(np.abs(values)))
+    magnitude = np.where(np.isfinite(magnitude), magnitude, 0)
+    scale = 10.0 ** (digits - 1 - magnitude)
+    return np.round(values * scale) / scale
+
+
+class NumericSketch:
+    """Mergeable value counts of a numeric column to compute its median.
+
+    The median is exact while the column has at most `max_distinct`
+    distinct values. Past that, values are rounded to fewer significant
+    digits until they fit, which makes the median approximate with a
+    relative error bounded by the remaining precision. With
+    `max_distinct=None` the counts are never rounded.
+    """
+
+    def __init__(self, max_distinct: int | None = DEFAULT_MAX_DISTINCT):
+        self.max_distinct = max_distinct
+        self.counts = pd.Series(dtype="float64")
+        # Significant digits kept, None while the counts are exact
+        self.digits = None
+
+    @property
+    def exact(self) -> bool:
+        """Whether the counts hold the exact values."""
+        return self.digits is None
+
+    def update(self, values: pd.Series) -> None:
+        """Add the non missing values of a chunk to the counts."""
+        values = values.dropna().to_numpy(dtype="float64")
+        if self.digits is not None:
+            values = _round_significant(values, self.digits)
+        counts = pd.Series(values).value_counts()
+        self.counts = self.counts.add(counts, fill_value=0)
+        self._compact()
+
+    def merge(self, other: "NumericSketch") -> None:
+        """Merge the counts of another sketch of the same column."""
+        other_counts = other.counts
+        if other.digits is not None and (
+            self.digits is None or other.digits < self.digits
+        ):
+            self._round_to(other.digits)
+        elif self.digits is not None:
+            other_counts = self._rounded(other_counts, self.digits)
+        self.counts = self.counts.add(other_counts, fill_value=0)
+        self._compact()
+
+    @staticmethod
+    def _rounded(counts: pd.Series, digits: int) -> pd.Series:
+        index = _round_significant(counts.index.to_numpy(), digits)
+        return counts.groupby(index).sum()
+
+    def _round_to(self, digits: int) -> None:
+        self.counts = self._rounded(self.counts, digits)
+        self.digits = digits
+
+    def _compact(self) -> None:
+        if self.max_distinct is None:
+            return
+        digits = self.digits or 16
+        while len(self.counts) > self.max_distinct and digits > 1:
+            digits -= 1
+            self._round_to(digits)
+
+    def to_dict(self, max_distinct: int | None = DEFAULT_MAX_DISTINCT) -> dict:
+        """The median and the counts, compacted to `max_distinct` values.
+
+        The median is the one of the counts before they are compacted.
+        """
+        sketch = self
+        if max_distinct is not None and len(self.counts) > max_distinct:
+            sketch = NumericSketch(max_distinct)
+            sketch.merge(self)
+        counts = sketch.counts.sort_index()
+        return {
+            "median": self.median(),
+            "count": self.count,
+            "digits": sketch.digits,
+            "values": counts.index.tolist(),
+            "counts": counts.astype("int64").tolist(),
+        }
+
+    @classmethod
+    def from_dict(
+        cls, data: dict, max_distinct: int | None = DEFAULT_MAX_DISTINCT
+    ) -> "NumericSketch":
+        """The sketch of the counts saved by `to_dict`."""
+        sketch = cls(max_distinct)
+        sketch.counts = pd.Series(
+            data["counts"],
+            index=pd.Index(data["values"], dtype="float64"),
+            dtype="float64",
+        )
+        sketch.digits = data["digits"]
+        sketch._compact()
+        return sketch
+
+    @property
+    def count(self) -> int:
+        """Number of non missing values seen."""
+        return int(self.counts.sum())
+
+    def median(self) -> float:
+        """Median of the values seen, NaN if there are none."""
+        total = self.count
+        if total == 0:
+            return np.nan
+        counts = self.counts.sort_index()
+        cumulative = counts.cumsum().to_numpy()
+        values = counts.index.to_numpy()
+        # Same convention as numpy, the mean of the two middle values
+        lower = values[np.searchsorted(cumulative, (total - 1) // 2 + 1)]
+        upper = values[np.searchsorted(cumulative, total // 2 + 1)]
+        return float((lower + upper) / 2)
+
+    def quantiles(self, qs) -> np.ndarray:
+        """Quantiles of the values seen, the lower of the nearest values."""
+        if self.count == 0:
+            return np.full(len(qs), np.nan)
+        counts = self.counts.sort_index()
+        cumulative = counts.cumsum().to_numpy()
+        positions = np.floor(np.asarray(qs) * (self.count - 1)) + 1
+        return counts.index.to_numpy()[np.searchsorted(cumulative, positions)]
+
+
+class CategoricalSketch:
+    """Mergeable value counts of a categorical column to compute its mode.
+
+    Ties are broken with the smallest value, as `SimpleImputer` does.
+    """
+
+    def __init__(self):
+        self.counts = pd.Series(dtype="int64")
+
+    def update(self, values: pd.Series) -> None:
+        """Add the non missing values of a chunk to the counts."""
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Count the category codes, without going through the values
+            codes = values.cat.codes.to_numpy()
+            counts = pd.Series(
+                np.bincount(
+                    codes[codes >= 0], minlength=len(values.cat.categories)
+                ),
+                index=values.cat.categories.astype("object"),
+            )
+            counts = counts[counts > 0]
+        else:
+            counts = values.value_counts(dropna=True)
+        self.counts = self.counts.add(counts, fill_value=0)
+
+    def merge(self, other: "CategoricalSketch") -> None:
+        """Merge the counts of another sketch of the same column."""
+        self.counts = self.counts.add(other.counts, fill_value=0)
+
+    @property
+    def count(self) -> int:
+        """Number of non missing values seen."""
+        return int(self.counts.sum())
+
+    def most_frequent(self):
+        """Most frequent value seen, NaN if there are none."""
+        if self.counts.empty:
+            return np.nan
+        top = self.counts[self.counts == self.counts.max()]
+        return min(top.index)
+
+    def to_dict(self) -> dict:
+        """The most frequent value and the counts."""
+        counts = self.counts.sort_index()
+        return {
+            "most_frequent": self.most_frequent(),
+            "count": self.count,
+            "values": counts.index.tolist(),
+            "counts": counts.astype("int64").tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CategoricalSketch":
+        """The sketch of the counts saved by `to_dict`."""
+        sketch = cls()
+        sketch.counts = pd.Series(
+            data["counts"],
+            index=pd.Index(data["values"], dtype="object"),
+            dtype="int64",
+        )
+        return sketch
+
+
+def impute(df: pd.DataFrame, medians: dict, modes: dict) -> pd.DataFrame:
+    """Fill the gaps of the numeric and categorical columns in place.
+
+    The numeric columns become float64 and the categorical ones object,
+    as with `SimpleImputer`.
+    """
+    numeric_cols, categorical_cols = list(medians), list(modes)
+    df[numeric_cols] = df[numeric_cols].fillna(medians).astype("float64")
+    df[categorical_cols] = df[categorical_cols].astype("object").fillna(modes)
+    return df
+
+
+class ImputationStats:
+    """The sketches of the numeric and categorical columns of the data."""
+
+    def __init__(
+        self,
+        numeric_cols: list = (),
+        categorical_cols: list = (),
+        max_distinct: int | None = DEFAULT_MAX_DISTINCT,
+    ):
+        self.numeric = {
+            col: NumericSketch(max_distinct) for col in numeric_cols
+        }
+        self.categorical = {
+            col: CategoricalSketch() for col in categorical_cols
+        }
+
+    def update(self, df: pd.DataFrame) -> None:
+        """Add the values of a chunk of rows."""
+        for col, sketch in self.numeric.items():
+            sketch.update(df[col])
+        for col, sketch in self.categorical.items():
+            sketch.update(df[col])
+
+    def merge(self, other: "ImputationStats") -> None:
+        """Merge the statistics of other rows, on the columns of these."""
+        for col, sketch in self.numeric.items():
+            if col in other.numeric:
+                sketch.merge(other.numeric[col])
+        for col, sketch in self.categorical.items():
+            if col in other.categorical:
+                sketch.merge(other.categorical[col])
+
+    def medians(self) -> dict:
+        """The median of each numeric column."""
+        return {col: sketch.median() for col, sketch in self.numeric.items()}
+
+    def modes(self) -> dict:
+        """The most frequent value of each categorical column."""
+        return {
+            col: sketch.most_frequent()
+            for col, sketch in self.categorical.items()
+        }
+
+    def impute(self, df: pd.DataFrame) -> pd.DataFrame:
+        """A copy of the rows with their gaps filled."""
+        return impute(df.copy(), self.medians(), self.modes())
+
+    def save(self, path: str) -> None:
+        """Write the statistics as json, replacing the file at once."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as stats_file:
+            json.dump(
+                {
+                    "numeric": {
+                        col: sketch.to_dict()
+                        for col, sketch in self.numeric.items()
+                    },
+                    "categorical": {
+                        col: sketch.to_dict()
+                        for col, sketch in self.categorical.items()
+                    },
+                },
+                stats_file,
+                indent=2,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(
+        cls, path: str, max_distinct: int | None = DEFAULT_MAX_DISTINCT
+    ) -> "ImputationStats":
+        """Read the statistics written by `save`."""
+        with open(path, "r") as stats_file:
+            data = json.load(stats_file)
+        stats = cls()
+        stats.numeric = {
+            col: NumericSketch.from_dict(sketch, max_distinct)
+            for col, sketch in data["numeric"].items()
+        }
+        stats.categorical = {
+            col: CategoricalSketch.from_dict(sketch)
+            for col, sketch in data["categorical"].items()
+        }
+        return stats
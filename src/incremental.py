@@ -0,0 +1,236 @@
+"""Incremental ingestion of the rows appended to the raw data.
+
+The rows already ingested are recorded in a state directory, versioned
+by DVC with the splits so that every `data-vX.Y.Z` tag holds the state
+of its data:
+    - state.json: the size and sha256 of the raw file ingested so far,
+        which is the high-watermark of the next run
+    - row_hashes.npy: the sorted hashes of every raw row ingested, to
+        drop the new rows that duplicate an ingested one
+
+The state, splits and statistics of the `data-latest` tag are restored
+from the DVC remote before a run, as the workspace may be a fresh one.
+
+When the previously ingested raw file is a prefix of the new one, only
+the appended rows are cleansed. They are assigned to train, val and test
+from a hash of their values, and written as a new partition of each
+split directory, so the existing partitions are never rewritten. If the
+raw file changed in any other way, the splits are rebuilt from scratch.
+
+The gaps of the appended rows are imputed with the statistics of all the
+rows ingested, updated from the imputation statistics sidecar of the
+previous run instead of refitted on the whole data.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from src import artefacts, utils
+from src.data_cleansing import clean_data
+from src.data_splitting import get_split_key_cols, hash_split_labels
+from src.imputation_stats import ImputationStats
+
+STATE_FILE = "state.json"
+ROW_HASHES_FILE = "row_hashes.npy"
+
+
+def is_enabled(config: dict) -> bool:
+    """Whether the incremental ingestion is enabled."""
+    return config.get("incremental", {}).get("enabled", False)
+
+
+def get_state_dir(config: dict) -> str:
+    """Get the directory of the incremental ingestion state."""
+    return config["incremental"]["state_dir"]
+
+
+def load_state(state_dir: str) -> tuple[dict, np.ndarray]:
+    """Load the ingestion state, an empty state if there is none."""
+    state_path = os.path.join(state_dir, STATE_FILE)
+    hashes_path = os.path.join(state_dir, ROW_HASHES_FILE)
+    if not (os.path.exists(state_path) and os.path.exists(hashes_path)):
+        return {}, np.empty(0, dtype="uint64")
+    with open(state_path, "r") as state_file:
+        state = json.load(state_file)
+    return state, np.load(hashes_path)
+
+
+def save_state(state_dir: str, state: dict, hashes: np.ndarray) -> None:
+    """Save the ingestion state."""
+    os.makedirs(state_dir, exist_ok=True)
+    np.save(os.path.join(state_dir, ROW_HASHES_FILE), hashes)
+    with open(os.path.join(state_dir, STATE_FILE), "w") as state_file:
+        json.dump(state, state_file, indent=2)
+
+
+def restore_state(config: dict, fs) -> bool:
+    """Restore the state, splits and statistics of the latest data version.
+
+    `fs` is the file system of the data repo at the latest data tag, see
+    `data_push.open_data_fs`. The state of a fresh workspace is otherwise
+    empty, and the splits would be rebuilt on every run. Returns whether
+    the local files were replaced.
+    """
+    state_dir = get_state_dir(config)
+    tagged_state = os.path.join(os.path.normpath(state_dir), STATE_FILE)
+    if not fs.exists(tagged_state):
+        utils.logger.info("No ingestion state at the latest data version")
+        return False
+    local_state = os.path.join(state_dir, STATE_FILE)
+    if os.path.exists(local_state):
+        with open(local_state, "rb") as state_file:
+            if state_file.read() == fs.cat_file(tagged_state):
+                return False
+
+    paths = [
+        *artefacts.get_split_dirs(config).values(),
+        state_dir,
+        artefacts.get_imputation_stats_path(config),
+    ]
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        repo_path = os.path.normpath(path)
+        if fs.exists(repo_path):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            fs.get(repo_path, path, recursive=fs.isdir(repo_path))
+    utils.logger.info(
+        "Restored the ingestion state of the latest data version"
+    )
+    return True
+
+
+def _digests(path: str, prefix_size: int) -> tuple[str, str]:
+    """sha256 of the first `prefix_size` bytes and of the whole file."""
+    digest = hashlib.sha256()
+    prefix_digest = None
+    with open(path, "rb") as file:
+        remaining = prefix_size
+        while remaining > 0 and (chunk := file.read(min(remaining, 2**20))):
+            digest.update(chunk)
+            remaining -= len(chunk)
+        if prefix_size:
+            prefix_digest = digest.hexdigest()
+        while chunk := file.read(2**20):
+            digest.update(chunk)
+    return prefix_digest, digest.hexdigest()
+
+
+def _is_appended(raw_path: str, state: dict, prefix_digest: str) -> bool:
+    """Whether the raw file only had rows appended since the state."""
+    if not state or prefix_digest != state["raw_sha256"]:
+        return False
+    with open(raw_path, "rb") as file:
+        file.seek(state["raw_bytes"] - 1)
+        # The new rows must start on a new line
+        return file.read(1) == b"\n"
+
+
+def read_delta(raw_path: str, state: dict) -> pd.DataFrame:
+    """Read the raw rows appended after the state high-watermark.
+
+    The rows are indexed by their position in the raw file, as when the
+    whole file is read.
+    """
+    with open(raw_path, "rb") as file:
+        header = pd.read_csv(file, nrows=0).columns
+        file.seek(state["raw_bytes"])
+        if not file.read(1):
+            delta = pd.DataFrame(columns=header)
+        else:
+            file.seek(state["raw_bytes"])
+            delta = pd.read_csv(file, header=None, names=header)
+    delta.index = pd.RangeIndex(state["rows"], state["rows"] + len(delta))
+    return delta
+
+
+def ingest_increment(config: dict) -> None:
+    """Cleanse, split and write the raw rows not ingested yet."""
+    raw_path = config["data_split"]["raw_data_save_path"]
+    state_dir = get_state_dir(config)
+    partition_dirs = artefacts.get_split_dirs(config)
+    stats_path = artefacts.get_imputation_stats_path(config)
+    state, seen_hashes = load_state(state_dir)
+    prefix_digest, raw_digest = _digests(raw_path, state.get("raw_bytes", 0))
+
+    if _is_appended(raw_path, state, prefix_digest) and all(
+        os.path.isdir(path) for path in partition_dirs.values()
+    ):
+        delta = read_delta(raw_path, state)
+        stats = None
+        if os.path.exists(stats_path):
+            stats = ImputationStats.load(stats_path)
+        utils.logger.info(
+            f"Incremental ingestion of {len(delta)} new raw rows after "
+            f"{state['rows']} ingested rows"
+        )
+    else:
+        utils.logger.info("Raw data not appended to, rebuilding the splits")
+        for path in partition_dirs.values():
+            shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(stats_path):
+            os.remove(stats_path)
+        stats = None
+        state = {"rows": 0, "partitions": 0}
+        seen_hashes = np.empty(0, dtype="uint64")
+        delta = pd.read_csv(raw_path)
+
+    # Drop the rows duplicating ingested rows, the duplicates within the
+    # new rows are dropped by the cleansing
+    hashes = utils.row_hashes(delta)
+    is_new = ~np.isin(hashes, seen_hashes)
+    rows = len(delta)
+    if is_new.any():
+        cleansed = clean_data(
+            config, data=delta[is_new], save=False, stats=stats
+        )
+        _write_partition(config, cleansed, state["partitions"])
+        state["partitions"] += 1
+    else:
+        utils.logger.info("No new raw rows to ingest")
+
+    state.update(
+        {
+            "raw_bytes": os.path.getsize(raw_path),
+            "raw_sha256": raw_digest,
+            "rows": state["rows"] + rows,
+        }
+    )
+    save_state(state_dir, state, np.union1d(seen_hashes, hashes[is_new]))
+
+
+def _write_partition(config: dict, data: pd.DataFrame, partition: int) -> None:
+    """Write the new rows of each split as a new partition."""
+    label_col = config["data_split"]["label_col"]
+    artefact_format = artefacts.get_artefact_format(config)
+    # Same column order as `split_data`, with the label last
+    data = data[
+        [col for col in data.columns if col != label_col] + [label_col]
+    ]
+    # The rows are assigned from their values only, not their position
+    labels = hash_split_labels(
+        data[get_split_key_cols(config, data.columns)],
+        config["data_split"]["seed"],
+        config["data_split"]["test_frac"],
+        config["data_split"]["val_frac"],
+    )
+    codec = artefacts.get_compression(config)
+    suffix = artefacts.artefact_suffix(artefact_format, codec["codec"])
+    digests = {}
+    for split, path in artefacts.get_split_dirs(config).items():
+        os.makedirs(path, exist_ok=True)
+        part_path = os.path.join(path, f"part-{partition:05d}{suffix}")
+        digests[part_path] = artefacts.write_artefact(
+            data[labels == split], part_path, artefact_format, **codec
+        )
+    artefacts.save_digests(config, digests)
+    utils.logger.info(
+        f"Wrote partition {partition} with {len(data)} cleansed rows"
+    )
@@ -1,33 +1,152 @@
 """Main training pipeline."""
 
-import os
-
-from src import utils
-from src.data_cleansing import clean_data
-from src.data_gathering import get_data_from_url
-from src.data_push import push_data
+from src import artefacts, incremental, metrics, stage_cache, utils
+from src.data_cleansing import clean_data, get_cleansed_data_path
+from src.data_gathering import (
+    gather_data,
+    get_download_options,
+    mark_ingested,
+    source_keys,
+)
+from src.data_push import get_authenticated_github_url, open_data_fs, push_data
 from src.data_splitting import split_data
 from src.utils import logger
 
+# The config values each stage output depends on, besides its inputs
+CLEANSING_KEYS = ("categorical_cols", "numeric_cols", "label_col")
+SPLITTING_KEYS = (
+    "splitter",
+    "split_key_cols",
+    "stratify_bins",
+    "seed",
+    "test_frac",
+    "val_frac",
+    "label_col",
+    "partition_rows",
+)
+PUSH_KEYS = (
+    "dvc_remote",
+    "dvc_remote_name",
+    "dvc_endpoint_url",
+    "git_repo_url",
+    "git_branch",
+    "commit_message",
+)
+
+
+def _data_split_params(config: dict, keys) -> dict:
+    return {
+        "artefact_format": artefacts.get_artefact_format(config),
+        "compression": artefacts.get_compression(config),
+        **{key: config["data_split"].get(key) for key in keys},
+    }
+
+
+def run_cached_stages(config: dict, cache) -> None:
+    """Cleanse, split and push, skipping the stages with unchanged inputs.
+
+    The stages hand the data over through their artefacts, so that they
+    can be skipped independently.
+    """
+    raw_path = config["data_split"]["raw_data_save_path"]
+    cleansed_path = get_cleansed_data_path(config)
+    stats_path = artefacts.get_imputation_stats_path(config)
+    split_outputs = artefacts.get_split_outputs(config)
+
+    stage_cache.run_stage(
+        cache,
+        "cleansing",
+        lambda: clean_data(config),
+        inputs=[raw_path],
+        params={
+            "data_cleansing": config.get("data_cleansing", {}),
+            **_data_split_params(config, CLEANSING_KEYS),
+        },
+        outputs=[cleansed_path, stats_path],
+    )
+    stage_cache.run_stage(
+        cache,
+        "splitting",
+        lambda: split_data(config),
+        inputs=[cleansed_path],
+        params=_data_split_params(config, SPLITTING_KEYS),
+        outputs=[*split_outputs, artefacts.get_digests_path(config)],
+    )
+    stage_cache.run_stage(
+        cache,
+        "push",
+        lambda: _push(config),
+        inputs=[*split_outputs, stats_path],
+        params={key: config[key] for key in PUSH_KEYS},
+    )
+
+
+def _push(config: dict) -> None:
+    if not push_data(config):
+        logger.info("No new data version, the latest one is up to date")
+
 
 def main():
     """Main Data versioning and ingestion pipeline."""
 
     config = utils.load_yaml_config()
     logger.info("Data Ingestion Config", extra=config)
+    metrics.configure(config)
+    try:
+        ingest(config)
+    finally:
+        # Also reported when a stage failed, with its failed status
+        metrics.write_report()
+
+
+def ingest(config: dict) -> None:
+    """Gather, cleanse, split and push the data."""
+    # Resolved now, as the push moves to the git workspace
+    fetch_cache_path = get_download_options(config)["fetch_cache_path"]
+    keys = source_keys(config)
+
+    # 1. Gather the data from all the sources, merged into the raw data
+    with metrics.stage("gathering"):
+        changed = gather_data(config)
+    # The incremental ingestion keeps its own state instead
+    cache = None
+    if not incremental.is_enabled(config):
+        cache = stage_cache.get_stage_cache(config)
+    if not changed and cache is None:
+        logger.info("Source data unchanged since the last ingestion, exiting")
+        return
 
-    # 1. Gather the data and download it locally
-    data_url = os.getenv("DATA_URL", config["data_url"])
-    get_data_from_url(data_url, config["data_split"]["raw_data_save_path"])
+    if cache is not None:
+        # 2-4. Only run the stages whose inputs or config changed
+        run_cached_stages(config, cache)
+    else:
+        if incremental.is_enabled(config):
+            # 2-3. Cleanse and split only the rows not ingested yet
+            with metrics.stage("incremental ingestion"):
+                # A fresh workspace starts from the latest data version
+                incremental.restore_state(
+                    config,
+                    open_data_fs(
+                        config,
+                        get_authenticated_github_url(config["git_repo_url"]),
+                    ),
+                )
+                incremental.ingest_increment(config)
+        else:
+            # 2. Cleanse the data, handing it over to the split in memory
+            with metrics.stage("cleansing"):
+                cleansed_data = clean_data(config, save=False)
 
-    # 2. Cleanse the data
-    clean_data(config)
+            # 3. Split the cleansed data
+            with metrics.stage("splitting"):
+                split_data(config, data=cleansed_data)
 
-    # 3. Load and split the cleansed data
-    split_data(config)
+        # 4. Update dvc and git
+        with metrics.stage("push"):
+            _push(config)
 
-    # 4. Update dvc and git
-    push_data(config)
+    # Only now the data is versioned, skip it on the next unchanged fetch
+    mark_ingested(fetch_cache_path, keys)
 
 
 if __name__ == "__main__":
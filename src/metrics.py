@@ -0,0 +1,207 @@
+"""Metrics of the pipeline stages.
+
+`stage(name)` measures a stage of the pipeline:
+    - wall_seconds and cpu_seconds, the CPU time including the worker
+        processes that ended during the stage
+    - peak_rss_bytes: the peak resident memory of the process during the
+        stage, or since it started where it can't be reset
+    - bytes_read and bytes_written by the process, when /proc is there
+
+The stage code adds the counts only it knows with `record`, e.g. the
+rows in and out or the bytes uploaded. Every stage is logged with its
+metrics as structured fields, and `write_report` writes the stages of
+the run as a json report and, optionally, a Prometheus textfile. With
+`profile_dir` set, each top level stage is profiled with cProfile into
+`<profile_dir>/<stage>.prof`.
+"""
+
+import cProfile
+import json
+import os
+import re
+import resource
+import time
+from contextlib import contextmanager
+
+from src import utils
+
+PROMETHEUS_PREFIX = "data_ingestion_stage"
+
+_settings = {"report_path": None, "prometheus_path": None, "profile_dir": None}
+# Stages being measured, innermost last
+_active = []
+# Stages of the run, in the order they ended
+_stages = []
+
+
+def configure(config: dict) -> None:
+    """Set the metrics outputs from the config, and start a new run."""
+    metrics_config = config.get("metrics", {})
+    for name in _settings:
+        path = metrics_config.get(name)
+        # Absolute, as the push moves to the git workspace
+        _settings[name] = os.path.abspath(path) if path else None
+    _stages.clear()
+
+
+def _read_proc(path: str, key: str) -> int | None:
+    """A `key: value` field of a /proc file, None without /proc."""
+    try:
+        with open(path, "r") as proc_file:
+            for line in proc_file:
+                name, _, value = line.partition(":")
+                if name == key:
+                    # VmHWM is in kB
+                    number, *unit = value.split()
+                    return int(number) * (1024 if unit else 1)
+    except OSError:
+        pass
+    return None
+
+
+def _peak_rss() -> int:
+    """Peak resident memory since the last reset, or the process start."""
+    peak = _read_proc("/proc/self/status", "VmHWM")
+    if peak is None:
+        # Kilobytes on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return peak
+
+
+def _reset_peak_rss() -> None:
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def _cpu_seconds() -> float:
+    usage = [
+        resource.getrusage(who)
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+    ]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def _io_bytes() -> tuple:
+    return (
+        _read_proc("/proc/self/io", "rchar"),
+        _read_proc("/proc/self/io", "wchar"),
+    )
+
+
+def record(**counts) -> None:
+    """Add counts to the metrics of the innermost stage being measured."""
+    if _active:
+        metrics = _active[-1]["metrics"]
+        for name, count in counts.items():
+            metrics[name] = metrics.get(name, 0) + count
+
+
+@contextmanager
+def stage(name: str):
+    """Measure a pipeline stage, yields its metrics to add fields to."""
+    # The enclosing stages keep the peak reached so far before the reset
+    peak = _peak_rss()
+    for outer in _active:
+        outer["peak"] = max(outer["peak"], peak)
+    _reset_peak_rss()
+
+    current = {"metrics": {"stage": name}, "peak": 0}
+    profiler = None
+    if _settings["profile_dir"] and not _active:
+        profiler = cProfile.Profile()
+    _active.append(current)
+    read, written = _io_bytes()
+    cpu = _cpu_seconds()
+    start = time.perf_counter()
+    status = "failed"
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield current["metrics"]
+        status = "succeeded"
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        seconds = time.perf_counter() - start
+        _active.pop()
+        peak = _peak_rss()
+        for outer in _active:
+            outer["peak"] = max(outer["peak"], peak)
+        metrics = current["metrics"]
+        metrics.update(
+            {
+                "status": status,
+                "wall_seconds": round(seconds, 6),
+                "cpu_seconds": round(_cpu_seconds() - cpu, 6),
+                "peak_rss_bytes": max(current["peak"], peak),
+            }
+        )
+        end_read, end_written = _io_bytes()
+        if read is not None and end_read is not None:
+            metrics["bytes_read"] = end_read - read
+            metrics["bytes_written"] = end_written - written
+        if profiler is not None:
+            _dump_profile(profiler, name)
+        _stages.append(metrics)
+        utils.logger.info(
+            f"{name} took {seconds:.2f}s",
+            extra={**metrics, "step": name, "seconds": seconds},
+        )
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+
+def _dump_profile(profiler: cProfile.Profile, name: str) -> None:
+    os.makedirs(_settings["profile_dir"], exist_ok=True)
+    path = os.path.join(_settings["profile_dir"], f"{_slug(name)}.prof")
+    profiler.dump_stats(path)
+    utils.logger.info(f"Profile of {name} written to {path}")
+
+
+def _write_atomic(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as output:
+        output.write(content)
+    os.replace(tmp_path, path)
+
+
+def prometheus_text(stages: list) -> str:
+    """The numeric stage metrics in the Prometheus text format."""
+    lines = []
+    names = sorted(
+        {
+            name
+            for metrics in stages
+            for name, value in metrics.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        }
+    )
+    for name in names:
+        metric = f"{PROMETHEUS_PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} gauge")
+        for metrics in stages:
+            if name in metrics:
+                stage_name = metrics["stage"].replace('"', '\\"')
+                lines.append(
+                    f'{metric}{{stage="{stage_name}"}} {metrics[name]}'
+                )
+    return "\n".join(lines) + "\n"
+
+
+def write_report() -> list:
+    """Write the metrics of the stages of the run, and return them."""
+    if _settings["report_path"]:
+        _write_atomic(
+            _settings["report_path"],
+            json.dumps({"stages": _stages}, indent=2),
+        )
+    if _settings["prometheus_path"]:
+        # Replaced atomically, as the node exporter may read it any time
+        _write_atomic(_settings["prometheus_path"], prometheus_text(_stages))
+    return list(_stages)
@@ -0,0 +1,226 @@
+"""Cache of the pipeline stage outputs, keyed by the stage inputs.
+
+A stage is fingerprinted from the sha256 of its input files and the
+config values it depends on. When a stage runs, copies of its outputs
+are kept in the cache under its fingerprint. On a later run with the
+same fingerprint the stage is skipped, and its outputs are restored from
+the cache if they were modified or removed since.
+
+The cache directory holds:
+    - index.json: the entries by fingerprint, with their size and last
+        use, and the sha256 of the input files by path, reused while the
+        file keeps its size and modification time
+    - <fingerprint>/: the copies of the outputs of an entry
+
+The least recently used entries are evicted to keep the cache within
+`max_bytes` and `max_entries`.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from src import metrics, utils
+
+INDEX_FILE = "index.json"
+
+
+def _stat(path: str) -> list | None:
+    """Size and modification time of a file, None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _files(path: str) -> list:
+    """The files of a path, itself if it's a file, sorted."""
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def _path_size(path: str) -> int:
+    return sum(os.path.getsize(file) for file in _files(path))
+
+
+class StageCache:
+    """Fingerprints the stage inputs and caches the stage outputs."""
+
+    def __init__(self, cache_dir: str, max_bytes: int, max_entries: int):
+        # Absolute, as the push stage moves to the git workspace
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.index = self._load_index()
+
+    def _load_index(self) -> dict:
+        index_path = os.path.join(self.cache_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, "r") as index_file:
+                    return json.load(index_file)
+            except (OSError, ValueError) as e:
+                utils.logger.warning(f"Ignoring unreadable stage cache: {e}")
+        return {"entries": {}, "files": {}}
+
+    def _save_index(self) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        index_path = os.path.join(self.cache_dir, INDEX_FILE)
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "w") as index_file:
+            json.dump(self.index, index_file, indent=2)
+        os.replace(tmp_path, index_path)
+
+    def file_digest(self, path: str) -> str:
+        """sha256 of a file, only read again if it was modified."""
+        stat = _stat(path)
+        known = self.index["files"].get(path)
+        if known and stat is not None and known["stat"] == stat:
+            return known["sha256"]
+        with open(path, "rb") as file:
+            sha256 = hashlib.file_digest(file, "sha256").hexdigest()
+        self.index["files"][path] = {"stat": stat, "sha256": sha256}
+        return sha256
+
+    def fingerprint(self, stage: str, inputs: list, params: dict) -> str:
+        """Fingerprint of a stage from its input files and parameters."""
+        digest = hashlib.sha256(stage.encode())
+        for path in inputs:
+            digest.update(path.encode())
+            # A missing input has its own fingerprint, the stage fails on it
+            for file in _files(path) if os.path.exists(path) else []:
+                digest.update(os.path.relpath(file, path).encode())
+                digest.update(self.file_digest(file).encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def lookup(self, key: str, outputs: list) -> bool:
+        """Whether the stage is cached, its outputs restored if needed."""
+        entry = self.index["entries"].get(key)
+        if entry is None:
+            return False
+        if outputs and not os.path.isdir(os.path.join(self.cache_dir, key)):
+            del self.index["entries"][key]
+            return False
+        for i, path in enumerate(outputs):
+            if self._output_stats(path) == entry["outputs"][i]:
+                continue
+            utils.logger.info(f"Restoring {path} from the stage cache")
+            cached = os.path.join(self.cache_dir, key, str(i))
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            # Copies keep the modification times, so match the stats again
+            if os.path.isdir(cached):
+                shutil.copytree(cached, path)
+            else:
+                shutil.copy2(cached, path)
+        entry["last_used"] = time.time_ns()
+        self._save_index()
+        return True
+
+    @staticmethod
+    def _output_stats(path: str) -> list | None:
+        if not os.path.exists(path):
+            return None
+        return [
+            [os.path.relpath(file, path), _stat(file)] for file in _files(path)
+        ]
+
+    def store(self, key: str, stage: str, outputs: list) -> None:
+        """Keep copies of the outputs of a stage that just ran."""
+        size = sum(_path_size(path) for path in outputs)
+        if size > self.max_bytes:
+            utils.logger.info(
+                f"Outputs of {stage} are too large for the stage cache"
+            )
+            self._save_index()
+            return
+        entry_dir = os.path.join(self.cache_dir, key)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.makedirs(entry_dir)
+        for i, path in enumerate(outputs):
+            if os.path.isdir(path):
+                shutil.copytree(path, os.path.join(entry_dir, str(i)))
+            else:
+                shutil.copy2(path, os.path.join(entry_dir, str(i)))
+        self.index["entries"][key] = {
+            "stage": stage,
+            "bytes": size,
+            "last_used": time.time_ns(),
+            "outputs": [self._output_stats(path) for path in outputs],
+        }
+        self._evict()
+        self._save_index()
+
+    def _evict(self) -> None:
+        """Remove the least recently used entries over the limits."""
+        entries = self.index["entries"]
+        total = sum(entry["bytes"] for entry in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key]["last_used"]):
+            if total <= self.max_bytes and len(entries) <= self.max_entries:
+                break
+            total -= entries.pop(key)["bytes"]
+            shutil.rmtree(
+                os.path.join(self.cache_dir, key), ignore_errors=True
+            )
+            utils.logger.info(f"Evicted stage cache entry {key}")
+
+
+def get_stage_cache(config: dict) -> StageCache | None:
+    """The configured stage cache, None if it is disabled."""
+    cache_config = config.get("stage_cache", {})
+    if not cache_config.get("enabled", False):
+        return None
+    return StageCache(
+        cache_config.get("cache_dir", "./artefacts/.stage_cache"),
+        int(cache_config.get("max_size_mb", 2048) * 2**20),
+        cache_config.get("max_entries", 16),
+    )
+
+
+def run_stage(
+    cache: StageCache | None,
+    stage: str,
+    func,
+    inputs: list,
+    params: dict,
+    outputs: list = (),
+) -> bool:
+    """Run `func` unless the stage ran before with the same fingerprint.
+
+    Args:
+        cache (StageCache): The stage cache, the stage always runs if None
+        stage (str): Name of the stage
+        func: Runs the stage
+        inputs (list): Paths of the files and directories the stage reads
+        params (dict): The config values the stage depends on
+        outputs (list): Paths of the files and directories it writes
+
+    Returns:
+        bool: Whether the stage ran
+    """
+    with metrics.stage(stage) as stage_metrics:
+        stage_metrics["cached"] = False
+        if cache is None:
+            func()
+            return True
+        key = cache.fingerprint(stage, list(inputs), params)
+        if cache.lookup(key, list(outputs)):
+            stage_metrics["cached"] = True
+            utils.logger.info(
+                f"Skipping {stage}, its inputs are unchanged",
+                extra={"stage": stage, "fingerprint": key, "result": "cached"},
+            )
+            return False
+        func()
+        cache.store(key, stage, list(outputs))
+        return True
@@ -4,9 +4,14 @@ import logging
 import os
 import sys
 
+import numpy as np
+import pandas as pd
 import yaml
 from pythonjsonlogger import jsonlogger
 
+# Key of the string hashes of the second half of `row_hashes128`
+SECOND_HASH_KEY = "row-hashes-128b!"
+
 
 def load_yaml_config(config_path: str = "./config.yaml"):
     """Load the json configuration."""
@@ -16,6 +21,90 @@ def load_yaml_config(config_path: str = "./config.yaml"):
     return config
 
 
+def _column_hashes(col: pd.Series, hash_key: str | None = None) -> np.ndarray:
+    """Hash the values of a column, numbers whatever their dtype.
+
+    Integer columns are hashed as int64, so that large integers are not
+    rounded. The integral values of float columns are hashed as int64
+    too, so that a value hashes the same in chunks where the column was
+    parsed as int or as float, and the other values as float64.
+    """
+    if pd.api.types.is_bool_dtype(col) or pd.api.types.is_integer_dtype(col):
+        hashes = pd.util.hash_array(col.to_numpy("int64", na_value=0))
+        if col.hasnans:
+            # Missing values of nullable integers, hashed as float gaps
+            hashes[col.isna().to_numpy()] = pd.util.hash_array(
+                np.array([np.nan])
+            )[0]
+        return hashes
+    if not pd.api.types.is_numeric_dtype(col):
+        return pd.util.hash_pandas_object(
+            col, index=False, hash_key=hash_key
+        ).to_numpy()
+    values = col.to_numpy("float64", na_value=np.nan)
+    with np.errstate(invalid="ignore"):
+        integral = (np.floor(values) == values) & (np.abs(values) < 2**63)
+    if integral.all():
+        return pd.util.hash_array(values.astype("int64"))
+    hashes = pd.util.hash_array(values)
+    if integral.any():
+        hashes[integral] = pd.util.hash_array(values[integral].astype("int64"))
+    return hashes
+
+
+def _combine(columns: list, rows: int) -> np.ndarray:
+    """Combine the column hashes as `pd.util.hash_pandas_object` does."""
+    hashes = np.full(rows, np.uint64(0x345678))
+    multiplier = np.uint64(1000003)
+    for i, column in enumerate(columns):
+        hashes ^= column
+        hashes *= multiplier
+        multiplier += np.uint64(82520 + 2 * (len(columns) - i))
+    return hashes + np.uint64(97531)
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """Hash every row of a dataframe to a 64 bit integer.
+
+    See `_column_hashes` for the hashes of the numeric columns.
+    """
+    return _combine(
+        [_column_hashes(df.iloc[:, i]) for i in range(len(df.columns))],
+        len(df),
+    )
+
+
+def _fmix64(values: np.ndarray) -> np.ndarray:
+    """The 64 bit finaliser of MurmurHash3, wrapping around."""
+    values = values ^ (values >> np.uint64(33))
+    values = values * np.uint64(0xFF51AFD7ED558CCD)
+    values = values ^ (values >> np.uint64(33))
+    values = values * np.uint64(0xC4CEB9FE1A85EC53)
+    return values ^ (values >> np.uint64(33))
+
+
+def row_hashes128(df: pd.DataFrame) -> np.ndarray:
+    """Hash every row of a dataframe to 128 bits, as two uint64 columns.
+
+    The first column is hashed as `row_hashes`. The second one hashes
+    the strings with another key and combines the columns in reverse
+    order with another function, so that it is independent from the
+    first one.
+    """
+    columns = [_column_hashes(df.iloc[:, i]) for i in range(len(df.columns))]
+    hashes = np.empty((len(df), 2), dtype="uint64")
+    hashes[:, 0] = _combine(columns, len(df))
+    combined = np.full(len(df), np.uint64(len(df.columns)))
+    for i in reversed(range(len(df.columns))):
+        column = columns[i]
+        # The numbers are hashed without a key
+        if not pd.api.types.is_numeric_dtype(df.iloc[:, i]):
+            column = _column_hashes(df.iloc[:, i], SECOND_HASH_KEY)
+        combined = _fmix64(combined ^ (column + np.uint64(i)))
+    hashes[:, 1] = combined
+    return hashes
+
+
 class CustomJsonFormatter(jsonlogger.JsonFormatter):
     """Custom log formatter."""
 
@@ -0,0 +1,141 @@
+"""Local HTTP stand-in for the raw data source.
+
+Serves files from a directory with optional byte range support, so the
+download code can be tested and benchmarked without network access.
+"""
+
+import contextlib
+import os
+import re
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler with range and conditional request support."""
+
+    accept_ranges = True
+    # Per connection bandwidth in bytes per second, None for unlimited
+    bandwidth = None
+    # Number of range requests to fail, used to simulate interruptions
+    fail_ranges = 0
+    range_requests = 0
+    probe_requests = 0
+    full_requests = 0
+    # Sent with every body, e.g. a Content-Type
+    extra_headers = {}
+
+    def log_message(self, format, *args):
+        """Silence the per-request logging."""
+
+    def _etag(self, path):
+        stat = os.stat(path)
+        return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    def do_GET(self):
+        """Serve the whole file or the requested byte range."""
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        etag = self._etag(path)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if (
+            not self.accept_ranges
+            or match is None
+            or (if_range is not None and if_range != etag)
+        ):
+            type(self).full_requests += 1
+            self._send_body(path, 200, 0, size - 1, size, etag)
+            return
+
+        cls = type(self)
+        if match.group(0) == "bytes=0-0":
+            # The probe for the range support and the size of the file
+            cls.probe_requests += 1
+            self._send_body(path, 206, 0, 0, size, etag)
+            return
+        cls.range_requests += 1
+        if cls.fail_ranges > 0:
+            cls.fail_ranges -= 1
+            self.send_error(503)
+            return
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+        self._send_body(path, 206, start, min(end, size - 1), size, etag)
+
+    def _send_body(self, path, status, start, end, size, etag):
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", etag)
+        for name, value in self.extra_headers.items():
+            self.send_header(name, value)
+        if self.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        chunk_size = 64 * 1024
+        with open(path, "rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = file.read(min(remaining, chunk_size))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed the connection early
+                    return
+                remaining -= len(chunk)
+                if self.bandwidth:
+                    time.sleep(len(chunk) / self.bandwidth)
+
+
+@contextlib.contextmanager
+def serve_directory(
+    directory, accept_ranges=True, fail_ranges=0, bandwidth=None, headers=None
+):
+    """Serve `directory` on a free local port and yield the base URL.
+
+    `bandwidth` limits each connection to the given bytes per second to
+    mimic a remote server, where a single stream is rarely saturating.
+
+    The yielded handler class exposes counters for the range requests,
+    the first byte probes and the whole files served, which the tests
+    use to check the download behaviour.
+    """
+    handler = type(
+        "Handler",
+        (RangeRequestHandler,),
+        {
+            "accept_ranges": accept_ranges,
+            "fail_ranges": fail_ranges,
+            "bandwidth": bandwidth,
+            "range_requests": 0,
+            "probe_requests": 0,
+            "full_requests": 0,
+            "extra_headers": headers or {},
+        },
+    )
+
+    def factory(*args, **kwargs):
+        return handler(*args, directory=str(directory), **kwargs)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), factory)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}", handler
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,159 @@
+"""Unit test for the artefact formats."""
+
+import hashlib
+
+import pandas as pd
+import pytest
+
+from src.artefacts import (
+    CSV_INDEX_COL,
+    ArtefactWriter,
+    PartitionedWriter,
+    artefact_path,
+    get_compression,
+    get_split_paths,
+    iter_artefact,
+    read_artefact,
+    write_artefact,
+)
+
+
+@pytest.fixture
+def df():
+    """Dataframe with the column types found in the data."""
+    return pd.DataFrame(
+        {
+            "price": [13300000, 12250000, 9870000],
+            "area": [7420.0, 8960.0, None],
+            "mainroad": ["yes", "no", None],
+        },
+        index=[0, 3, 7],
+    )
+
+
+@pytest.mark.parametrize("artefact_format", ["parquet", "arrow"])
+def test_columnar_round_trip_keeps_dtypes(df, tmp_path, artefact_format):
+    """Columnar artefacts read back with the written dtypes."""
+    path = artefact_path(str(tmp_path / "data.csv"), artefact_format)
+    write_artefact(df, path, artefact_format)
+
+    pd.testing.assert_frame_equal(
+        read_artefact(path, artefact_format), df.reset_index(drop=True)
+    )
+
+
+@pytest.mark.parametrize("artefact_format", ["csv", "parquet", "arrow"])
+def test_chunked_writer_with_index(df, tmp_path, artefact_format):
+    """Chunks are appended and the index reads back as in csv."""
+    path = artefact_path(str(tmp_path / "data.csv"), artefact_format)
+    with ArtefactWriter(path, artefact_format, index=True) as writer:
+        writer.write(df.iloc[:1])
+        # A first chunk missing a string column doesn't fix its type
+        writer.write(df.iloc[1:])
+
+    result = read_artefact(path, artefact_format)
+    assert list(result.columns) == [CSV_INDEX_COL, *df.columns]
+    assert result[CSV_INDEX_COL].tolist() == [0, 3, 7]
+    assert result["mainroad"].tolist()[:2] == ["yes", "no"]
+
+
+@pytest.mark.parametrize("artefact_format", ["csv", "parquet", "arrow"])
+def test_writer_digest(df, tmp_path, artefact_format):
+    """The digest computed while writing is the md5 of the file."""
+    path = artefact_path(str(tmp_path / "data.csv"), artefact_format)
+    digest = write_artefact(df, path, artefact_format, index=True)
+
+    content = (tmp_path / path).read_bytes()
+    assert digest["md5"] == hashlib.md5(content).hexdigest()
+    assert digest["size"] == len(content)
+    if artefact_format == "csv":
+        assert content == df.to_csv().encode()
+
+
+@pytest.mark.parametrize("codec", ["gzip", "bz2", "zstd"])
+def test_compressed_csv(df, tmp_path, codec):
+    """Compressed csv reads back chunk by chunk, digested as written."""
+    path = artefact_path(str(tmp_path / "data.csv"), "csv", codec)
+    digest = write_artefact(df, path, "csv", index=True, codec=codec, level=3)
+
+    content = (tmp_path / path).read_bytes()
+    assert digest["md5"] == hashlib.md5(content).hexdigest()
+    assert len(content) == digest["size"]
+    # The same rows give the same bytes
+    write_artefact(df, path, "csv", index=True, codec=codec, level=3)
+    assert (tmp_path / path).read_bytes() == content
+    result = pd.concat(iter_artefact(path, "csv", 2))
+    assert result[CSV_INDEX_COL].tolist() == [0, 3, 7]
+    assert result["mainroad"].tolist()[:2] == ["yes", "no"]
+
+
+@pytest.mark.parametrize("artefact_format", ["csv", "parquet", "arrow"])
+def test_partitioned_writer(tmp_path, artefact_format):
+    """Partitions have fixed sizes and bytes independent of the chunks."""
+    data = pd.DataFrame({"a": range(10), "b": [f"v{i}" for i in range(10)]})
+    (tmp_path / "split").mkdir()
+    (tmp_path / "split" / "part-00009.csv").write_text("stale")
+
+    digests = []
+    for chunks in ([data], [data.iloc[:1], data.iloc[1:7], data.iloc[7:]]):
+        with PartitionedWriter(
+            str(tmp_path / "split"), artefact_format, 4
+        ) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+        digests.append({path: d["md5"] for path, d in writer.digests.items()})
+
+    assert digests[0] == digests[1]
+    parts = sorted((tmp_path / "split").iterdir())
+    assert [part.name[:10] for part in parts] == [
+        "part-00000",
+        "part-00001",
+        "part-00002",
+    ]
+    assert [len(read_artefact(part, artefact_format)) for part in parts] == [
+        4,
+        4,
+        2,
+    ]
+
+
+def test_partitioned_writer_without_rows(tmp_path):
+    """A split without rows is a single partition with the header only."""
+    with PartitionedWriter(str(tmp_path / "split"), "csv", 4) as writer:
+        writer.write(pd.DataFrame({"a": []}))
+
+    assert (tmp_path / "split" / "part-00000.csv").read_text() == "a\n"
+
+
+def test_get_split_paths():
+    """Split paths take the suffix of the artefact format."""
+    config = {
+        "data_split": {
+            "artefact_format": "parquet",
+            "train_data_save_path": "./artefacts/train_data.csv",
+            "val_data_save_path": "./artefacts/val_data.csv",
+            "test_data_save_path": "./artefacts/test_data.csv",
+        }
+    }
+    assert get_split_paths(config) == {
+        "train": "artefacts/train_data.parquet",
+        "val": "artefacts/val_data.parquet",
+        "test": "artefacts/test_data.parquet",
+    }
+
+    config["data_split"]["artefact_format"] = "csv"
+    config["data_split"]["compression"] = "zstd"
+    assert get_split_paths(config)["train"] == "artefacts/train_data.csv.zst"
+
+    # Arrow only has the zstd codec among the supported ones
+    config["data_split"]["artefact_format"] = "arrow"
+    config["data_split"]["compression"] = "gzip"
+    with pytest.raises(ValueError):
+        get_compression(config)
+    config["data_split"]["compression"] = "lzma"
+    with pytest.raises(ValueError):
+        get_compression(config)
+
+    config["data_split"]["artefact_format"] = "xlsx"
+    with pytest.raises(ValueError):
+        get_split_paths(config)
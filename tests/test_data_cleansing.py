@@ -0,0 +1,202 @@
+"""Unit test for data cleansing."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.artefacts import read_artefact
+from src.compression import CODECS
+from src.data_cleansing import (
+    _normalise_categoricals,
+    clean_data,
+    get_cleansed_data_path,
+)
+from src.imputation_stats import ImputationStats
+
+
+@pytest.fixture
+def config(tmp_path):
+    """Cleansing config with a raw file holding duplicates and gaps."""
+    rng = np.random.default_rng(0)
+    n_rows = 500
+    df = pd.DataFrame(
+        {
+            "price": rng.integers(1_000_000, 9_000_000, n_rows),
+            "area": rng.integers(1000, 9000, n_rows).astype(float),
+            "bedrooms": rng.integers(1, 6, n_rows),
+            "mainroad": rng.choice(["Yes", "no ", " NO", "yes"], n_rows),
+            "furnishingstatus": rng.choice(
+                ["furnished", "Semi-Furnished"], n_rows
+            ),
+        }
+    )
+    for col in ["price", "area", "mainroad", "furnishingstatus"]:
+        df[col] = df[col].where(rng.random(n_rows) > 0.05)
+    # Duplicates spread over the whole file
+    df = pd.concat([df, df.sample(100, random_state=1)], ignore_index=True)
+    df.to_csv(tmp_path / "raw_data.csv", index=False)
+
+    return {
+        "data_split": {
+            "raw_data_save_path": str(tmp_path / "raw_data.csv"),
+            "cleansed_data_save_path": str(tmp_path / "cleansed_data.csv"),
+            "imputation_stats_path": str(tmp_path / "imputation_stats.json"),
+            "label_col": "price",
+            "categorical_cols": ["mainroad", "furnishingstatus"],
+            "numeric_cols": ["area", "bedrooms"],
+        }
+    }
+
+
+def test_clean_data_in_memory(config):
+    """Duplicates and missing labels are dropped, gaps imputed."""
+    clean_data(config)
+
+    df = pd.read_csv(config["data_split"]["cleansed_data_save_path"])
+    raw = pd.read_csv(config["data_split"]["raw_data_save_path"])
+    assert len(df) == len(raw.drop_duplicates().dropna(subset=["price"]))
+    assert not df.isna().any().any()
+    assert set(df["mainroad"]) == {"yes", "no"}
+
+
+def test_clean_data_saves_imputation_stats(config, tmp_path):
+    """Every mode saves the statistics the gaps were imputed with."""
+    clean_data(config)
+    raw = pd.read_csv(config["data_split"]["raw_data_save_path"])
+    kept = raw.drop_duplicates().dropna(subset=["price"])
+    stats = ImputationStats.load(str(tmp_path / "imputation_stats.json"))
+    assert stats.medians() == {
+        "area": kept["area"].median(),
+        "bedrooms": kept["bedrooms"].median(),
+    }
+    assert stats.modes() == {
+        col: kept[col].str.strip().str.lower().mode()[0]
+        for col in ("mainroad", "furnishingstatus")
+    }
+
+    for mode in ("streaming", "parallel"):
+        config["data_cleansing"] = {"mode": mode, "memory_budget_mb": 0.01}
+        clean_data(config)
+        loaded = ImputationStats.load(str(tmp_path / "imputation_stats.json"))
+        assert loaded.medians() == stats.medians()
+        assert loaded.modes() == stats.modes()
+
+
+def test_clean_data_streaming_matches_in_memory(config, tmp_path):
+    """The streaming mode writes the same file as the in-memory mode."""
+    clean_data(config)
+    expected = (tmp_path / "cleansed_data.csv").read_bytes()
+
+    config["data_cleansing"] = {
+        "mode": "streaming",
+        # Small enough to split the file in many chunks
+        "memory_budget_mb": 0.01,
+        # and to spill the row hashes
+        "dedup_memory_mb": 0.001,
+    }
+    clean_data(config)
+
+    assert (tmp_path / "cleansed_data.csv").read_bytes() == expected
+
+
+def test_clean_data_parallel_matches_in_memory(config, tmp_path, monkeypatch):
+    """The parallel mode writes the same file as the in-memory mode."""
+    clean_data(config)
+    expected = (tmp_path / "cleansed_data.csv").read_bytes()
+
+    # More partitions than workers, some of them empty
+    monkeypatch.setattr("src.data_cleansing.PARTITION_BYTES", 1000)
+    config["data_cleansing"] = {
+        "mode": "parallel",
+        "num_workers": 3,
+        "dedup_memory_mb": 0.001,
+    }
+    clean_data(config)
+
+    assert (tmp_path / "cleansed_data.csv").read_bytes() == expected
+    # The partitions are removed once written to the output
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "cleansed_data.csv",
+        "imputation_stats.json",
+        "raw_data.csv",
+    ]
+
+    config["data_split"]["artefact_format"] = "parquet"
+    clean_data(config)
+    pd.testing.assert_frame_equal(
+        read_artefact(tmp_path / "cleansed_data.parquet", "parquet"),
+        pd.read_csv(tmp_path / "cleansed_data.csv"),
+    )
+
+
+def test_normalise_categoricals():
+    """Categories are normalised and merged, missing values kept."""
+    df = pd.DataFrame(
+        {
+            "mainroad": [" Yes", "no", None, "yes ", "NO"],
+            "empty": [None] * 5,
+        }
+    )
+    _normalise_categoricals(df, ["mainroad", "empty"])
+
+    assert list(df["mainroad"].cat.categories) == ["yes", "no"]
+    assert df["mainroad"].tolist() == ["yes", "no", np.nan, "yes", "no"]
+    assert df["empty"].isna().all()
+
+
+def test_clean_data_unknown_mode(config):
+    """An unknown mode is rejected."""
+    config["data_cleansing"] = {"mode": "distributed"}
+    with pytest.raises(ValueError):
+        clean_data(config)
+
+
+@pytest.mark.parametrize("artefact_format", ["parquet", "arrow"])
+def test_clean_data_columnar(config, tmp_path, artefact_format):
+    """Columnar outputs hold the same data as the csv output."""
+    clean_data(config)
+    expected = pd.read_csv(tmp_path / "cleansed_data.csv")
+
+    config["data_split"]["artefact_format"] = artefact_format
+    for mode in ("in_memory", "streaming"):
+        config["data_cleansing"] = {"mode": mode, "memory_budget_mb": 0.01}
+        clean_data(config)
+        path = tmp_path / f"cleansed_data.{artefact_format}"
+        pd.testing.assert_frame_equal(
+            read_artefact(str(path), artefact_format), expected
+        )
+
+
+@pytest.mark.parametrize("codec", ["gzip", "bz2", "zstd"])
+def test_clean_data_compressed(config, tmp_path, codec):
+    """Compressed csv outputs hold the same data in every mode."""
+    clean_data(config)
+    expected = pd.read_csv(tmp_path / "cleansed_data.csv")
+
+    config["data_split"]["compression"] = codec
+    path = get_cleansed_data_path(config)
+    assert path.endswith(f".csv{CODECS[codec]}")
+    for mode in ("in_memory", "streaming", "parallel"):
+        config["data_cleansing"] = {
+            "mode": mode,
+            "memory_budget_mb": 0.01,
+            "num_workers": 2,
+        }
+        clean_data(config)
+        pd.testing.assert_frame_equal(read_artefact(path, "csv"), expected)
+
+
+def test_clean_data_in_memory_handoff(config, tmp_path):
+    """The returned data matches the artefact read back from disk."""
+    raw = pd.read_csv(config["data_split"]["raw_data_save_path"])
+    df = clean_data(config, data=raw, save=False)
+    assert not (tmp_path / "cleansed_data.csv").exists()
+
+    clean_data(config)
+    pd.testing.assert_frame_equal(
+        df, pd.read_csv(tmp_path / "cleansed_data.csv")
+    )
+    # The caller's data is left untouched
+    pd.testing.assert_frame_equal(
+        raw, pd.read_csv(config["data_split"]["raw_data_save_path"])
+    )
@@ -1,10 +1,27 @@
 """Unit test for data gathering."""
 
+import bz2
+import gzip
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock, patch
 
+import pandas as pd
+import pytest
 import requests
 
-from src.data_gathering import get_data_from_url
+from src import compression, fetch_cache
+from src.data_gathering import (
+    _declared_codec,
+    gather_data,
+    get_data_from_url,
+    mark_ingested,
+    merge_sources,
+    source_keys,
+)
+from tests.http_server import serve_directory
 
 
 @patch("src.data_gathering.requests.get")
@@ -22,3 +39,347 @@ def test_get_data_from_url_success(mock_requests_get):
 
     # Check if the function returns True
     assert result is True
+
+
+@pytest.fixture
+def raw_file(tmp_path):
+    """A raw data file larger than a few download ranges."""
+    served = tmp_path / "served"
+    served.mkdir()
+    data = os.urandom(5 * 1024 + 123)
+    (served / "data.csv").write_bytes(data)
+    return served, data
+
+
+def test_get_data_from_url_ranged(raw_file, tmp_path):
+    """The file is assembled from concurrent range requests."""
+    served, data = raw_file
+    output_path = tmp_path / "raw.csv"
+    with serve_directory(served) as (base_url, handler):
+        result = get_data_from_url(
+            f"{base_url}/data.csv",
+            str(output_path),
+            num_workers=4,
+            part_size=1024,
+        )
+
+    assert result is True
+    # The size is probed from the first byte, the whole file never sent
+    assert handler.probe_requests == 1
+    assert handler.full_requests == 0
+    assert handler.range_requests == 6
+    assert output_path.read_bytes() == data
+    assert not os.path.exists(f"{output_path}.part")
+    assert not os.path.exists(f"{output_path}.part.json")
+
+
+def test_get_data_from_url_without_range_support(raw_file, tmp_path):
+    """Servers without `Accept-Ranges` are read in a single stream."""
+    served, data = raw_file
+    output_path = tmp_path / "raw.csv"
+    with serve_directory(served, accept_ranges=False) as (base_url, handler):
+        get_data_from_url(
+            f"{base_url}/data.csv", str(output_path), part_size=1024
+        )
+
+    assert handler.range_requests == 0
+    # The answer to the probe is the file, read without another request
+    assert handler.full_requests == 1
+    assert output_path.read_bytes() == data
+
+
+def test_get_data_from_url_small_file(raw_file, tmp_path):
+    """A file smaller than a range is read in a single request."""
+    served, data = raw_file
+    output_path = tmp_path / "raw.csv"
+    with serve_directory(served) as (base_url, handler):
+        get_data_from_url(f"{base_url}/data.csv", str(output_path))
+
+    assert handler.probe_requests == 1
+    assert handler.range_requests == 0
+    assert handler.full_requests == 1
+    assert output_path.read_bytes() == data
+
+
+def test_get_data_from_url_resumes(raw_file, tmp_path):
+    """An interrupted download only fetches the missing ranges."""
+    served, data = raw_file
+    output_path = tmp_path / "raw.csv"
+    with serve_directory(served, fail_ranges=2) as (base_url, handler):
+        with pytest.raises(requests.RequestException):
+            get_data_from_url(
+                f"{base_url}/data.csv",
+                str(output_path),
+                num_workers=2,
+                part_size=1024,
+            )
+        assert not output_path.exists()
+        with open(f"{output_path}.part.json") as state_file:
+            completed = len(json.load(state_file)["completed"])
+        assert completed > 0
+        first_attempt = handler.range_requests
+
+        get_data_from_url(
+            f"{base_url}/data.csv",
+            str(output_path),
+            num_workers=2,
+            part_size=1024,
+        )
+
+    # Only the ranges missing from the partial file are requested again
+    assert handler.range_requests - first_attempt == 6 - completed
+    assert output_path.read_bytes() == data
+
+
+def test_get_data_from_url_fetch_cache(raw_file, tmp_path):
+    """Unchanged data is only reported as changed until it's ingested."""
+    served, data = raw_file
+    output_path = str(tmp_path / "raw.csv")
+    cache_path = str(tmp_path / "fetch_cache.json")
+    with serve_directory(served) as (base_url, _):
+        url = f"{base_url}/data.csv"
+        assert get_data_from_url(url, output_path, fetch_cache_path=cache_path)
+        # Not ingested yet, so the next run still has to process it
+        assert get_data_from_url(url, output_path, fetch_cache_path=cache_path)
+        fetch_cache.mark_ingested(cache_path, url)
+
+        with patch(
+            "src.data_gathering._download_single_stream"
+        ) as mock_download:
+            assert not get_data_from_url(
+                url, output_path, fetch_cache_path=cache_path
+            )
+        # The server answered 304 so nothing was downloaded
+        mock_download.assert_not_called()
+
+        # A new ETag with identical content is detected from the digest
+        os.utime(served / "data.csv", ns=(0, 0))
+        assert not get_data_from_url(
+            url, output_path, fetch_cache_path=cache_path
+        )
+
+        (served / "data.csv").write_bytes(data + b"new row\n")
+        assert get_data_from_url(url, output_path, fetch_cache_path=cache_path)
+
+    with open(output_path, "rb") as file:
+        assert file.read() == data + b"new row\n"
+
+
+def test_get_data_from_url_fetch_cache_compressed(raw_file, tmp_path):
+    """A compressed source unchanged since ingested is not fetched again."""
+    served, data = raw_file
+    (served / "data.csv.gz").write_bytes(gzip.compress(data))
+    output_path = str(tmp_path / "raw.csv")
+    cache_path = str(tmp_path / "fetch_cache.json")
+    with serve_directory(served) as (base_url, _):
+        url = f"{base_url}/data.csv.gz"
+        assert get_data_from_url(url, output_path, fetch_cache_path=cache_path)
+        fetch_cache.mark_ingested(cache_path, url)
+
+        with patch(
+            "src.data_gathering._download_single_stream"
+        ) as mock_download:
+            assert not get_data_from_url(
+                url, output_path, fetch_cache_path=cache_path
+            )
+        mock_download.assert_not_called()
+
+    with open(output_path, "rb") as file:
+        assert file.read() == data
+
+
+def _source_frame(start, stop):
+    return pd.DataFrame(
+        {
+            "id": range(start, stop),
+            "price": [i * 10.5 for i in range(start, stop)],
+        }
+    )
+
+
+@pytest.mark.parametrize("accept_ranges", [False, True])
+def test_get_data_from_url_declared_codec(raw_file, tmp_path, accept_ranges):
+    """A zstd encoded body is decompressed while it is streamed."""
+    served, data = raw_file
+    with open(served / "export", "wb") as file:
+        with compression.open_writer(file, "zstd") as output:
+            output.write(data)
+    output_path = tmp_path / "raw.csv"
+    real_decompress = compression.decompress_file
+    with serve_directory(
+        served,
+        accept_ranges=accept_ranges,
+        headers={"Content-Encoding": "zstd"},
+    ) as (base_url, _), patch(
+        "src.data_gathering.compression.decompress_file",
+        side_effect=real_decompress,
+    ) as mock_decompress:
+        assert get_data_from_url(
+            f"{base_url}/export", str(output_path), part_size=1024
+        )
+
+    assert output_path.read_bytes() == data
+    # Only the ranges, written in place, are decompressed afterwards
+    assert mock_decompress.called == accept_ranges
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "raw.csv",
+        "served",
+    ]
+
+
+@pytest.mark.parametrize(
+    "url, headers, codec",
+    [
+        ("http://host/data", {"Content-Type": "application/zstd"}, "zstd"),
+        ("http://host/data.csv.bz2?version=2", {}, "bz2"),
+        ("http://host/data.csv", {"Content-Encoding": "zstd"}, "zstd"),
+        # Decoded by requests, so the body is no longer gzip
+        ("http://host/data.csv.gz", {"Content-Encoding": "gzip"}, None),
+        ("http://host/data.csv", {"Content-Type": "text/csv"}, None),
+    ],
+)
+def test_declared_codec(url, headers, codec):
+    """The codec is found from the headers, then the url suffix."""
+    response = requests.Response()
+    response.headers.update(headers)
+    response.raw = MagicMock(CONTENT_DECODERS=["gzip", "x-gzip", "deflate"])
+    assert _declared_codec(url, response) == codec
+
+
+def test_fetch_cache_concurrent_updates(tmp_path):
+    """Entries updated from many threads are all kept."""
+    cache_path = str(tmp_path / "fetch_cache.json")
+    urls = [f"https://example.com/{i}.csv" for i in range(16)]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for _ in range(5):
+            list(
+                executor.map(
+                    lambda url: fetch_cache.update_entry(
+                        cache_path, url, {"size": 1, "ingested": False}
+                    ),
+                    urls,
+                )
+            )
+            list(
+                executor.map(
+                    lambda url: fetch_cache.mark_ingested(cache_path, url),
+                    urls,
+                )
+            )
+
+    cache = json.loads((tmp_path / "fetch_cache.json").read_text())
+    assert sorted(cache) == sorted(urls)
+    assert all(entry["ingested"] for entry in cache.values())
+    # No temporary file is left behind
+    assert os.listdir(tmp_path) == ["fetch_cache.json"]
+
+
+def test_gather_data_from_sources(tmp_path):
+    """Every kind of source is fetched and their rows concatenated."""
+    served = tmp_path / "served"
+    served.mkdir()
+    _source_frame(0, 10).to_csv(served / "http.csv", index=False)
+    _source_frame(10, 20).to_csv(tmp_path / "nfs.csv", index=False)
+    with sqlite3.connect(tmp_path / "houses.db") as connection:
+        _source_frame(20, 35).to_sql("houses", connection, index=False)
+    lake = tmp_path / "lake" / "houses"
+    lake.mkdir(parents=True)
+    # Objects taken in path order, the last one without a final newline
+    _source_frame(35, 40).to_csv(lake / "part-0.csv", index=False)
+    (lake / "part-1.csv").write_text("id,price\n40,420.0")
+    (lake / "notes.txt").write_text("not data")
+
+    with serve_directory(served) as (base_url, _):
+        config = {
+            "data_sources": [
+                {"name": "web", "type": "http", "url": f"{base_url}/http.csv"},
+                {
+                    "name": "nfs",
+                    "type": "file",
+                    "path": str(tmp_path / "nfs.csv"),
+                },
+                {
+                    "name": "db",
+                    "type": "sql",
+                    "database": str(tmp_path / "houses.db"),
+                    "query": "SELECT id, price FROM houses ORDER BY id",
+                    "batch_rows": 4,
+                },
+                {"name": "lake", "type": "objects", "url": f"file://{lake}"},
+            ],
+            "data_download": {
+                "fetch_cache_path": str(tmp_path / "fetch_cache.json")
+            },
+            "data_split": {"raw_data_save_path": str(tmp_path / "raw.csv")},
+        }
+        assert gather_data(config)
+        raw = pd.read_csv(tmp_path / "raw.csv")
+        pd.testing.assert_frame_equal(raw, _source_frame(0, 41))
+
+        mark_ingested(str(tmp_path / "fetch_cache.json"), source_keys(config))
+        assert not gather_data(config)
+        # A single changed source changes the data
+        _source_frame(10, 21).to_csv(tmp_path / "nfs.csv", index=False)
+        assert gather_data(config)
+        assert len(pd.read_csv(tmp_path / "raw.csv")) == 42
+
+
+def test_gather_compressed_sources(tmp_path):
+    """Compressed sources are decompressed into plain csv."""
+    served = tmp_path / "served"
+    served.mkdir()
+    with open(served / "http.csv.zst", "wb") as file:
+        with compression.open_writer(file, "zstd", 3) as output:
+            output.write(_source_frame(0, 300).to_csv(index=False).encode())
+    with gzip.open(tmp_path / "nfs.csv.gz", "wb") as file:
+        file.write(_source_frame(300, 310).to_csv(index=False).encode())
+    lake = tmp_path / "lake"
+    lake.mkdir()
+    _source_frame(310, 315).to_csv(lake / "part-0.csv", index=False)
+    with bz2.open(lake / "part-1.csv.bz2", "wb") as file:
+        file.write(_source_frame(315, 320).to_csv(index=False).encode())
+
+    with serve_directory(served) as (base_url, _):
+        config = {
+            "data_sources": [
+                {
+                    "name": "web",
+                    "type": "http",
+                    "url": f"{base_url}/http.csv.zst",
+                },
+                {
+                    "name": "nfs",
+                    "type": "file",
+                    "path": str(tmp_path / "nfs.csv.gz"),
+                },
+                {"name": "lake", "type": "objects", "url": f"file://{lake}"},
+            ],
+            "data_split": {"raw_data_save_path": str(tmp_path / "raw.csv")},
+        }
+        assert gather_data(config)
+
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "raw.csv"), _source_frame(0, 320)
+    )
+    assert not list((tmp_path / "sources").glob("*.part"))
+
+
+def test_merge_sources(tmp_path):
+    """Sources with other columns are aligned, or joined on a key."""
+    _source_frame(0, 3).to_csv(tmp_path / "a.csv", index=False)
+    pd.DataFrame({"id": [1, 2, 5], "area": [7.0, 8.0, 9.0]}).to_csv(
+        tmp_path / "b.csv", index=False
+    )
+    paths = [str(tmp_path / "a.csv"), str(tmp_path / "b.csv")]
+
+    merge_sources(paths, str(tmp_path / "concat.csv"), {})
+    concat = pd.read_csv(tmp_path / "concat.csv")
+    assert list(concat.columns) == ["id", "price", "area"]
+    assert concat["id"].tolist() == [0, 1, 2, 1, 2, 5]
+
+    merge_sources(
+        paths, str(tmp_path / "join.csv"), {"how": "join", "on": ["id"]}
+    )
+    joined = pd.read_csv(tmp_path / "join.csv")
+    assert joined["id"].tolist() == [0, 1, 2]
+    assert joined["area"].tolist()[1:] == [7.0, 8.0]
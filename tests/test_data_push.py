@@ -1,8 +1,40 @@
 """Unit test for data push."""
 
-from unittest.mock import MagicMock, PropertyMock, patch
-
-from src.data_push import get_latest_tag, git_push, push_data
+import os
+from unittest.mock import MagicMock, patch
+
+import fsspec.config
+import pandas as pd
+import pytest
+import s3fs
+import yaml
+from dvc.repo import Repo as DvcRepo
+from git import Repo
+
+from src.artefacts import write_artefact
+from src.data_push import (
+    TagIndex,
+    data_unchanged,
+    dvc_add_files,
+    dvc_push,
+    dvc_remote_add,
+    get_dvc_outputs,
+    get_latest_tag,
+    git_add_files,
+    git_commit,
+    git_push,
+    prepare_workspace,
+    push_data,
+    seed_dvc_state,
+)
+
+
+@pytest.fixture
+def dvc_repo(tmp_path, monkeypatch):
+    """An empty dvc repo as the working directory."""
+    monkeypatch.chdir(tmp_path)
+    with DvcRepo.init(str(tmp_path), no_scm=True) as repo:
+        yield repo
 
 
 @patch("src.data_push.get_authenticated_github_url")
@@ -10,9 +42,10 @@ from src.data_push import get_latest_tag, git_push, push_data
 @patch("src.data_push.checkout_branch")
 @patch("src.data_push.pull_updates")
 @patch("src.data_push.copy_directory")
-@patch("src.data_push.dvc_main")
+@patch("src.data_push.DvcRepo")
 @patch("src.data_push.dvc_remote_add")
 @patch("src.data_push.dvc_add_files")
+@patch("src.data_push.data_unchanged", return_value=False)
 @patch("src.data_push.dvc_push")
 @patch("src.data_push.create_and_switch_branch")
 @patch("src.data_push.git_add_files")
@@ -26,9 +59,10 @@ def test_push_data(
     mock_git_add_files,
     mock_create_and_switch_branch,
     mock_dvc_push,
+    mock_data_unchanged,
     mock_dvc_add_files,
     mock_dvc_remote_add,
-    mock_dvc_main,
+    mock_DvcRepo,
     mock_copy_directory,
     mock_pull_updates,
     mock_checkout_branch,
@@ -43,34 +77,56 @@ def test_push_data(
     mock_repo = MagicMock()
     mock_repo.bare = False
     mock_Repo.return_value = mock_repo
+    mock_dvc_repo = mock_DvcRepo.return_value.__enter__.return_value
 
     config = {
         "git_repo_url": "https://example.com/repo.git",
         "git_branch": "main",
         "git_repo_save_name": "repo_dir",
+        "data_split": {"digests_path": "missing_digests.json"},
         # Additional config for dvc
     }
 
     # Call the function
-    push_data(config)
+    assert push_data(config)
 
     # Assertions
     mock_get_authenticated_github_url.assert_called_once_with(
         config["git_repo_url"]
     )
-    mock_dvc_remote_add.assert_called_once_with(config)
-    mock_dvc_add_files.assert_called_once_with(config)
-    mock_dvc_push.assert_called_once_with(config)
+    mock_dvc_remote_add.assert_called_once_with(mock_dvc_repo, config)
+    mock_dvc_add_files.assert_called_once_with(mock_dvc_repo, config)
+    mock_dvc_push.assert_called_once_with(mock_dvc_repo, config)
     mock_create_and_switch_branch.assert_called_once_with(mock_repo, config)
     mock_git_add_files.assert_called_once_with(mock_repo, config)
     mock_git_commit.assert_called_once_with(mock_repo, config)
     mock_git_push.assert_called_once_with(mock_repo, config)
 
+    # Nothing is pushed when the data is the same as the latest version
+    mock_data_unchanged.return_value = True
+    mock_dvc_push.reset_mock()
+    mock_git_commit.reset_mock()
+    mock_git_push.reset_mock()
+    assert not push_data(config)
+    mock_dvc_push.assert_not_called()
+    mock_git_commit.assert_not_called()
+    mock_git_push.assert_not_called()
+
+
+def mock_tags(repo, tags):
+    """Mock the `for-each-ref` listing of lightweight tags and commits."""
+    repo.git.for_each_ref.return_value = "\n".join(
+        f"{name} {sha} " for name, sha in tags.items()
+    )
+    repo.commit.side_effect = lambda sha=None: (
+        repo.head_commit if sha is None else MagicMock(hexsha=sha)
+    )
+
 
 def test_no_tags():
     """Test when there are no tags in the repository."""
     repo = MagicMock()
-    repo.tags = []
+    mock_tags(repo, {})
     result = get_latest_tag(repo)
     assert result["new_tag"] == "data-v1.0.0"
 
@@ -81,40 +137,27 @@ def test_valid_data_v_tag():
     The version should be incremented.
     """
     repo = MagicMock()
-
-    # Create a mock tag object
-    tag = MagicMock()
-    tag.name = "data-v1.2.0"
-    tag.commit.committed_datetime = "2000-01-01"
-
-    # Mock repo.tags to return the mock tag
-    repo.tags = [tag]
+    mock_tags(repo, {"data-v1.2.0": "aaaa"})
 
     result = get_latest_tag(repo)
     assert result["new_tag"] == "data-v1.3.0"
+    assert result["latest_commit"].hexsha == "aaaa"
 
 
 def test_multiple_data_v_tags():
     """Test when multiple valid data-v tags exist.
 
-    The latest one should be selected and incremented.
+    The highest version should be selected and incremented.
     """
     repo = MagicMock()
-
-    # Create multiple mock tag objects
-    tag1 = MagicMock()
-    tag1.name = "data-v1.1.0"
-    tag1.commit.committed_datetime = "2000-01-01"
-
-    tag2 = MagicMock()
-    tag2.name = "data-v1.2.0"
-    tag2.commit.committed_datetime = "2001-01-01"
-
-    # Mock repo.tags to return both tags
-    repo.tags = [tag1, tag2]
+    mock_tags(
+        repo,
+        {"data-v1.10.0": "cccc", "data-v1.1.0": "aaaa", "data-v1.9.0": "bbbb"},
+    )
 
     result = get_latest_tag(repo)
-    assert result["new_tag"] == "data-v1.3.0"
+    assert result["new_tag"] == "data-v1.11.0"
+    assert result["latest_commit"].hexsha == "cccc"
 
 
 def test_non_data_v_tags():
@@ -122,18 +165,7 @@ def test_non_data_v_tags():
 
     All the non data-v tags should be ignored."""
     repo = MagicMock()
-
-    # Create mock tag objects where one is unrelated
-    tag1 = MagicMock()
-    tag1.name = "v1.0.1"
-    tag1.commit.committed_datetime = "2002-01-01"
-
-    tag2 = MagicMock()
-    tag2.name = "data-v1.0.0"
-    tag2.commit.committed_datetime = "2001-01-01"
-
-    # Mock repo.tags to return both tags
-    repo.tags = [tag1, tag2]
+    mock_tags(repo, {"v1.0.1": "bbbb", "data-v1.0.0": "aaaa"})
 
     result = get_latest_tag(repo)
     assert result["new_tag"] == "data-v1.1.0"
@@ -144,105 +176,88 @@ def test_empty_data_v_tag():
 
     Should return data-v1.0.0."""
     repo = MagicMock()
-
-    # Mock repo.tags with tags that don't match the 'data-v' pattern
-    tag1 = MagicMock()
-    tag1.name = "v1.0.0"
-    tag1.commit.committed_datetime = "2000-01-01"
-
-    tag2 = MagicMock()
-    tag2.name = "v2.0.0"
-    tag2.commit.committed_datetime = "2001-01-01"
-
-    repo.tags = [tag1, tag2]
+    mock_tags(repo, {"v1.0.0": "aaaa", "v2.0.0": "bbbb"})
 
     result = get_latest_tag(repo)
     assert result["new_tag"] == "data-v1.0.0"
 
 
-def test_add_previous_tag():
-    """Test adding the data-previous tag when a valid latest commit exists."""
-    repo = MagicMock()
+def test_tag_index_reads_annotated_tags(tmp_path, remote_repo):
+    """Tags are read in one listing, annotated ones to their commit."""
+    commit = remote_repo.head.commit
+    remote_repo.create_tag("data-v1.0.0")
+    remote_repo.create_tag("data-v1.1.0", message="annotated")
 
-    # Create mock tags and commits
-    latest_commit = MagicMock()
-    latest_commit.hexsha = "abcd1234"
-    latest_commit.committed_datetime = "2025-01-01"
+    tag_index = TagIndex.from_repo(remote_repo)
 
-    # Mock a previous tag with a commit
-    prev_tag = MagicMock()
-    prev_tag.name = "data-v1.0.0"
-    prev_tag.commit = latest_commit
-
-    # Set up repo.tags to include the previous tag
-    type(repo).tags = PropertyMock(return_value=[prev_tag])
+    assert tag_index.tags == {
+        "data-v1.0.0": commit.hexsha,
+        "data-v1.1.0": commit.hexsha,
+    }
+    assert "data-v1.1.0" in tag_index
+    assert tag_index.latest_data_tag() == "data-v1.1.0"
 
-    # Ensure repo.commit() returns the latest commit
-    repo.commit = MagicMock(return_value=latest_commit)
 
-    # Mock create_tag and push methods
-    repo.create_tag = MagicMock()
-    repo.delete_tag = MagicMock()
-    repo.git.push = MagicMock()
+def test_add_previous_tag():
+    """Test adding the data-previous tag when a valid latest commit exists."""
+    repo = MagicMock()
+    mock_tags(repo, {"data-v1.0.0": "abcd1234"})
+    repo.head_commit = MagicMock(hexsha="abcd5678")
 
     # Call the function under test
     config = {"git_branch": "main"}
     git_push(repo, config)
 
     # Verify 'data-previous' was created on the correct commit
-    repo.create_tag.assert_any_call("data-previous", ref=latest_commit)
-    repo.git.push.assert_any_call("origin", "data-previous")
+    latest_commit = repo.create_tag.call_args_list[0].kwargs["ref"]
+    assert latest_commit.hexsha == "abcd1234"
+    repo.create_tag.assert_any_call(
+        "data-previous", ref=latest_commit, force=True
+    )
+    repo.git.push.assert_called_once_with(
+        "--atomic",
+        "origin",
+        "main",
+        "+abcd1234:refs/tags/data-previous",
+        "refs/tags/data-v1.1.0",
+        "+abcd5678:refs/tags/data-latest",
+    )
 
 
 def test_add_latest_tag():
     """Test adding the 'data-latest' tag to the current HEAD."""
     repo = MagicMock()
-
-    # Mock tags and the current commit
-    current_commit = MagicMock()
-    current_commit.hexsha = "abcd5678"
-    repo.commit.return_value = current_commit
-
-    repo.tags = []
-    repo.create_tag = MagicMock()
-    repo.git.push = MagicMock()
+    mock_tags(repo, {})
+    repo.head_commit = MagicMock(hexsha="abcd5678")
 
     # Call the function to create and push tags
     config = {"git_branch": "main"}
     git_push(repo, config)
 
     # Check that 'data-latest' tag was created
-    repo.create_tag.assert_any_call("data-latest", ref=current_commit)
-    repo.git.push.assert_any_call("origin", "data-latest")
+    repo.create_tag.assert_any_call(
+        "data-latest", ref=repo.head_commit, force=True
+    )
+    assert "+abcd5678:refs/tags/data-latest" in repo.git.push.call_args.args
 
 
 def test_update_existing_latest_tag():
     """Test updating the 'data-latest' tag if it already exists."""
     repo = MagicMock()
-
-    # Mock an existing 'data-latest' tag
-    existing_latest_tag = MagicMock()
-    existing_latest_tag.name = "data-latest"
-    repo.tags = [existing_latest_tag]
-
-    # Mock the current commit
-    current_commit = MagicMock()
-    current_commit.hexsha = "abcd5678"
-    repo.commit.return_value = current_commit
-
-    repo.create_tag = MagicMock()
-    repo.delete_tag = MagicMock()
-    repo.git.push = MagicMock()
+    mock_tags(repo, {"data-latest": "abcd1234"})
+    repo.head_commit = MagicMock(hexsha="abcd5678")
 
     # Call the function to create and push tags
     config = {"git_branch": "main"}
     git_push(repo, config)
 
-    # Ensure the existing 'data-latest' tag is deleted and recreated
-    repo.delete_tag.assert_called_once_with("data-latest")
-    repo.create_tag.assert_any_call("data-latest", ref=current_commit)
-    repo.git.push.assert_any_call("--delete", "origin", "data-latest")
-    repo.git.push.assert_any_call("origin", "data-latest")
+    # Ensure the existing 'data-latest' tag is moved in a single push
+    repo.delete_tag.assert_not_called()
+    repo.create_tag.assert_any_call(
+        "data-latest", ref=repo.head_commit, force=True
+    )
+    repo.git.push.assert_called_once()
+    assert "+abcd5678:refs/tags/data-latest" in repo.git.push.call_args.args
 
 
 def test_no_previous_commit():
@@ -250,15 +265,8 @@ def test_no_previous_commit():
     repo = MagicMock()
 
     # No tags exist, and latest_commit is None
-    repo.tags = []
-    # Mock the current commit
-    current_commit = MagicMock()
-    current_commit.hexsha = "abcd5678"
-    repo.commit.return_value = current_commit
-
-    # Mock methods
-    repo.create_tag = MagicMock()
-    repo.git.push = MagicMock()
+    mock_tags(repo, {})
+    repo.head_commit = MagicMock(hexsha="abcd5678")
 
     # Call the function to create and push tags
     config = {"git_branch": "main"}
@@ -270,5 +278,354 @@ def test_no_previous_commit():
             call.args[0] != "data-previous"
         ), f"Unexpected call with tag 'data-previous': {call}"
 
-    # Ensure the branch is pushed
-    repo.git.push.assert_any_call("origin", config["git_branch"])
+    # Ensure the branch is pushed with the tags
+    repo.git.push.assert_called_once_with(
+        "--atomic",
+        "origin",
+        config["git_branch"],
+        "refs/tags/data-v1.0.0",
+        "+abcd5678:refs/tags/data-latest",
+    )
+
+
+def test_get_dvc_outputs():
+    """Split files are tracked, or their partitions in incremental mode."""
+    config = {
+        "data_split": {
+            "train_data_save_path": "./artefacts/train_data.csv",
+            "val_data_save_path": "./artefacts/val_data.csv",
+            "test_data_save_path": "./artefacts/test_data.csv",
+        }
+    }
+    assert get_dvc_outputs(config) == [
+        "artefacts/train_data.csv",
+        "artefacts/val_data.csv",
+        "artefacts/test_data.csv",
+        "./artefacts/imputation_stats.json",
+    ]
+
+    config["data_split"]["partition_rows"] = 1000
+    assert get_dvc_outputs(config) == [
+        "artefacts/train_data",
+        "artefacts/val_data",
+        "artefacts/test_data",
+        "./artefacts/imputation_stats.json",
+    ]
+
+    config["incremental"] = {
+        "enabled": True,
+        "state_dir": "./artefacts/ingestion_state",
+    }
+    assert get_dvc_outputs(config) == [
+        "artefacts/train_data",
+        "artefacts/val_data",
+        "artefacts/test_data",
+        "./artefacts/ingestion_state",
+        "./artefacts/imputation_stats.json",
+    ]
+
+
+def test_dvc_remote_add(dvc_repo, monkeypatch):
+    """The remote and its credentials are written in the dvc config."""
+    for name in ("DVC_REMOTE_NAME", "DVC_REMOTE", "DVC_ENDPOINT_URL"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("DVC_ACCESS_KEY_ID", "key-id")
+    monkeypatch.setenv("DVC_SECRET_ACCESS_KEY", "secret")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+    monkeypatch.setenv("DVC_PUSH_JOBS", "16")
+    monkeypatch.setattr(fsspec.config, "conf", {})
+    config = {
+        "dvc_remote_name": "remote",
+        "dvc_remote": "s3://artifacts",
+        "dvc_endpoint_url": "http://minio",
+        "dvc_push": {"jobs": 4, "max_pool_connections": 64, "retries": 3},
+    }
+
+    dvc_remote_add(dvc_repo, config)
+    # Replaces the existing remote
+    dvc_remote_add(dvc_repo, config)
+
+    assert dvc_repo.config.load_one("repo")["remote"]["remote"] == {
+        "url": "s3://artifacts",
+        "endpointurl": "http://minio",
+        "access_key_id": "key-id",
+        "secret_access_key": "secret",
+        "region": "eu-west-2",
+        # The environment overrides the config
+        "jobs": "16",
+    }
+    # The S3 client settings are taken by the s3 filesystems
+    fs = s3fs.S3FileSystem(
+        endpoint_url="http://minio", skip_instance_cache=True
+    )
+    assert fs.max_concurrency == 4
+    assert fs.config_kwargs["max_pool_connections"] == 64
+    assert fs.config_kwargs["retries"] == {
+        "max_attempts": 3,
+        "mode": "adaptive",
+    }
+
+
+def test_seed_dvc_state(dvc_repo, tmp_path):
+    """DVC takes the digests computed on write instead of the files."""
+    (tmp_path / "artefacts").mkdir()
+    digests = {
+        path: write_artefact(pd.DataFrame({"a": [i]}), path, "csv")
+        for i, path in enumerate(["artefacts/a.csv", "artefacts/b.csv"])
+    }
+    # A digest DVC couldn't compute itself shows it wasn't recomputed
+    digests["artefacts/a.csv"]["md5"] = "0" * 32
+    # A file modified after it was written is hashed again
+    digests["artefacts/b.csv"]["mtime_ns"] -= 1
+
+    seed_dvc_state(dvc_repo, digests)
+    dvc_repo.add(["artefacts/a.csv", "artefacts/b.csv"])
+
+    a_dvc = yaml.safe_load((tmp_path / "artefacts/a.csv.dvc").read_text())
+    b_dvc = yaml.safe_load((tmp_path / "artefacts/b.csv.dvc").read_text())
+    assert a_dvc["outs"][0]["md5"] == "0" * 32
+    assert b_dvc["outs"][0]["md5"] == digests["artefacts/b.csv"]["md5"]
+
+
+def test_dvc_add_and_push_files(dvc_repo, tmp_path, caplog):
+    """All the outputs are added at once and pushed to the remote."""
+    config = {
+        "dvc_remote_name": "local",
+        "data_split": {
+            **{
+                f"{split}_data_save_path": f"artefacts/{split}_data.csv"
+                for split in ("train", "val", "test")
+            },
+            "imputation_stats_path": "artefacts/imputation_stats.json",
+        },
+    }
+    (tmp_path / "artefacts").mkdir()
+    for split in ("train", "val", "test"):
+        (tmp_path / "artefacts" / f"{split}_data.csv").write_text(split)
+    (tmp_path / "artefacts" / "imputation_stats.json").write_text("{}")
+    with dvc_repo.config.edit() as dvc_config:
+        dvc_config["remote"]["local"] = {"url": str(tmp_path / "remote")}
+
+    dvc_add_files(dvc_repo, config)
+    with caplog.at_level("INFO"):
+        dvc_push(dvc_repo, config)
+
+    for split in ("train", "val", "test"):
+        assert (tmp_path / "artefacts" / f"{split}_data.csv.dvc").exists()
+    assert (tmp_path / "artefacts" / "imputation_stats.json.dvc").exists()
+    assert len(list((tmp_path / "remote").rglob("*"))) > 4
+    (record,) = [r for r in caplog.records if hasattr(r, "files_pushed")]
+    assert record.files_pushed == 4
+    assert record.bytes == len("train") + len("val") + len("test") + 2
+    assert any(hasattr(r, "files_done") for r in caplog.records)
+
+
+def test_dvc_push_counts_missing_files(dvc_repo, tmp_path, caplog):
+    """Only the partitions missing on the remote are counted as pushed."""
+    config = {
+        "dvc_remote_name": "local",
+        "dvc_push": {"jobs": 2},
+        "data_split": {
+            **{
+                f"{split}_data_save_path": f"artefacts/{split}_data.csv"
+                for split in ("train", "val", "test")
+            },
+            "partition_rows": 10,
+            "imputation_stats_path": "artefacts/imputation_stats.json",
+        },
+    }
+    artefacts_dir = tmp_path / "artefacts"
+    for split in ("train", "val", "test"):
+        (artefacts_dir / f"{split}_data").mkdir(parents=True)
+        (artefacts_dir / f"{split}_data" / "part-00000.csv").write_text(
+            f"{split} 0\n"
+        )
+    (artefacts_dir / "imputation_stats.json").write_text("{}")
+    with dvc_repo.config.edit() as dvc_config:
+        dvc_config["remote"]["local"] = {"url": str(tmp_path / "remote")}
+    dvc_add_files(dvc_repo, config)
+    dvc_push(dvc_repo, config)
+
+    (artefacts_dir / "train_data" / "part-00001.csv").write_text("new\n")
+    dvc_add_files(dvc_repo, config)
+    caplog.clear()
+    with caplog.at_level("INFO"):
+        dvc_push(dvc_repo, config)
+
+    (record,) = [r for r in caplog.records if hasattr(r, "files_pushed")]
+    # The new partition and the new manifest of its directory
+    assert record.files_pushed == 2
+    assert record.bytes == len("new\n")
+
+
+def test_git_add_files_commits_gitignore(tmp_path, monkeypatch):
+    """The outputs are ignored in the commit, as `dvc add` set them."""
+    monkeypatch.chdir(tmp_path)
+    repo = Repo.init(tmp_path)
+    repo.git.config("user.name", "test")
+    repo.git.config("user.email", "test@example.com")
+    config = {
+        "commit_message": "update dvc data",
+        "data_split": {
+            **{
+                f"{split}_data_save_path": f"artefacts/{split}_data.csv"
+                for split in ("train", "val", "test")
+            },
+            "imputation_stats_path": "artefacts/imputation_stats.json",
+        },
+        "incremental": {
+            "enabled": True,
+            "state_dir": "./artefacts/ingestion_state",
+        },
+    }
+    for path in get_dvc_outputs(config)[:-1]:
+        os.makedirs(path)
+        (tmp_path / path / "part-00000.csv").write_text(path)
+    (tmp_path / "artefacts" / "imputation_stats.json").write_text("{}")
+    # Initialised without git, then opened in the git repo
+    DvcRepo.init(str(tmp_path), no_scm=True).close()
+    with DvcRepo(str(tmp_path)) as dvc_repo:
+        with dvc_repo.config.edit() as dvc_config:
+            del dvc_config["core"]["no_scm"]
+    with DvcRepo(str(tmp_path)) as dvc_repo:
+        dvc_add_files(dvc_repo, config)
+
+    git_add_files(repo, config)
+    git_commit(repo, config)
+
+    gitignore = repo.git.show("HEAD:artefacts/.gitignore").splitlines()
+    assert sorted(gitignore) == [
+        "/imputation_stats.json",
+        "/ingestion_state",
+        "/test_data",
+        "/train_data",
+        "/val_data",
+    ]
+    # Only the files of `dvc init` are left untracked
+    assert not [
+        path for path in repo.untracked_files if path.startswith("artefacts")
+    ]
+
+
+@pytest.fixture
+def remote_repo(tmp_path):
+    """A bare origin repo with a commit on its default branch."""
+    origin = Repo.init(tmp_path / "origin.git", bare=True)
+    origin.git.config("uploadpack.allowFilter", "true")
+    seed = Repo.init(tmp_path / "seed")
+    seed.git.config("user.name", "test")
+    seed.git.config("user.email", "test@example.com")
+    (tmp_path / "seed" / "README.md").write_text("data ingestion")
+    seed.index.add("README.md")
+    seed.index.commit("initial commit")
+    seed.git.push(str(tmp_path / "origin.git"), "HEAD:refs/heads/main")
+    origin.git.symbolic_ref("HEAD", "refs/heads/main")
+    return seed
+
+
+def test_prepare_workspace(tmp_path, remote_repo, monkeypatch):
+    """The workspace is cloned once, then updated in place."""
+    monkeypatch.chdir(tmp_path)
+    git_url = f"file://{tmp_path / 'origin.git'}"
+    config = {
+        "git_repo_url": git_url,
+        "git_repo_save_name": "workspace",
+        "git_branch": "data",
+    }
+    # Data produced by the pipeline before the push
+    (tmp_path / "workspace" / "artefacts").mkdir(parents=True)
+    (tmp_path / "workspace" / "artefacts" / "train.csv").write_text("a")
+
+    repo = prepare_workspace(git_url, config)
+    assert repo.active_branch.name == "data"
+    assert (tmp_path / "workspace" / "README.md").exists()
+    assert (tmp_path / "workspace" / "artefacts" / "train.csv").exists()
+    assert not (tmp_path / "workspace.clone").exists()
+    # A partial clone, the file contents are fetched when checked out
+    assert repo.git.config("remote.origin.partialclonefilter") == "blob:none"
+    (tmp_path / "workspace" / "data.dvc").write_text("md5")
+    repo.index.add("data.dvc")
+    repo.index.commit("update dvc data")
+    repo.git.push("origin", "data")
+    repo.create_tag("data-v1.0.0")
+    repo.git.push("origin", "data-v1.0.0")
+
+    # Another run pushes to the branch, the workspace catches up
+    other = Repo.clone_from(git_url, tmp_path / "other", branch="data")
+    (tmp_path / "other" / "data.dvc").write_text("new md5")
+    other.index.add("data.dvc")
+    other.index.commit("update dvc data")
+    other.git.push("origin", "data")
+    other.create_tag("data-v1.1.0")
+    other.git.push("origin", "data-v1.1.0")
+    # Leftovers of a failed run are discarded
+    (tmp_path / "workspace" / "data.dvc").write_text("stale md5")
+
+    repo = prepare_workspace(git_url, config)
+    assert repo.head.commit == other.head.commit
+    assert (tmp_path / "workspace" / "data.dvc").read_text() == "new md5"
+    assert {tag.name for tag in repo.tags} == {"data-v1.0.0", "data-v1.1.0"}
+    assert (tmp_path / "workspace" / "artefacts" / "train.csv").exists()
+
+
+def test_git_push_moves_rolling_tags(tmp_path, remote_repo):
+    """Rolling tags move on the remote along with the new version."""
+    repo = Repo.clone_from(tmp_path / "origin.git", tmp_path / "workspace")
+    config = {"git_branch": "data"}
+    repo.git.checkout("-b", "data")
+    commits = []
+    for content in ("v1", "v2"):
+        (tmp_path / "workspace" / "data.dvc").write_text(content)
+        repo.index.add("data.dvc")
+        commits.append(repo.index.commit("update dvc data"))
+        git_push(repo, config)
+
+    origin = Repo(tmp_path / "origin.git")
+    remote_tags = {tag.name: tag.commit for tag in origin.tags}
+    assert remote_tags == {
+        "data-v1.0.0": commits[0],
+        "data-v1.1.0": commits[1],
+        "data-previous": commits[0],
+        "data-latest": commits[1],
+    }
+    assert origin.heads["data"].commit == commits[1]
+
+
+def test_data_unchanged(tmp_path, remote_repo, monkeypatch):
+    """The .dvc files hashes are compared with the ones at data-latest."""
+    monkeypatch.chdir(tmp_path / "seed")
+    config = {
+        "data_split": {
+            **{
+                f"{split}_data_save_path": f"artefacts/{split}_data.csv"
+                for split in ("train", "val", "test")
+            },
+            "imputation_stats_path": "artefacts/imputation_stats.json",
+        }
+    }
+    outputs = [
+        "train_data.csv",
+        "val_data.csv",
+        "test_data.csv",
+        "imputation_stats.json",
+    ]
+    artefacts_dir = tmp_path / "seed" / "artefacts"
+    artefacts_dir.mkdir()
+
+    def write_dvc_files(train_md5):
+        for output in outputs:
+            md5 = train_md5 if output == "train_data.csv" else f"{output}-md5"
+            (artefacts_dir / f"{output}.dvc").write_text(
+                f"outs:\n- md5: {md5}\n  size: 4\n  path: {output}\n"
+            )
+
+    write_dvc_files("train-md5")
+    assert not data_unchanged(remote_repo, config)
+
+    remote_repo.index.add([f"artefacts/{output}.dvc" for output in outputs])
+    remote_repo.index.commit("update dvc data")
+    remote_repo.create_tag("data-latest")
+    assert data_unchanged(remote_repo, config)
+
+    write_dvc_files("new-train-md5")
+    assert not data_unchanged(remote_repo, config)
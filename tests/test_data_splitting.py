@@ -1,11 +1,18 @@
 """Unit test for data splitting."""
 
+import os
 from unittest.mock import patch
 
+import numpy as np
 import pandas as pd
 import pytest
 
-from src.data_splitting import split_data
+from src import artefacts, utils
+from src.data_splitting import (
+    get_split_key_cols,
+    hash_split_labels,
+    split_data,
+)
 
 # Test config
 config = {
@@ -22,6 +29,12 @@ config = {
 }
 
 
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run in a temporary directory, where the digests are recorded."""
+    monkeypatch.chdir(tmp_path)
+
+
 @pytest.fixture
 def mock_data():
     """Mock data."""
@@ -34,11 +47,15 @@ def mock_data():
     )
 
 
-@patch("src.data_splitting.pd.read_csv")
-@patch("src.data_splitting.pd.DataFrame.to_csv")
+@patch("src.artefacts.pd.read_csv")
+@patch("src.artefacts.pd.DataFrame.to_csv")
 @patch("src.data_splitting.train_test_split")
 def test_split_data(
-    mock_train_test_split, mock_to_csv, mock_read_csv, mock_data
+    mock_train_test_split,
+    mock_to_csv,
+    mock_read_csv,
+    mock_data,
+    tmp_path,
 ):
     """Test successful data splitting."""
     # Mock the read_csv method
@@ -65,7 +82,276 @@ def test_split_data(
 
     split_data(config)
 
-    # Check if to_csv was called with the correct file path
+    # Check if to_csv wrote the test split, opened by the artefact writer
     mock_to_csv.assert_called_with(
-        config["data_split"]["test_data_save_path"], index=False
+        mock_to_csv.call_args.args[0], index=False, header=True
+    )
+    assert (tmp_path / config["data_split"]["test_data_save_path"]).exists()
+
+
+def test_split_data_parquet(tmp_path):
+    """Splits are written in the configured artefact format."""
+    data = pd.DataFrame(
+        {
+            "feature1": range(100),
+            "category": ["yes", "no"] * 50,
+            "target": [float(i) for i in range(100)],
+        }
+    )
+    data.to_parquet(tmp_path / "cleansed_data.parquet", index=False)
+    parquet_config = {
+        "data_split": {
+            **config["data_split"],
+            "artefact_format": "parquet",
+            "cleansed_data_save_path": str(tmp_path / "cleansed_data.csv"),
+            "train_data_save_path": str(tmp_path / "train_data.csv"),
+            "val_data_save_path": str(tmp_path / "val_data.csv"),
+            "test_data_save_path": str(tmp_path / "test_data.csv"),
+        }
+    }
+
+    split_data(parquet_config)
+
+    splits = [
+        pd.read_parquet(tmp_path / f"{split}_data.parquet")
+        for split in ("train", "val", "test")
+    ]
+    assert [len(split) for split in splits] == [60, 20, 20]
+    for split in splits:
+        pd.testing.assert_series_equal(split.dtypes, data.dtypes)
+
+
+def test_split_data_in_memory(tmp_path):
+    """Data handed over in memory is split as if read from disk."""
+    data = pd.DataFrame({"feature1": range(50), "target": range(50)})
+    data.to_csv(tmp_path / "cleansed_data.csv", index=False)
+    split_config = {
+        "data_split": {
+            **config["data_split"],
+            "cleansed_data_save_path": str(tmp_path / "cleansed_data.csv"),
+            "train_data_save_path": str(tmp_path / "train_data.csv"),
+            "val_data_save_path": str(tmp_path / "val_data.csv"),
+            "test_data_save_path": str(tmp_path / "test_data.csv"),
+        }
+    }
+    split_data(split_config)
+    from_disk = (tmp_path / "train_data.csv").read_bytes()
+
+    (tmp_path / "cleansed_data.csv").unlink()
+    split_data(split_config, data=data)
+
+    assert (tmp_path / "train_data.csv").read_bytes() == from_disk
+
+
+def test_hash_split_labels():
+    """Rows keep their split when others are added, in the right shares."""
+    data = pd.DataFrame({"feature1": range(20_000), "target": 1.0})
+    labels = hash_split_labels(data, 42, 0.2, 0.25)
+
+    shares = pd.Series(labels).value_counts(normalize=True)
+    assert shares["test"] == pytest.approx(0.2, abs=0.01)
+    assert shares["val"] == pytest.approx(0.8 * 0.25, abs=0.01)
+    assert shares["train"] == pytest.approx(0.8 * 0.75, abs=0.01)
+
+    subset_labels = hash_split_labels(data.iloc[::3], 42, 0.2, 0.25)
+    assert (subset_labels == labels[::3]).all()
+    assert (hash_split_labels(data, 7, 0.2, 0.25) != labels).any()
+
+
+@pytest.mark.parametrize("artefact_format", ["csv", "parquet", "arrow"])
+def test_split_data_hash(tmp_path, monkeypatch, artefact_format):
+    """The hash splitter streams chunks and keeps rows in their split."""
+    monkeypatch.setattr("src.data_splitting.SPLIT_CHUNK_ROWS", 64)
+    data = pd.DataFrame(
+        {
+            "feature1": range(1000),
+            "category": ["yes", "no"] * 500,
+            "target": [float(i % 7) for i in range(1000)],
+        }
+    )
+    suffix = artefacts.ARTEFACT_SUFFIXES[artefact_format]
+    hash_config = {
+        "data_split": {
+            **config["data_split"],
+            "splitter": "hash",
+            "split_key_cols": ["feature1"],
+            "artefact_format": artefact_format,
+            "cleansed_data_save_path": str(tmp_path / "cleansed_data.csv"),
+            "train_data_save_path": str(tmp_path / "train_data.csv"),
+            "val_data_save_path": str(tmp_path / "val_data.csv"),
+            "test_data_save_path": str(tmp_path / "test_data.csv"),
+        }
+    }
+
+    def read_splits():
+        return {
+            split: artefacts.read_artefact(
+                tmp_path / f"{split}_data{suffix}", artefact_format
+            )
+            for split in ("train", "val", "test")
+        }
+
+    artefacts.write_artefact(
+        data.iloc[:600], tmp_path / f"cleansed_data{suffix}", artefact_format
+    )
+    split_data(hash_config)
+    before = read_splits()
+    artefacts.write_artefact(
+        data, tmp_path / f"cleansed_data{suffix}", artefact_format
+    )
+    split_data(hash_config)
+    after = read_splits()
+
+    assert sum(len(split) for split in after.values()) == len(data)
+    for split, split_data_ in before.items():
+        assert list(split_data_.columns) == ["feature1", "category", "target"]
+        assert set(split_data_["feature1"]) <= set(after[split]["feature1"])
+    assert len(after["test"]) == pytest.approx(200, abs=40)
+
+
+def test_split_data_hash_ignores_imputed_cols(tmp_path):
+    """Rows with gaps keep their split when the imputed values change."""
+    data = pd.DataFrame(
+        {
+            "feature1": range(1000),
+            "feature2": [np.nan if i % 3 else float(i) for i in range(1000)],
+            "target": [float(i % 7) for i in range(1000)],
+        }
+    )
+    hash_config = {
+        "data_split": {
+            **config["data_split"],
+            "splitter": "hash",
+            "numeric_cols": ["feature2"],
+            "categorical_cols": [],
+            "cleansed_data_save_path": str(tmp_path / "cleansed_data.csv"),
+        }
+    }
+
+    def split_imputed(median):
+        data.fillna({"feature2": median}).to_csv(
+            tmp_path / "cleansed_data.csv", index=False
+        )
+        split_data(hash_config)
+        return {
+            split: set(pd.read_csv(f"{split}_data.csv")["feature1"])
+            for split in ("train", "val", "test")
+        }
+
+    assert split_imputed(100.0) == split_imputed(500.0)
+
+    hash_config["data_split"]["numeric_cols"] = ["feature1", "feature2"]
+    hash_config["data_split"]["categorical_cols"] = ["target"]
+    with pytest.raises(ValueError, match="split_key_cols"):
+        split_imputed(100.0)
+
+
+def test_split_key_cols_shipped_config():
+    """The housing data needs explicit key columns to be hash split."""
+    shipped = utils.load_yaml_config(
+        os.path.join(os.path.dirname(__file__), "..", "config.yaml")
+    )
+    data_split = shipped["data_split"]
+    columns = [
+        artefacts.CSV_INDEX_COL,
+        data_split["label_col"],
+        *data_split["numeric_cols"],
+        *data_split["categorical_cols"],
+    ]
+    # Only the label is never imputed
+    with pytest.raises(ValueError, match=r"\['price'\]"):
+        get_split_key_cols(shipped, columns)
+
+    keyed = {"data_split": {**data_split, "split_key_cols": ["price", "area"]}}
+    assert get_split_key_cols(keyed, columns) == ["price", "area"]
+
+
+def test_split_data_partitioned(tmp_path):
+    """Appended rows leave the first partitions of each split unchanged."""
+    data = pd.DataFrame(
+        {"feature1": range(1000), "target": [i % 7 for i in range(1000)]}
+    )
+    partitioned_config = {
+        "data_split": {
+            **config["data_split"],
+            "splitter": "hash",
+            "partition_rows": 50,
+            "cleansed_data_save_path": str(tmp_path / "cleansed_data.csv"),
+            "train_data_save_path": str(tmp_path / "train_data.csv"),
+            "val_data_save_path": str(tmp_path / "val_data.csv"),
+            "test_data_save_path": str(tmp_path / "test_data.csv"),
+        }
+    }
+
+    def part_digests():
+        return {
+            path: digest["md5"]
+            for path, digest in artefacts.load_digests(
+                partitioned_config
+            ).items()
+            if os.path.exists(path)
+        }
+
+    data.iloc[:900].to_csv(tmp_path / "cleansed_data.csv", index=False)
+    split_data(partitioned_config)
+    before = part_digests()
+    data.to_csv(tmp_path / "cleansed_data.csv", index=False)
+    split_data(partitioned_config)
+    after = part_digests()
+
+    for split in ("train", "val", "test"):
+        parts = sorted((tmp_path / f"{split}_data").iterdir())
+        assert all(len(pd.read_csv(part)) == 50 for part in parts[:-1])
+        # Only the last partition written before changed
+        before_parts = sorted(
+            path for path in before if f"{split}_data" in path
+        )
+        assert len(parts) >= len(before_parts) > 2
+        for path in before_parts[:-1]:
+            assert after[path] == before[path]
+    assert not (tmp_path / "train_data.csv").exists()
+
+
+def test_split_data_unknown_splitter():
+    """An unknown splitter is rejected."""
+    with pytest.raises(ValueError):
+        split_data({"data_split": {**config["data_split"], "splitter": "x"}})
+
+
+def test_split_data_stratified(tmp_path, monkeypatch):
+    """Every split gets its share of every label quantile bin."""
+    monkeypatch.setattr("src.data_splitting.SPLIT_CHUNK_ROWS", 250)
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(
+        {
+            "feature1": range(2000),
+            "target": np.sort(rng.lognormal(15, 0.5, 2000)),
+        }
+    )
+    data.to_csv(tmp_path / "cleansed_data.csv", index=False)
+    stratified_config = {
+        "data_split": {
+            **config["data_split"],
+            "splitter": "stratified",
+            "stratify_bins": 10,
+            "cleansed_data_save_path": str(tmp_path / "cleansed_data.csv"),
+            "train_data_save_path": str(tmp_path / "train_data.csv"),
+            "val_data_save_path": str(tmp_path / "val_data.csv"),
+            "test_data_save_path": str(tmp_path / "test_data.csv"),
+        }
+    }
+
+    split_data(stratified_config)
+
+    splits = {
+        split: pd.read_csv(tmp_path / f"{split}_data.csv")
+        for split in ("train", "val", "test")
+    }
+    assert [len(split) for split in splits.values()] == [1200, 400, 400]
+    assert pd.concat(splits.values())["feature1"].sort_values().tolist() == (
+        list(range(2000))
     )
+    # Sorted labels: every 200 rows form a bin split 120/40/40
+    for split, share in (("train", 120), ("val", 40), ("test", 40)):
+        bins = splits[split]["feature1"] // 200
+        assert (bins.value_counts() == share).all()
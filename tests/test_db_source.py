@@ -0,0 +1,204 @@
+"""Unit test for the database source."""
+
+import sqlite3
+import types
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import db_source
+
+
+@pytest.fixture
+def source(tmp_path):
+    """A SQLite table with gaps and missing values in its key."""
+    rng = np.random.default_rng(0)
+    ids = rng.choice(100_000, 2_000, replace=False).astype("float64")
+    ids[:5] = np.nan
+    houses = pd.DataFrame(
+        {
+            "id": ids,
+            "price": rng.integers(1_000_000, 9_000_000, 2_000),
+            "mainroad": rng.choice(["yes", "no"], 2_000),
+        }
+    )
+    with sqlite3.connect(tmp_path / "houses.db") as connection:
+        houses.to_sql("houses", connection, index=False)
+    return {
+        "name": "houses",
+        "database": str(tmp_path / "houses.db"),
+        "query": "SELECT id, price, mainroad FROM houses WHERE price > 0",
+        "batch_rows": 128,
+    }
+
+
+class _CursorSpy:
+    """Records the sizes of the batches fetched by a cursor."""
+
+    batches = []
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def fetchmany(self, size):
+        rows = self._cursor.fetchmany(size)
+        self.batches.append(len(rows))
+        return rows
+
+
+def test_export_query_in_batches(source, tmp_path):
+    """The rows are fetched and written in batches of `batch_rows`."""
+    _CursorSpy.batches = []
+    real_cursor = db_source._cursor
+    with patch(
+        "src.db_source._cursor",
+        lambda *args: _CursorSpy(real_cursor(*args)),
+    ):
+        db_source.export_query(source, str(tmp_path / "houses.csv"))
+
+    assert max(_CursorSpy.batches) == 128
+    assert sum(_CursorSpy.batches) == 2_000
+    with sqlite3.connect(source["database"]) as connection:
+        expected = pd.read_sql_query(source["query"], connection)
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "houses.csv"), expected
+    )
+
+
+def test_export_query_in_ranges(source, tmp_path):
+    """Range partitioned queries export every row once, in key order."""
+    partitioned = {**source, "partition_col": "id", "partitions": 7}
+
+    db_source.export_query(partitioned, str(tmp_path / "houses.csv"))
+
+    exported = pd.read_csv(tmp_path / "houses.csv")
+    with sqlite3.connect(source["database"]) as connection:
+        expected = pd.read_sql_query(
+            f"{source['query']} ORDER BY id IS NULL, id", connection
+        )
+    # The rows without a key come last, with the last range
+    pd.testing.assert_frame_equal(exported, expected)
+    # The range files are removed
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "houses.csv",
+        "houses.db",
+    ]
+
+
+class _NamedCursor:
+    """SQLite cursor that behaves like a psycopg2 server-side cursor."""
+
+    def __init__(self, cursor, named):
+        self._cursor = cursor
+        self._named = named
+        self._fetched = False
+
+    @property
+    def description(self):
+        # A named cursor has no description before its first fetch
+        if self._named and not self._fetched:
+            return None
+        return self._cursor.description
+
+    def execute(self, query, params=()):
+        self._cursor.execute(query.replace("%s", "?"), params)
+
+    def fetchmany(self, size):
+        self._fetched = True
+        return self._cursor.fetchmany(size)
+
+    def fetchone(self):
+        self._fetched = True
+        return self._cursor.fetchone()
+
+    def close(self):
+        self._cursor.close()
+
+
+class _Connection:
+    """SQLite connection with the psycopg2 `cursor(name=...)` signature."""
+
+    def __init__(self, database):
+        self._connection = sqlite3.connect(database, check_same_thread=False)
+
+    def cursor(self, name=None):
+        return _NamedCursor(self._connection.cursor(), name is not None)
+
+    def close(self):
+        self._connection.close()
+
+
+def test_export_query_postgres(source, tmp_path):
+    """Server-side cursors export the rows, with or without ranges."""
+    psycopg2 = types.SimpleNamespace(
+        connect=lambda dsn: _Connection(source["database"])
+    )
+    postgres = {
+        **source,
+        "driver": "postgres",
+        "dsn": "postgresql://user@db/houses",
+        "partition_col": "id",
+    }
+    with patch.dict("sys.modules", {"psycopg2": psycopg2}):
+        digest = db_source.export_query(postgres, str(tmp_path / "single.csv"))
+        ranged_digest = db_source.export_query(
+            {**postgres, "partitions": 3}, str(tmp_path / "ranged.csv")
+        )
+
+    with sqlite3.connect(source["database"]) as connection:
+        expected = pd.read_sql_query(
+            f"{source['query']} ORDER BY id IS NULL, id", connection
+        )
+    pd.testing.assert_frame_equal(
+        pd.read_csv(tmp_path / "single.csv"), expected
+    )
+    # Same rows in the same order, so the same digest
+    assert (tmp_path / "ranged.csv").read_bytes() == (
+        tmp_path / "single.csv"
+    ).read_bytes()
+    assert ranged_digest == digest
+
+
+def test_export_query_more_partitions_than_keys(source, tmp_path):
+    """No empty range is queried when the keys span fewer partitions."""
+    with sqlite3.connect(tmp_path / "small.db") as connection:
+        pd.DataFrame({"id": [0, 1, 1, 3], "price": [1, 2, 3, 4]}).to_sql(
+            "houses", connection, index=False
+        )
+    small = {
+        **source,
+        "database": str(tmp_path / "small.db"),
+        "query": "SELECT * FROM houses",
+        "partition_col": "id",
+        "partitions": 8,
+    }
+
+    ranges = db_source._key_ranges(small)
+    db_source.export_query(small, str(tmp_path / "small.csv"))
+
+    assert ranges == [(0, 1), (1, 2), (2, 3)]
+    assert pd.read_csv(tmp_path / "small.csv")["price"].tolist() == [
+        1,
+        2,
+        3,
+        4,
+    ]
+    single = {**small, "database": str(tmp_path / "single.db")}
+    with sqlite3.connect(single["database"]) as connection:
+        pd.DataFrame({"id": [5, 5], "price": [1, 2]}).to_sql(
+            "houses", connection, index=False
+        )
+    assert db_source._key_ranges(single) == [(5, 5)]
+
+
+def test_unknown_driver(source, tmp_path):
+    """An unknown database driver is rejected."""
+    with pytest.raises(ValueError):
+        db_source.export_query(
+            {**source, "driver": "oracle"}, str(tmp_path / "houses.csv")
+        )
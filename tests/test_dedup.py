@@ -0,0 +1,80 @@
+"""Unit test for the deduplication."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.dedup import Deduplicator, drop_duplicates
+
+
+@pytest.fixture
+def df():
+    """Rows repeated far apart, with gaps and signed zeros."""
+    rng = np.random.default_rng(0)
+    n_rows = 5000
+    df = pd.DataFrame(
+        {
+            "area": rng.integers(0, 20, n_rows).astype(float),
+            "mainroad": rng.choice(["yes", "no", None], n_rows),
+            "bedrooms": rng.integers(0, 5, n_rows),
+        }
+    )
+    df.loc[::11, "area"] = np.nan
+    df.loc[::13, "area"] = -0.0
+    return df
+
+
+@pytest.mark.parametrize("memory_budget_bytes", [2**30, 2400, 240])
+def test_keeps_first_occurrences(df, tmp_path, memory_budget_bytes):
+    """Same rows as `drop_duplicates`, whether the hashes spill or not."""
+    with Deduplicator(
+        memory_budget_bytes, partitions=4, tmp_dir=str(tmp_path)
+    ) as dedup:
+        for start in range(0, len(df), 333):
+            stop = start + 333
+            dedup.add(df.iloc[start:stop])
+        dedup.finish()
+        keep = np.concatenate(list(dedup.keep_masks()))
+
+    expected = df.drop_duplicates()
+    pd.testing.assert_frame_equal(df[keep], expected)
+    assert dedup.duplicates == len(df) - len(expected)
+    assert dedup.spilled == (memory_budget_bytes < 2**30)
+    # The spilled hashes are removed
+    assert not list(tmp_path.iterdir())
+
+
+def test_drop_duplicates_across_dtypes():
+    """A row read as int in a chunk and float in another is the same."""
+    df = pd.DataFrame({"a": [1.0, 2.0, 1.0, 3.0], "b": ["x", "y", "x", "x"]})
+    pd.testing.assert_frame_equal(
+        drop_duplicates(df, 2**20, chunk_rows=1), df.iloc[[0, 1, 3]]
+    )
+
+    with Deduplicator(2**20) as dedup:
+        dedup.add(pd.DataFrame({"a": [1, 2]}))
+        dedup.add(pd.DataFrame({"a": [2.0, 3.0]}))
+        dedup.finish()
+        assert [mask.tolist() for mask in dedup.keep_masks()] == [
+            [True, True],
+            [False, True],
+        ]
+
+
+def test_drop_duplicates_large_integers():
+    """Integers above 2**53 are not rounded to the same float."""
+    ids = [2**53, 2**53 + 1, 2**62 + 1, 2**62 + 1]
+    df = pd.DataFrame({"id": ids, "b": ["x"] * 4})
+    pd.testing.assert_frame_equal(
+        drop_duplicates(df, 2**20, chunk_rows=2), df.iloc[[0, 1, 2]]
+    )
+
+    # Integral floats of another chunk still match the integers
+    with Deduplicator(2**20) as dedup:
+        dedup.add(pd.DataFrame({"a": [2**53 + 1, 7]}))
+        dedup.add(pd.DataFrame({"a": [2.0**53, 7.0, np.nan]}))
+        dedup.finish()
+        assert [mask.tolist() for mask in dedup.keep_masks()] == [
+            [True, True],
+            [True, False, True],
+        ]
@@ -0,0 +1,122 @@
+"""Unit test for the streaming imputation statistics."""
+
+import numpy as np
+import pandas as pd
+
+from src.imputation_stats import (
+    CategoricalSketch,
+    ImputationStats,
+    NumericSketch,
+)
+
+
+def test_numeric_sketch_median_matches_numpy():
+    """Chunked and merged counts give the exact median."""
+    values = pd.Series(np.random.default_rng(0).integers(0, 50, 1001))
+    values[::7] = np.nan
+
+    sketch, other = NumericSketch(), NumericSketch()
+    sketch.update(values[:300])
+    other.update(values[300:700])
+    sketch.merge(other)
+    sketch.update(values[700:])
+
+    assert sketch.exact
+    assert sketch.count == values.notna().sum()
+    assert sketch.median() == np.nanmedian(values)
+    # Even number of values uses the mean of the middle ones
+    even = NumericSketch()
+    even.update(pd.Series([1.0, 2.0, 4.0, 10.0]))
+    assert even.median() == 3.0
+
+
+def test_numeric_sketch_quantiles_match_numpy():
+    """Quantiles of chunked counts are numpy's lower quantiles."""
+    values = pd.Series(np.random.default_rng(1).integers(0, 500, 3001))
+    sketch = NumericSketch()
+    for _, chunk in values.groupby(values.index // 800):
+        sketch.update(chunk)
+    qs = np.linspace(0, 1, 11)
+    np.testing.assert_array_equal(
+        sketch.quantiles(qs), np.quantile(values, qs, method="lower")
+    )
+    assert np.isnan(NumericSketch().quantiles([0.5])).all()
+
+
+def test_numeric_sketch_compacts():
+    """Too many distinct values are rounded to an approximate median."""
+    values = pd.Series(np.random.default_rng(0).normal(100, 10, 10_000))
+    sketch = NumericSketch(max_distinct=100)
+    for _, chunk in values.groupby(values.index // 1000):
+        sketch.update(chunk)
+
+    assert not sketch.exact
+    assert len(sketch.counts) <= 100
+    assert abs(sketch.median() - values.median()) < 1
+
+
+def test_categorical_sketch_ties_use_smallest_value():
+    """The most frequent value is the smallest one on ties."""
+    sketch = CategoricalSketch()
+    sketch.update(pd.Series(["yes", "no", None]))
+    sketch.update(pd.Series(["no", "yes", "maybe"]))
+
+    assert sketch.most_frequent() == "no"
+    assert CategoricalSketch().most_frequent() is np.nan
+
+
+def test_categorical_sketch_counts_category_codes():
+    """Category columns count like their values, unused categories aside."""
+    values = pd.Series(["b", "a", None, "b", "c"])
+    categories = values.astype(pd.CategoricalDtype(["a", "b", "c", "unused"]))
+    sketch = CategoricalSketch()
+    sketch.update(categories)
+    expected = CategoricalSketch()
+    expected.update(values)
+
+    pd.testing.assert_series_equal(
+        sketch.counts.sort_index(), expected.counts.sort_index()
+    )
+    assert sketch.most_frequent() == "b"
+
+
+def test_imputation_stats_save_and_load(tmp_path):
+    """Saved statistics impute and merge like the fitted ones."""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "area": rng.normal(100, 10, 1000),
+            "mainroad": rng.choice(["yes", "no"], 1000),
+        }
+    )
+    df = df.mask(rng.random(df.shape) < 0.1)
+    stats = ImputationStats(["area"], ["mainroad"], max_distinct=None)
+    stats.update(df)
+    stats.save(str(tmp_path / "stats.json"))
+    loaded = ImputationStats.load(str(tmp_path / "stats.json"))
+
+    assert loaded.medians() == stats.medians() == {"area": df["area"].median()}
+    assert loaded.modes() == stats.modes()
+    imputed = loaded.impute(df)
+    assert not imputed.isna().any().any()
+    assert df.isna().any().all()
+
+    # Updated with new rows without the rows seen before
+    other = ImputationStats(["area"], ["mainroad"])
+    other.update(df.iloc[:10])
+    loaded.merge(other)
+    assert loaded.numeric["area"].count == df["area"].count() + 9
+
+
+def test_numeric_sketch_to_dict_compacts():
+    """Saved counts are compacted, but keep the median of the exact ones."""
+    values = pd.Series(np.random.default_rng(0).normal(100, 10, 1000))
+    sketch = NumericSketch(max_distinct=None)
+    sketch.update(values)
+    data = sketch.to_dict(max_distinct=100)
+    loaded = NumericSketch.from_dict(data)
+
+    assert data["median"] == values.median()
+    assert len(loaded.counts) <= 100
+    assert not loaded.exact
+    assert loaded.count == 1000
@@ -0,0 +1,229 @@
+"""Unit test for the incremental ingestion."""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from dvc.api import DVCFileSystem
+from dvc.repo import Repo as DvcRepo
+from git import Repo
+
+from src.data_cleansing import clean_data
+from src.imputation_stats import ImputationStats
+from src.incremental import ingest_increment, load_state, restore_state
+
+
+def make_rows(start, count):
+    """Raw rows with a few missing values."""
+    rng = np.random.default_rng(start)
+    return pd.DataFrame(
+        {
+            "price": rng.integers(1_000_000, 9_000_000, count),
+            "area": rng.integers(1000, 9000, count).astype(float),
+            "mainroad": rng.choice(["Yes", "no"], count),
+        }
+    )
+
+
+@pytest.fixture
+def config(tmp_path):
+    """Incremental ingestion config."""
+    return {
+        "data_split": {
+            "raw_data_save_path": str(tmp_path / "raw_data.csv"),
+            "cleansed_data_save_path": str(tmp_path / "cleansed_data.csv"),
+            "train_data_save_path": str(tmp_path / "train_data.csv"),
+            "val_data_save_path": str(tmp_path / "val_data.csv"),
+            "test_data_save_path": str(tmp_path / "test_data.csv"),
+            "digests_path": str(tmp_path / "artefact_digests.json"),
+            "imputation_stats_path": str(tmp_path / "imputation_stats.json"),
+            "seed": 42,
+            "test_frac": 0.2,
+            "val_frac": 0.2,
+            "label_col": "price",
+            "categorical_cols": ["mainroad"],
+            "numeric_cols": ["area"],
+            "split_key_cols": ["price", "area", "mainroad"],
+        },
+        "incremental": {
+            "enabled": True,
+            "state_dir": str(tmp_path / "ingestion_state"),
+        },
+    }
+
+
+def read_split(tmp_path, split):
+    """Read all the partitions of a split."""
+    paths = sorted((tmp_path / f"{split}_data").glob("part-*.csv"))
+    return pd.concat([pd.read_csv(path) for path in paths])
+
+
+def test_ingest_increment_appends_partitions(config, tmp_path):
+    """Appended rows are written as new partitions, old ones untouched."""
+    first = make_rows(0, 300)
+    first.to_csv(tmp_path / "raw_data.csv", index=False)
+    ingest_increment(config)
+    train_partition = tmp_path / "train_data" / "part-00000.csv"
+    first_train = train_partition.read_bytes()
+    first_members = {
+        split: set(read_split(tmp_path, split)["Unnamed: 0"])
+        for split in ("train", "val", "test")
+    }
+
+    # New rows, one duplicating an ingested row
+    appended = pd.concat([make_rows(1, 100), first.iloc[[5]]])
+    appended.to_csv(
+        tmp_path / "raw_data.csv", index=False, header=False, mode="a"
+    )
+    ingest_increment(config)
+
+    assert train_partition.read_bytes() == first_train
+    assert (tmp_path / "train_data" / "part-00001.csv").exists()
+    state, hashes = load_state(config["incremental"]["state_dir"])
+    assert state["rows"] == 401
+    assert state["partitions"] == 2
+    assert len(hashes) == 400
+
+    splits = {
+        split: read_split(tmp_path, split)
+        for split in ("train", "val", "test")
+    }
+    assert sum(len(split) for split in splits.values()) == 400
+    # The rows ingested first kept their split, the duplicate was dropped
+    for split, members in first_members.items():
+        rows = set(splits[split]["Unnamed: 0"])
+        assert members <= rows
+        assert 400 not in rows
+    assert list(splits["train"].columns) == [
+        "Unnamed: 0",
+        "area",
+        "mainroad",
+        "price",
+    ]
+
+
+def test_ingest_increment_no_new_rows(config, tmp_path):
+    """A run without new rows doesn't write a partition."""
+    make_rows(0, 50).to_csv(tmp_path / "raw_data.csv", index=False)
+    ingest_increment(config)
+    ingest_increment(config)
+
+    state, _ = load_state(config["incremental"]["state_dir"])
+    assert state["partitions"] == 1
+    assert not (tmp_path / "train_data" / "part-00001.csv").exists()
+
+
+def test_ingest_increment_rebuilds_changed_data(config, tmp_path):
+    """Data changed in place is rebuilt as a single partition."""
+    make_rows(0, 50).to_csv(tmp_path / "raw_data.csv", index=False)
+    ingest_increment(config)
+    make_rows(1, 80).to_csv(tmp_path / "raw_data.csv", index=False)
+    ingest_increment(config)
+
+    state, hashes = load_state(config["incremental"]["state_dir"])
+    assert state["rows"] == 80
+    assert state["partitions"] == 1
+    assert len(hashes) == 80
+    assert (
+        sum(
+            len(read_split(tmp_path, split))
+            for split in ("train", "val", "test")
+        )
+        == 80
+    )
+
+
+def test_ingest_increment_updates_imputation_stats(config, tmp_path):
+    """The statistics are updated with the new rows, as if refitted."""
+    first = make_rows(0, 300)
+    first.loc[::10, "area"] = np.nan
+    first.to_csv(tmp_path / "raw_data.csv", index=False)
+    ingest_increment(config)
+    stats_path = config["data_split"]["imputation_stats_path"]
+    first_stats = ImputationStats.load(stats_path)
+
+    appended = make_rows(1, 100) * [1, 2, 1]
+    appended.loc[::5, "area"] = np.nan
+    appended.to_csv(
+        tmp_path / "raw_data.csv", index=False, header=False, mode="a"
+    )
+    ingest_increment(config)
+    stats = ImputationStats.load(stats_path)
+    assert stats.medians() != first_stats.medians()
+    # The appended gaps are imputed with the median of all the rows
+    partitions = tmp_path.glob("*_data/part-00001.csv")
+    delta = pd.concat([pd.read_csv(path) for path in partitions])
+    assert (delta["area"] == stats.medians()["area"]).sum() == 20
+
+    clean_data(config)
+    pd.testing.assert_series_equal(
+        stats.numeric["area"].counts,
+        ImputationStats.load(stats_path).numeric["area"].counts,
+    )
+
+
+def test_restore_state_from_clean_workspaces(config, tmp_path, monkeypatch):
+    """A clean workspace ingests only the rows after the tagged version."""
+    origin = tmp_path / "origin"
+    remote = tmp_path / "remote"
+    origin.mkdir()
+    git_repo = Repo.init(origin)
+    git_repo.git.config("user.email", "test@example.com")
+    git_repo.git.config("user.name", "test")
+    # Initialised without git, then opened in the git repo
+    DvcRepo.init(str(origin), no_scm=True).close()
+    with DvcRepo(str(origin)) as dvc_repo:
+        with dvc_repo.config.edit() as dvc_config:
+            del dvc_config["core"]["no_scm"]
+            dvc_config["remote"]["storage"] = {"url": str(remote)}
+    # The data paths relative to the workspace, as in the repo
+    relative_config = {
+        "data_split": {
+            key: (
+                os.path.relpath(value, tmp_path)
+                if key.endswith("_path")
+                else value
+            )
+            for key, value in config["data_split"].items()
+        },
+        "incremental": {"enabled": True, "state_dir": "ingestion_state"},
+    }
+    outputs = ["train_data", "val_data", "test_data", "ingestion_state"]
+    first = make_rows(0, 300)
+    appended = make_rows(1, 100)
+
+    # First run, tagged as the latest data version
+    monkeypatch.chdir(tmp_path / "origin")
+    first.to_csv("raw_data.csv", index=False)
+    ingest_increment(relative_config)
+    first_train = (origin / "train_data" / "part-00000.csv").read_bytes()
+    with DvcRepo(str(origin)) as dvc_repo:
+        dvc_repo.add(outputs + ["imputation_stats.json"])
+        dvc_repo.push(remote="storage")
+    git_repo.git.add("--all", "--", ":!raw_data.csv", ":!*digests.json")
+    git_repo.index.commit("data")
+    git_repo.create_tag("data-latest")
+
+    # Second run, in a clean workspace with the appended raw rows
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    monkeypatch.chdir(workspace)
+    pd.concat([first, appended]).to_csv("raw_data.csv", index=False)
+    fs = DVCFileSystem(
+        str(origin),
+        rev="data-latest",
+        remote="storage",
+        remote_config={"url": str(remote)},
+    )
+    assert restore_state(relative_config, fs)
+    assert not restore_state(relative_config, fs)
+    ingest_increment(relative_config)
+
+    train = workspace / "train_data"
+    assert (train / "part-00000.csv").read_bytes() == first_train
+    assert (train / "part-00001.csv").exists()
+    state, hashes = load_state("ingestion_state")
+    assert state["rows"] == 400
+    assert state["partitions"] == 2
+    assert len(hashes) == 400
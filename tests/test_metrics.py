@@ -0,0 +1,82 @@
+"""Unit test for the stage metrics."""
+
+import json
+import pstats
+
+import numpy as np
+import pytest
+
+from src import metrics
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    """Don't leave the outputs configured for the other tests."""
+    yield
+    metrics.configure({})
+
+
+@pytest.fixture
+def config(tmp_path):
+    """Metrics config writing every output."""
+    return {
+        "metrics": {
+            "report_path": str(tmp_path / "run_report.json"),
+            "prometheus_path": str(tmp_path / "metrics.prom"),
+            "profile_dir": str(tmp_path / "profiles"),
+        }
+    }
+
+
+def test_stage_metrics(config, tmp_path):
+    """Stages are measured, with the counts recorded by their code."""
+    metrics.configure(config)
+    with metrics.stage("cleansing"):
+        metrics.record(rows_in=10)
+        metrics.record(rows_in=5, rows_out=12)
+        with metrics.stage("inner step"):
+            block = np.ones(2**24)
+            (tmp_path / "out.bin").write_bytes(block.tobytes()[: 2**20])
+            del block
+    stages = metrics.write_report()
+
+    inner, outer = stages
+    assert inner["stage"] == "inner step"
+    assert outer["rows_in"] == 15
+    assert outer["rows_out"] == 12
+    assert "rows_in" not in inner
+    assert outer["status"] == "succeeded"
+    assert outer["wall_seconds"] >= inner["wall_seconds"] > 0
+    assert inner["cpu_seconds"] >= 0
+    # The 128 MiB array was allocated within both stages
+    assert outer["peak_rss_bytes"] >= inner["peak_rss_bytes"] > 2**27
+    assert inner["bytes_written"] >= 2**20
+    report = json.loads((tmp_path / "run_report.json").read_text())
+    assert report["stages"] == stages
+
+
+def test_failed_stage_and_outputs(config, tmp_path):
+    """A failed stage is reported, in json and the Prometheus format."""
+    metrics.configure(config)
+    with pytest.raises(ValueError):
+        with metrics.stage("DVC push"):
+            metrics.record(bytes_uploaded=100)
+            raise ValueError("remote unavailable")
+    (stage,) = metrics.write_report()
+
+    assert stage["status"] == "failed"
+    prometheus = (tmp_path / "metrics.prom").read_text().splitlines()
+    assert "# TYPE data_ingestion_stage_bytes_uploaded gauge" in prometheus
+    assert 'data_ingestion_stage_bytes_uploaded{stage="DVC push"} 100' in (
+        prometheus
+    )
+    # Only the top level stages are profiled
+    stats = pstats.Stats(str(tmp_path / "profiles" / "dvc_push.prof"))
+    assert stats.total_calls > 0
+
+
+def test_record_outside_stage():
+    """Counts recorded outside of a stage are ignored."""
+    metrics.configure({})
+    metrics.record(rows_in=1)
+    assert metrics.write_report() == []
@@ -0,0 +1,129 @@
+"""Unit test for the stage cache."""
+
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import data_cleansing
+from src.main import run_cached_stages
+from src.stage_cache import StageCache, run_stage
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in a temporary directory."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_run_stage_skips_unchanged_inputs(workdir):
+    """A stage only runs again when its inputs or parameters change."""
+    cache = StageCache("cache", 2**20, 8)
+    (workdir / "in.txt").write_text("a")
+    func = MagicMock(side_effect=lambda: (workdir / "out.txt").write_text("b"))
+
+    def run(params):
+        return run_stage(cache, "stage", func, ["in.txt"], params, ["out.txt"])
+
+    assert run({"frac": 0.2})
+    assert not run({"frac": 0.2})
+    assert run({"frac": 0.3})
+    (workdir / "in.txt").write_text("c")
+    assert run({"frac": 0.3})
+    assert func.call_count == 3
+
+    # A removed output is restored, a new cache instance reloads the index
+    (workdir / "out.txt").unlink()
+    cache = StageCache("cache", 2**20, 8)
+    assert not run({"frac": 0.3})
+    assert (workdir / "out.txt").read_text() == "b"
+    assert func.call_count == 3
+
+
+def test_evicts_least_recently_used(workdir):
+    """Entries past the size or count limits are evicted, oldest first."""
+    cache = StageCache("cache", 25, 2)
+    (workdir / "in.txt").write_text("a")
+
+    def run(value, size=10):
+        def func():
+            (workdir / "out.txt").write_text(value * size)
+
+        return run_stage(
+            cache, "stage", func, ["in.txt"], {"v": value}, ["out.txt"]
+        )
+
+    assert run("a")
+    assert run("b")
+    # "a" is used again, so "b" is the least recently used
+    assert not run("a")
+    assert run("c")
+    assert not run("a")
+    assert run("b")
+    assert len(cache.index["entries"]) == 2
+    # Evicts both others to fit the size limit
+    assert run("d", size=20)
+    assert list(cache.index["entries"].values())[0]["bytes"] == 20
+    assert len(list((workdir / "cache").iterdir())) == 2
+    # Too large to be cached at all
+    assert run("e", size=30)
+    assert run("e", size=30)
+
+
+@patch("src.main.push_data")
+def test_only_changed_stages_run(mock_push_data, workdir):
+    """Changing the split fractions only re-runs the split and push."""
+    rng = np.random.default_rng(0)
+    pd.DataFrame(
+        {
+            "price": rng.integers(1_000, 9_000, 200),
+            "area": rng.random(200),
+            "mainroad": rng.choice(["yes", "no"], 200),
+        }
+    ).to_csv(workdir / "raw_data.csv", index=False)
+    config = {
+        "data_split": {
+            "raw_data_save_path": "raw_data.csv",
+            "cleansed_data_save_path": "cleansed_data.csv",
+            "train_data_save_path": "train_data.csv",
+            "val_data_save_path": "val_data.csv",
+            "test_data_save_path": "test_data.csv",
+            "digests_path": "digests.json",
+            "imputation_stats_path": "imputation_stats.json",
+            "label_col": "price",
+            "categorical_cols": ["mainroad"],
+            "numeric_cols": ["area"],
+            "seed": 42,
+            "test_frac": 0.2,
+            "val_frac": 0.2,
+        },
+        **{
+            key: "x"
+            for key in (
+                "dvc_remote",
+                "dvc_remote_name",
+                "dvc_endpoint_url",
+                "git_repo_url",
+                "git_branch",
+                "commit_message",
+            )
+        },
+    }
+    cache = StageCache("cache", 2**30, 16)
+
+    with patch(
+        "src.main.clean_data", wraps=data_cleansing.clean_data
+    ) as mock_clean_data:
+        run_cached_stages(config, cache)
+        run_cached_stages(config, cache)
+        assert mock_clean_data.call_count == 1
+        assert mock_push_data.call_count == 1
+
+        config["data_split"]["val_frac"] = 0.25
+        run_cached_stages(config, cache)
+        assert mock_clean_data.call_count == 1
+        assert mock_push_data.call_count == 2
+
+    assert len(pd.read_csv("val_data.csv")) == 40